@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares the size of an XMP sidecar and the time needed to read its
+annotations when they are stored in each format of
+``qidata._mixin.ANNOTATION_FORMATS``, and checks that all formats give the
+same annotations.
+
+Usage: python benchmarks/annotation_formats.py [annotation_count [repeat]]
+"""
+
+# Standard libraries
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+# Third-party libraries
+from xmp.xmp import XMPFile
+
+# Local modules
+from qidata import _mixin as xmp_tools
+from qidata.metadata_objects import Property
+from qidata.qidataimagefile import QiDataImageFile
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           "..", "tests", "data")
+
+def makeImage(folder, name, annotation_count, annotation_format):
+	"""
+	Create an annotated image in ``folder`` and return its sidecar's path
+	"""
+	image_path = os.path.join(folder, name)
+	shutil.copyfile(os.path.join(DATA_FOLDER, "JPG_with_external_annotations.jpg"),
+	                image_path)
+	with QiDataImageFile(image_path, "w") as _f:
+		_f.convertAnnotations(annotation_format)
+		for i in range(annotation_count):
+			_f.addAnnotation(
+			  "annotator%d"%(i%5),
+			  Property("key%d"%i, "value%d"%i),
+			  [[i, i], [i+10, i+10]]
+			)
+	return image_path + ".xmp"
+
+def readAnnotations(xmp_path):
+	with XMPFile(xmp_path) as _f:
+		return xmp_tools._load_annotations(_f)
+
+def main(annotation_count=500, repeat=20):
+	folder = tempfile.mkdtemp()
+	try:
+		paths = dict()
+		for annotation_format in xmp_tools.ANNOTATION_FORMATS:
+			paths[annotation_format] = makeImage(
+			                             folder,
+			                             annotation_format + ".jpg",
+			                             annotation_count,
+			                             annotation_format
+			                           )
+		reference = readAnnotations(paths["xmp"])
+		for annotation_format, xmp_path in paths.iteritems():
+			if readAnnotations(xmp_path) != reference:
+				print "Annotations stored in %s differ"%annotation_format
+				return 1
+
+		print "%d annotations, best of %d reads"%(annotation_count, repeat)
+		for annotation_format in xmp_tools.ANNOTATION_FORMATS:
+			xmp_path = paths[annotation_format]
+			duration = min(
+			  timeit.repeat(lambda: readAnnotations(xmp_path),
+			                number=1,
+			                repeat=repeat)
+			)
+			print "%-8s %8.2f ms %10d bytes"%(
+			  annotation_format,
+			  1000*duration,
+			  os.path.getsize(xmp_path)
+			)
+		return 0
+	finally:
+		shutil.rmtree(folder)
+
+if __name__ == "__main__":
+	sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares the time needed to find the annotations under a point of an image
+with ``QiDataImageFile.queryPoint`` and with a scan of ``getAnnotations``.
+
+Usage: python benchmarks/spatial_queries.py [annotation_count [query_count]]
+"""
+
+# Standard libraries
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Local modules
+from qidata.metadata_objects import Property
+from qidata.qidataimagefile import QiDataImageFile
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           "..", "tests", "data")
+
+def scanPoint(image, x, y):
+	"""
+	Find the annotations containing a point by going through all of them
+	"""
+	return [
+	  annotation
+	    for annotation in image.getAnnotations("jdoe")
+	      if annotation[1] is not None
+	         and min(annotation[1][0][0], annotation[1][1][0]) <= x
+	         and x <= max(annotation[1][0][0], annotation[1][1][0])
+	         and min(annotation[1][0][1], annotation[1][1][1]) <= y
+	         and y <= max(annotation[1][0][1], annotation[1][1][1])
+	]
+
+def main(annotation_count=5000, query_count=1000):
+	folder = tempfile.mkdtemp()
+	try:
+		image_path = os.path.join(folder, "image.jpg")
+		shutil.copyfile(os.path.join(DATA_FOLDER, "SpringNebula.jpg"), image_path)
+		random.seed(0)
+		points = [(random.randint(0, 2000), random.randint(0, 2000))
+		            for i in range(query_count)]
+		with QiDataImageFile(image_path, "w") as _f:
+			for i in range(annotation_count):
+				x, y = random.randint(0, 2000), random.randint(0, 2000)
+				_f.addAnnotation(
+				  "jdoe",
+				  Property("key%d"%i, "value"),
+				  [[x, y], [x+random.randint(5, 80), y+random.randint(5, 80)]]
+				)
+
+			start = time.time()
+			_f.queryPoint(0, 0)
+			build = time.time() - start
+
+			start = time.time()
+			indexed = [len(_f.queryPoint(x, y)) for x, y in points]
+			query = time.time() - start
+
+			start = time.time()
+			scanned = [len(scanPoint(_f, x, y)) for x, y in points]
+			scan = time.time() - start
+
+			_f.cancelChanges()
+
+		if indexed != scanned:
+			print "Index and scan give different results"
+			return 1
+		print "%d annotations, %d point queries"%(annotation_count, query_count)
+		print "index build %8.2f ms"%(1000*build)
+		print "queryPoint  %8.3f ms/query"%(1000*query/query_count)
+		print "scan        %8.3f ms/query"%(1000*scan/query_count)
+		return 0
+	finally:
+		shutil.rmtree(folder)
+
+if __name__ == "__main__":
+	sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -228,3 +228,8 @@ def open(file_path, mode="r"):
 			return _LOOKUP_ITEM_MODEL[pattern](file_path, mode)
 
 	raise TypeError("Data type not supported by QiDataFile")
+
+# ──────────────────
+# Background opening
+
+from _background import openAsync, AsyncQiDataSet
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Optional SQLite index of the annotations contained in a dataset.
+
+The index holds one row per annotation (file, annotator, metadata type,
+flattened attributes and location). It allows to search a dataset's
+annotations without opening every annotated file.
+"""
+
+# Standard libraries
+import collections
+import json
+import os
+import sqlite3
+
+INDEX_FILENAME = "metadata.index"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    annotator TEXT NOT NULL,
+    metadata_type TEXT NOT NULL,
+    attributes TEXT NOT NULL,
+    location TEXT
+);
+CREATE TABLE IF NOT EXISTS attributes (
+    annotation_id INTEGER NOT NULL
+        REFERENCES annotations(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS annotations_file ON annotations(file);
+CREATE INDEX IF NOT EXISTS annotations_key
+    ON annotations(annotator, metadata_type);
+CREATE INDEX IF NOT EXISTS attributes_key ON attributes(name, value);
+CREATE INDEX IF NOT EXISTS attributes_annotation ON attributes(annotation_id);
+"""
+
+def _flatten(value, prefix="", out=None):
+	"""
+	Flatten a metadata object into a dict of dotted names and unicode values
+
+	:param value: MetadataObject (or any nested value) to flatten
+	:param prefix: Name of ``value`` in its parent, ending with a "."
+	:type prefix: str
+	:return: Flattened attributes
+	:rtype: dict
+
+	:Example:
+
+		>>> _flatten(Property("key", "value"))
+		{"key": u"key", "value": u"value"}
+	"""
+	if out is None:
+		out = dict()
+	if isinstance(value, collections.Mapping):
+		for key in value:
+			_flatten(value[key], prefix + str(key) + ".", out)
+	elif isinstance(value, (list, tuple)):
+		for i in range(len(value)):
+			_flatten(value[i], prefix + "%d."%i, out)
+	else:
+		out[prefix[:-1]] = unicode(value)
+	return out
+
+def annotationRows(annotations):
+	"""
+	Convert annotations into rows ready to be stored in the index
+
+	:param annotations: Annotations as returned by ``_load_annotations``
+	:type annotations: collections.OrderedDict
+	:return: List of (annotator, metadata type, attributes, location) tuples
+	:rtype: list
+	"""
+	rows = []
+	for annotator, typed_annotations in annotations.iteritems():
+		for metadata_type, annotation_list in typed_annotations.iteritems():
+			for annotation, location in annotation_list:
+				rows.append(
+				  (annotator, metadata_type, _flatten(annotation), location)
+				)
+	return rows
+
+def indexPath(folder_path):
+	"""
+	Return the path of the index of a dataset
+	"""
+	return os.path.join(folder_path, INDEX_FILENAME)
+
+def updateIndexOf(file_path, annotations):
+	"""
+	Update the index of the dataset containing ``file_path``, if any
+
+	:param file_path: Path of the data file whose annotations changed
+	:type file_path: str
+	:param annotations: The file's current annotations
+	:type annotations: collections.OrderedDict
+	"""
+	folder_path, name = os.path.split(os.path.abspath(file_path))
+	if not os.path.isfile(indexPath(folder_path)):
+		return
+	with AnnotationIndex(folder_path) as index:
+		index.setFileAnnotations(name, annotationRows(annotations))
+
+class AnnotationIndex(object):
+	"""
+	SQLite annotation index stored in a dataset folder
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, folder_path, read_only=False):
+		"""
+		Open (and create if needed) the index of a dataset
+
+		:param folder_path: Path of the dataset
+		:type folder_path: str
+		:param read_only: True to only search the index. It is then never
+		 created nor modified.
+		:type read_only: bool
+		:raises: IOError if ``read_only`` is True and there is no index
+		"""
+		path = indexPath(folder_path)
+		if read_only:
+			if not os.path.isfile(path):
+				raise IOError("%s has no annotation index"%folder_path)
+			# Python 2 cannot open SQLite URIs with "mode=ro": writing is
+			# forbidden on the connection instead
+			self._connection = sqlite3.connect(path)
+			self._connection.execute("PRAGMA query_only = ON")
+		else:
+			self._connection = sqlite3.connect(path)
+			self._connection.execute("PRAGMA foreign_keys = ON")
+			self._connection.executescript(_SCHEMA)
+
+	# ──────────
+	# Public API
+
+	def close(self):
+		"""
+		Close the index
+		"""
+		self._connection.close()
+
+	def query(self, annotator=None, metadata_type=None, attributes=None):
+		"""
+		Search for annotations
+
+		:param annotator: Only return annotations made by this annotator
+		:type annotator: str
+		:param metadata_type: Only return annotations of this type
+		:type metadata_type: str
+		:param attributes: Only return annotations whose attributes have the
+		 given values (nested attributes are named with dots, like
+		 "translation.x")
+		:type attributes: dict
+		:return: List of (file, annotator, metadata type, location) tuples
+		:rtype: list
+		"""
+		request = "SELECT a.file, a.annotator, a.metadata_type, a.location"
+		request += " FROM annotations AS a"
+		conditions = []
+		parameters = []
+		if annotator is not None:
+			conditions.append("a.annotator = ?")
+			parameters.append(annotator)
+		if metadata_type is not None:
+			conditions.append("a.metadata_type = ?")
+			parameters.append(str(metadata_type))
+		for name, value in (attributes or dict()).iteritems():
+			conditions.append(
+			  "EXISTS (SELECT 1 FROM attributes AS t WHERE "
+			  "t.annotation_id = a.id AND t.name = ? AND t.value = ?)"
+			)
+			parameters += [name, unicode(value)]
+		if conditions:
+			request += " WHERE " + " AND ".join(conditions)
+		request += " ORDER BY a.file, a.id"
+
+		return [
+		  (str(row[0]), row[1], str(row[2]), json.loads(row[3]))
+		    for row in self._connection.execute(request, parameters)
+		]
+
+	def removeOtherFiles(self, names):
+		"""
+		Remove the indexed annotations of the files not listed
+
+		:param names: Names of the files of the dataset
+		:type names: list
+		"""
+		names = set(names)
+		with self._connection:
+			gone = [
+			  (row[0],) for row in self._connection.execute(
+			    "SELECT DISTINCT file FROM annotations"
+			  ) if row[0] not in names
+			]
+			self._connection.executemany(
+			  "DELETE FROM annotations WHERE file = ?",
+			  gone
+			)
+
+	def setFileAnnotations(self, name, rows):
+		"""
+		Replace the indexed annotations of a file
+
+		:param name: Name of the file in the dataset
+		:type name: str
+		:param rows: Rows as returned by ``annotationRows``
+		:type rows: list
+		"""
+		with self._connection:
+			self._connection.execute(
+			  "DELETE FROM annotations WHERE file = ?",
+			  (name,)
+			)
+			for annotator, metadata_type, attributes, location in rows:
+				cursor = self._connection.execute(
+				  "INSERT INTO annotations"
+				  " (file, annotator, metadata_type, attributes, location)"
+				  " VALUES (?, ?, ?, ?, ?)",
+				  (
+				    name,
+				    annotator,
+				    metadata_type,
+				    json.dumps(attributes, sort_keys=True),
+				    json.dumps(location)
+				  )
+				)
+				self._connection.executemany(
+				  "INSERT INTO attributes (annotation_id, name, value)"
+				  " VALUES (?, ?, ?)",
+				  [
+				    (cursor.lastrowid, key, value)
+				      for key, value in attributes.iteritems()
+				  ]
+				)
+
+	# ───────────────
+	# Context Manager
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
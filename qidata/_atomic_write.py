@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Crash-safe writing of XMP files
+
+Metadata is written in a temporary copy of the XMP file, which then
+replaces the original with an atomic rename. An interrupted write thus
+never leaves a truncated file behind.
+"""
+
+# Standard libraries
+import contextlib
+import os
+import shutil
+import threading
+import uuid
+
+# Third-party libraries
+from xmp.xmp import XMPFile
+
+# Directories whose synchronization is deferred until the end of the current
+# ``groupCommit`` (None when there is none)
+_pending_directories = None
+_pending_lock = threading.Lock()
+
+# ───────
+# Helpers
+
+def _fsync(path):
+	"""
+	Flush a file or a directory to the disk
+	"""
+	fd = os.open(path, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+def _syncDirectory(directory):
+	"""
+	Flush a directory entries to the disk, so that renames are persisted
+	"""
+	try:
+		_fsync(directory)
+	except OSError:
+		# Directories cannot be opened on every platform
+		pass
+
+def _commitDirectory(directory):
+	"""
+	Synchronize a directory now, or at the end of the current group commit
+	"""
+	with _pending_lock:
+		if _pending_directories is not None:
+			_pending_directories.add(directory)
+			return
+	_syncDirectory(directory)
+
+def _temporaryPath(path):
+	"""
+	Return the directory of ``path`` and a temporary path next to it
+	"""
+	directory = os.path.dirname(os.path.abspath(path))
+	return (
+	  directory,
+	  os.path.join(
+	    directory,
+	    ".%s.%s"%(uuid.uuid4().hex, os.path.basename(path))
+	  )
+	)
+
+# ──────────
+# Public API
+
+@contextlib.contextmanager
+def groupCommit():
+	"""
+	Group the synchronizations of the directories written in the block
+
+	Each file is still written and renamed atomically, but each modified
+	directory is synchronized only once, when the outermost block ends.
+
+	:Example:
+		>>> with groupCommit():
+		>>>     for path in paths:
+		>>>         with qidata.open(path, "w") as f:
+		>>>             f.addAnnotation("jdoe", Property("key", "value"))
+	"""
+	global _pending_directories
+	with _pending_lock:
+		is_outermost = _pending_directories is None
+		if is_outermost:
+			_pending_directories = set()
+	try:
+		yield
+	finally:
+		if is_outermost:
+			with _pending_lock:
+				directories = _pending_directories
+				_pending_directories = None
+			for directory in directories:
+				_syncDirectory(directory)
+
+@contextlib.contextmanager
+def openForWriting(xmp_path, source_path=None):
+	"""
+	Open an XMP file for writing, so that it is atomically replaced
+
+	:param xmp_path: Path of the XMP file to write
+	:type xmp_path: str
+	:param source_path: Path of the file to copy the XMP metadata from, if it
+	 is not ``xmp_path`` (for instance when creating an external annotation
+	 file from a file's internal annotations)
+	:type source_path: str
+	:return: Context manager giving the XMP file to write in
+
+	.. note::
+
+		If an exception is raised while writing, ``xmp_path`` is left
+		untouched.
+	"""
+	directory, tmp_path = _temporaryPath(xmp_path)
+	try:
+		if source_path is not None and source_path != xmp_path:
+			with XMPFile(source_path, rw=False) as _source:
+				with XMPFile(tmp_path, rw=True) as _destination:
+					_destination.libxmp_metadata = _source.libxmp_metadata
+		elif os.path.exists(xmp_path):
+			shutil.copy(xmp_path, tmp_path)
+		with XMPFile(tmp_path, rw=True) as _xmp_file:
+			yield _xmp_file
+		_fsync(tmp_path)
+		os.rename(tmp_path, xmp_path)
+	finally:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+	_commitDirectory(directory)
+
+@contextlib.contextmanager
+def openFileForWriting(path):
+	"""
+	Open a regular file for writing, so that it is atomically replaced
+
+	:param path: Path of the file to write
+	:type path: str
+	:return: Context manager giving the file object to write in (the file
+	 starts empty)
+
+	.. note::
+
+		If an exception is raised while writing, ``path`` is left untouched.
+	"""
+	directory, tmp_path = _temporaryPath(path)
+	try:
+		with open(tmp_path, "w") as _f:
+			yield _f
+			_f.flush()
+			os.fsync(_f.fileno())
+		os.rename(tmp_path, path)
+	finally:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+	_commitDirectory(directory)
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Opening files and datasets without blocking the calling thread.
+
+Parsing XMP metadata and decoding images can take a while. Functions of this
+module run that work in a pool of threads and immediately return a
+``multiprocessing.pool.AsyncResult``, so that event loops (or UIs) are not
+blocked. The result can be waited for with ``get``, polled with ``ready``, or
+received by a callback.
+"""
+
+# Standard libraries
+from collections import deque
+import itertools
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+
+# Local modules
+import qidata
+
+MAX_CONCURRENT_OPENS = 4
+
+class BackgroundOpener(object):
+	"""
+	Runs blocking qidata operations in background threads
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, executor=None,
+	                   max_concurrent_opens=MAX_CONCURRENT_OPENS):
+		"""
+		Create an opener
+
+		:param executor: Thread pool running the blocking work (any object
+		 with the ``apply_async`` method of ``multiprocessing.pool.ThreadPool``).
+		 By default, a pool of ``max_concurrent_opens`` threads is created on
+		 first use.
+		:param max_concurrent_opens: Maximum number of operations running at
+		 the same time, whatever the size of the executor, so that the
+		 filesystem is not overwhelmed
+		:type max_concurrent_opens: int
+		"""
+		self._executor = executor
+		self._owns_executor = executor is None
+		self._max_concurrent_opens = max_concurrent_opens
+		self._slots = threading.BoundedSemaphore(max_concurrent_opens)
+		self._lock = threading.Lock()
+
+	# ──────────
+	# Properties
+
+	@property
+	def executor(self):
+		"""
+		Thread pool running the blocking work
+		"""
+		with self._lock:
+			if self._executor is None:
+				self._executor = ThreadPool(self._max_concurrent_opens)
+			return self._executor
+
+	# ──────────
+	# Public API
+
+	def close(self):
+		"""
+		Wait for pending operations and stop the threads created by the opener
+
+		.. note::
+
+			An executor given to the constructor is left untouched.
+		"""
+		with self._lock:
+			executor, self._executor = self._executor, None
+		if self._owns_executor and executor is not None:
+			executor.close()
+			executor.join()
+
+	def open(self, path, mode="r", callback=None):
+		"""
+		Open a file with ``qidata.open`` in background
+
+		:param path: Path of the file to open
+		:type path: str
+		:param mode: Opening mode ("r" or "w")
+		:type mode: str
+		:param callback: Function called with the opened file (in a
+		 background thread)
+		:return: Result giving the opened file
+		:rtype: multiprocessing.pool.AsyncResult
+		"""
+		return self.submit(qidata.open, (path, mode), callback)
+
+	def submit(self, function, args=(), callback=None):
+		"""
+		Run a blocking function in background
+
+		:param function: Function to run
+		:param args: Arguments of the function
+		:type args: tuple
+		:param callback: Function called with the returned value (in a
+		 background thread)
+		:return: Result giving the returned value
+		:rtype: multiprocessing.pool.AsyncResult
+		"""
+		return self.executor.apply_async(
+		         self._run,
+		         (function, args),
+		         callback=callback
+		       )
+
+	# ───────────
+	# Private API
+
+	def _run(self, function, args):
+		with self._slots:
+			return function(*args)
+
+_default_opener = BackgroundOpener()
+
+def configure(executor=None, max_concurrent_opens=MAX_CONCURRENT_OPENS):
+	"""
+	Replace the opener used by default by ``openAsync`` and ``AsyncQiDataSet``
+
+	:param executor: Thread pool running the blocking work (see
+	 ``BackgroundOpener``)
+	:param max_concurrent_opens: Maximum number of operations running at
+	 the same time
+	:type max_concurrent_opens: int
+	"""
+	global _default_opener
+	previous, _default_opener = _default_opener,\
+	                            BackgroundOpener(executor, max_concurrent_opens)
+	previous.close()
+
+def openAsync(path, mode="r", callback=None):
+	"""
+	Open a file with qidata, in background
+
+	:param path: Path of the file to open
+	:type path: str
+	:param mode: Opening mode ("r" or "w")
+	:type mode: str
+	:param callback: Function called with the opened file (in a background
+	 thread)
+	:return: Result giving the opened file
+	:rtype: multiprocessing.pool.AsyncResult
+
+	:Example:
+		>>> import qidata
+		>>> result = qidata.openAsync("path/to/file.png")
+		>>> # ... do something else ...
+		>>> with result.get() as f:
+		>>>     print f.annotators
+	"""
+	return _default_opener.open(path, mode, callback)
+
+class AsyncQiDataSet(object):
+	"""
+	QiDataSet whose blocking operations run in background
+
+	Opened children are owned by the caller, who must close them.
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, dataset, opener=None):
+		"""
+		Wrap an open dataset
+
+		:param dataset: Dataset to wrap
+		:type dataset: qidata.QiDataSet
+		:param opener: Opener running the blocking work (the default one if
+		 None, see ``configure``)
+		:type opener: BackgroundOpener
+		"""
+		self._dataset = dataset
+		self._opener = opener if opener is not None else _default_opener
+		# Children opened by the dataset share its cache
+		self._child_lock = threading.Lock()
+
+	@classmethod
+	def open(cls, folder_path, mode="r", opener=None, callback=None,
+	              **kwargs):
+		"""
+		Open a dataset in background
+
+		:param folder_path: Path of the dataset
+		:type folder_path: str
+		:param mode: Opening mode ("r" or "w")
+		:type mode: str
+		:param opener: Opener running the blocking work
+		:type opener: BackgroundOpener
+		:param callback: Function called with the opened ``AsyncQiDataSet``
+		 (in a background thread)
+		:param kwargs: Other arguments given to ``QiDataSet``
+		:return: Result giving the opened ``AsyncQiDataSet``
+		:rtype: multiprocessing.pool.AsyncResult
+		"""
+		opener = opener if opener is not None else _default_opener
+		def _open():
+			return cls(qidata.QiDataSet(folder_path, mode, **kwargs), opener)
+		return opener.submit(_open, callback=callback)
+
+	# ──────────
+	# Properties
+
+	@property
+	def dataset(self):
+		"""
+		The wrapped dataset
+		"""
+		return self._dataset
+
+	# ──────────
+	# Public API
+
+	def close(self, callback=None):
+		"""
+		Close the dataset in background
+
+		:return: Result giving None once the dataset is closed
+		:rtype: multiprocessing.pool.AsyncResult
+		"""
+		return self._opener.submit(self._dataset.close, callback=callback)
+
+	def iterChildren(self, names=None, mode="r", prefetch=4):
+		"""
+		Iterates over children being opened in background, in order
+
+		At most ``prefetch`` children after the current one are being opened.
+
+		:param names: Names of the children to open (all children by default)
+		:type names: list
+		:param mode: Opening mode of the children ("r" or "w")
+		:type mode: str
+		:param prefetch: Maximum number of children opened in advance
+		:type prefetch: int
+		:return: Generator of (name, result giving the opened child)
+		:raises: IOError if one of the names is not a child of the dataset
+		:raises: ReadOnlyException if mode is "w" but the dataset is not
+		"""
+		if mode == "w" and self._dataset.read_only:
+			raise qidata.ReadOnlyException(
+			        "Children cannot be opened in \"w\" mode"
+			      )
+		names = self._dataset.children if names is None else list(names)
+		for name in names:
+			if not self._dataset._isChild(name):
+				raise IOError("%s is not a child of the current dataset"%name)
+		return self._prefetch(
+		         [(name, name) for name in names],
+		         mode,
+		         max(0, prefetch)
+		       )
+
+	def iterStream(self, stream_name, mode="r", prefetch=4):
+		"""
+		Iterates over the files of a stream being opened in background, in
+		time order
+
+		:param stream_name: Data stream of interest
+		:type stream_name: str
+		:param mode: Opening mode of the files ("r" or "w")
+		:type mode: str
+		:param prefetch: Maximum number of files opened in advance
+		:type prefetch: int
+		:return: Generator of (timestamp, result giving the opened file)
+		:raises: KeyError if stream_name does not exist
+		:raises: ReadOnlyException if mode is "w" but the dataset is not
+		"""
+		if mode == "w" and self._dataset.read_only:
+			raise qidata.ReadOnlyException(
+			        "Children cannot be opened in \"w\" mode"
+			      )
+		return self._prefetch(
+		         list(self._dataset.iterStream(stream_name)),
+		         mode,
+		         max(0, prefetch)
+		       )
+
+	def openChild(self, name, callback=None):
+		"""
+		Open a child of the dataset in background (see
+		``QiDataSet.openChild``)
+
+		:param name: Name of the file to open
+		:type name: str
+		:param callback: Function called with the opened file (in a
+		 background thread)
+		:return: Result giving the opened file
+		:rtype: multiprocessing.pool.AsyncResult
+		"""
+		def _open():
+			with self._child_lock:
+				return self._dataset.openChild(name)
+		return self._opener.submit(_open, callback=callback)
+
+	# ───────────
+	# Private API
+
+	def _prefetch(self, entries, mode, prefetch):
+		"""
+		Generator behind ``iterChildren`` and ``iterStream``
+
+		:param entries: (key, file name) pairs, the keys being yielded with
+		 the results
+		:type entries: list
+
+		.. note::
+
+			If the iteration stops early, files already being opened are
+			closed once they are open.
+		"""
+		folder_path = self._dataset.name
+		entries = iter(entries)
+		pending = deque()
+		def _submit(count):
+			for key, name in itertools.islice(entries, count):
+				pending.append((
+				  key,
+				  self._opener.open(os.path.join(folder_path, name), mode)
+				))
+		try:
+			_submit(prefetch)
+			while True:
+				# Submit the file following the prefetched ones, which is the
+				# next one to yield when nothing is prefetched
+				_submit(1)
+				if not pending:
+					break
+				key, result = pending.popleft()
+				yield key, result
+		finally:
+			for _, result in pending:
+				try:
+					result.get().close()
+				except Exception:
+					pass
+
+	# ───────────────
+	# Context Manager
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close().get()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Bounded cache of the data files opened by a dataset.
+"""
+
+# Standard libraries
+from collections import OrderedDict
+import os
+
+# Local modules
+import _consolidated_store
+
+def _mtime(path):
+	"""
+	Return the modification time of ``path``, or None if it does not exist
+	"""
+	try:
+		return os.stat(path).st_mtime
+	except OSError:
+		return None
+
+def childSignature(path):
+	"""
+	Return what must not change for an open data file to stay valid
+
+	:param path: Path of the data file
+	:type path: str
+	:return: Modification times of the file, of its external annotation file
+	 and of its dataset's consolidated store
+	:rtype: tuple
+	"""
+	return (
+	  _mtime(path),
+	  _mtime(path + ".xmp"),
+	  _mtime(_consolidated_store.storePath(os.path.dirname(path)))
+	)
+
+class ChildCache(object):
+	"""
+	Least-recently-used cache of data files opened in "r" mode
+
+	Cached files are kept open: closing them (for instance when leaving a
+	``with`` block) does nothing. They are really closed when they leave
+	the cache. A cached file is dropped as soon as the file or its metadata
+	changes on disk.
+
+	.. note::
+		Files opened in "w" mode must not be cached: they would only be
+		written when leaving the cache, and could overwrite the changes made
+		on disk meanwhile.
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, capacity):
+		"""
+		Create an empty cache
+
+		:param capacity: Maximum number of files kept open (0 to disable the
+		 cache)
+		:type capacity: int
+		"""
+		self._capacity = capacity
+		self._entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	# ──────────
+	# Properties
+
+	@property
+	def statistics(self):
+		"""
+		Hits, misses and evictions since the cache was created, and number of
+		cached files
+		"""
+		return dict(
+		  hits=self.hits,
+		  misses=self.misses,
+		  evictions=self.evictions,
+		  size=len(self._entries)
+		)
+
+	# ──────────
+	# Public API
+
+	def clear(self):
+		"""
+		Close all cached files, from the least recently used one
+		"""
+		while self._entries:
+			_, (_, handle) = self._entries.popitem(last=False)
+			_release(handle)
+
+	def get(self, name, path, open_function):
+		"""
+		Return the cached file, or open it and cache it
+
+		:param name: Name of the file in its dataset
+		:type name: str
+		:param path: Path of the file
+		:type path: str
+		:param open_function: Function opening the file
+		:return: The open file
+		:rtype: qidata.qidatafile.QiDataFile
+		"""
+		if self._capacity <= 0:
+			return open_function()
+
+		signature = childSignature(path)
+		entry = self._entries.pop(name, None)
+		if entry is not None:
+			if entry[0] == signature and not entry[1].closed:
+				self.hits += 1
+				self._entries[name] = entry
+				return entry[1]
+			# Outdated, it is dropped before being opened again
+			_release(entry[1])
+
+		self.misses += 1
+		handle = open_function()
+		assert(handle.read_only)
+		handle._cached = True
+		self._entries[name] = (signature, handle)
+		while len(self._entries) > self._capacity:
+			_, (_, evicted) = self._entries.popitem(last=False)
+			_release(evicted)
+			self.evictions += 1
+		return handle
+
+def _release(handle):
+	"""
+	Really close a file leaving the cache
+	"""
+	handle._cached = False
+	if not handle.closed:
+		handle.close()
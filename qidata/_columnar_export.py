@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Columnar export of the rectangles annotated on images.
+
+A bundle is a folder holding one ``.npy`` file per column, plus an
+"index.json" file describing the columns and the vocabularies needed to
+decode them. Each row describes one annotation located by a rectangle:
+
+- ``file_index``: index of the file in the bundle's list of files
+- ``annotator``: index of the annotator in the bundle's list of annotators
+- ``metadata_type``: index of the type in the bundle's list of types
+- ``x0``, ``y0``, ``x1``, ``y1``: corners of the rectangle
+
+Selected attributes of the metadata objects are stored in additional
+columns. Numeric attributes are stored as floats (NaN when missing), others
+as indexes in a list of categories (-1 when missing).
+
+Separate ``.npy`` files are used rather than an ``.npz`` archive so that
+columns can be memory-mapped.
+"""
+
+# Standard libraries
+import json
+import os
+
+# Third-party libraries
+import numpy
+
+# Local modules
+import _annotation_index
+
+BUNDLE_VERSION = 1
+BUNDLE_INDEX_FILENAME = "index.json"
+BOX_COLUMNS = ["file_index", "annotator", "metadata_type", "x0", "y0", "x1", "y1"]
+
+def _isRectangle(location):
+	"""
+	Return True if ``location`` is of the form [[x0, y0], [x1, y1]]
+	"""
+	try:
+		return len(location) == 2 and all(
+		  len(corner) == 2 and all(
+		    isinstance(c, (int, long, float)) for c in corner
+		  ) for corner in location
+		)
+	except TypeError:
+		return False
+
+def boxRows(annotations, attributes=()):
+	"""
+	Extract the annotations located by a rectangle
+
+	:param annotations: Annotations of a file, as returned by
+	 ``QiDataFile.annotations``
+	:type annotations: collections.OrderedDict
+	:param attributes: Names of the attributes to extract (nested attributes
+	 are named with dots, like "translation.x")
+	:type attributes: list
+	:return: List of (annotator, metadata type, x0, y0, x1, y1, attribute
+	 values) tuples. Missing attributes are None.
+	:rtype: list
+	"""
+	rows = []
+	for annotator, typed_annotations in annotations.iteritems():
+		for metadata_type, annotation_list in typed_annotations.iteritems():
+			for annotation, location in annotation_list:
+				if not _isRectangle(location):
+					continue
+				values = _annotation_index._flatten(annotation)
+				rows.append(
+				  (annotator, metadata_type)
+				  + tuple(location[0]) + tuple(location[1])
+				  + (tuple(values.get(name) for name in attributes),)
+				)
+	return rows
+
+def _attributeColumn(values):
+	"""
+	Convert an attribute's values into a column
+
+	:return: The column and its categories (None for a numeric column)
+	:rtype: tuple
+	"""
+	try:
+		column = numpy.array(
+		  [numpy.nan if v is None else float(v) for v in values],
+		  dtype=numpy.float64
+		)
+		return column, None
+	except ValueError:
+		pass
+	categories = []
+	codes = dict()
+	column = numpy.empty(len(values), dtype=numpy.int32)
+	for i, value in enumerate(values):
+		if value is None:
+			column[i] = -1
+			continue
+		if not codes.has_key(value):
+			codes[value] = len(categories)
+			categories.append(value)
+		column[i] = codes[value]
+	return column, categories
+
+def writeBundle(path, files, rows_per_file, attributes=()):
+	"""
+	Write a bundle
+
+	:param path: Path of the folder to create (or to overwrite)
+	:type path: str
+	:param files: Name of each file
+	:type files: list
+	:param rows_per_file: Rows of each file, as returned by ``boxRows``
+	:type rows_per_file: list
+	:param attributes: Names of the extracted attributes
+	:type attributes: list
+	"""
+	annotators = []
+	metadata_types = []
+	codes = (dict(), dict())
+	columns = dict((name, []) for name in BOX_COLUMNS)
+	attribute_values = [[] for name in attributes]
+	for file_index, rows in enumerate(rows_per_file):
+		for annotator, metadata_type, x0, y0, x1, y1, values in rows:
+			for value, vocabulary, code in [(annotator, annotators, codes[0]),
+			                               (metadata_type, metadata_types, codes[1])]:
+				if not code.has_key(value):
+					code[value] = len(vocabulary)
+					vocabulary.append(value)
+			columns["file_index"].append(file_index)
+			columns["annotator"].append(codes[0][annotator])
+			columns["metadata_type"].append(codes[1][metadata_type])
+			for name, coordinate in zip(["x0", "y0", "x1", "y1"], [x0, y0, x1, y1]):
+				columns[name].append(coordinate)
+			for column, value in zip(attribute_values, values):
+				column.append(value)
+
+	if not os.path.isdir(path):
+		os.makedirs(path)
+	for name in BOX_COLUMNS:
+		dtype = numpy.float64 if name[0] in "xy" else numpy.int32
+		numpy.save(
+		  os.path.join(path, name + ".npy"),
+		  numpy.array(columns[name], dtype=dtype)
+		)
+	attribute_descriptions = []
+	for i, (name, values) in enumerate(zip(attributes, attribute_values)):
+		column, categories = _attributeColumn(values)
+		filename = "attribute_%d.npy"%i
+		numpy.save(os.path.join(path, filename), column)
+		attribute_descriptions.append(
+		  dict(name=name, file=filename, categories=categories)
+		)
+
+	with open(os.path.join(path, BUNDLE_INDEX_FILENAME), "w") as _f:
+		json.dump(
+		  dict(
+		    version=BUNDLE_VERSION,
+		    count=len(columns["file_index"]),
+		    files=list(files),
+		    annotators=annotators,
+		    metadata_types=metadata_types,
+		    attributes=attribute_descriptions
+		  ),
+		  _f
+		)
+
+class BoxBundle(object):
+	"""
+	Bundle of rectangle annotations, with memory-mapped columns
+
+	Columns are accessed by name (see ``BOX_COLUMNS`` and ``attributes``).
+	They are read-only ``numpy.memmap`` arrays, whose pages are shared by all
+	processes reading the same bundle.
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, path):
+		"""
+		Open a bundle
+
+		:param path: Path of the bundle's folder
+		:type path: str
+		:raises: IOError if the bundle cannot be read
+		"""
+		with open(os.path.join(path, BUNDLE_INDEX_FILENAME), "r") as _f:
+			index = json.load(_f)
+		if index["version"] != BUNDLE_VERSION:
+			raise IOError("Unsupported bundle version: %s"%index["version"])
+		self._path = path
+		self._count = index["count"]
+		self.files = [str(name) for name in index["files"]]
+		self.annotators = index["annotators"]
+		self.metadata_types = [str(name) for name in index["metadata_types"]]
+		self._files = dict((name, name + ".npy") for name in BOX_COLUMNS)
+		self._categories = dict()
+		self.attributes = []
+		for description in index["attributes"]:
+			self.attributes.append(description["name"])
+			self._files[description["name"]] = description["file"]
+			self._categories[description["name"]] = description["categories"]
+		self._columns = dict()
+
+	# ──────────
+	# Public API
+
+	def categories(self, name):
+		"""
+		Return the values coded by an attribute column
+
+		:param name: Name of the attribute
+		:type name: str
+		:return: The values, in code order, or None for a numeric column
+		:rtype: list
+		:raises: KeyError if the attribute was not exported
+		"""
+		return self._categories[name]
+
+	def keys(self):
+		"""
+		Return the names of all columns
+		"""
+		return BOX_COLUMNS + self.attributes
+
+	# ───────────
+	# Private API
+
+	def __getitem__(self, name):
+		if not self._columns.has_key(name):
+			self._columns[name] = numpy.load(
+			                        os.path.join(self._path, self._files[name]),
+			                        mmap_mode="r"
+			                      )
+		return self._columns[name]
+
+	def __len__(self):
+		return self._count
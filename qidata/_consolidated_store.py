@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Consolidated metadata store of a dataset.
+
+Instead of one XMP file per data file and per frame, a dataset can keep all
+their metadata in a single SQLite file. Each entry holds the content of the
+qidata XMP namespaces of one file or frame, encoded in JSON. Values are
+stored as unicode strings, exactly like in XMP, so that they are decoded the
+same way.
+
+``StoredXMPFile`` gives access to an entry through the part of the
+``xmp.xmp.XMPFile`` interface used by qidata.
+"""
+
+# Standard libraries
+import collections
+import json
+import os
+import sqlite3
+import threading
+
+STORE_FILENAME = "metadata.store"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_revision ON entries (revision);
+"""
+
+# Stores kept open by ``sharedStore``, for each thread
+_shared_stores = threading.local()
+
+def storePath(folder_path):
+	"""
+	Return the path of the consolidated store of a dataset
+	"""
+	return os.path.join(folder_path, STORE_FILENAME)
+
+def storeOf(path):
+	"""
+	Find the consolidated store holding the metadata of a file
+
+	:param path: Path of a data file, of its external annotation file, or of
+	 a frame
+	:type path: str
+	:return: Path of the dataset and name of the file's entry, or None if
+	 the file's folder has no consolidated store
+	:rtype: tuple
+	"""
+	folder_path, name = os.path.split(os.path.abspath(path))
+	if not os.path.isfile(storePath(folder_path)):
+		return None
+	if os.path.splitext(path)[1] == ".xmp"\
+	   and os.path.exists(os.path.splitext(path)[0]):
+		name = os.path.splitext(name)[0]
+	return (folder_path, name)
+
+def _fileIdentity(path):
+	"""
+	Return what identifies the file at ``path``, or None if there is none
+	"""
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return (stat.st_dev, stat.st_ino)
+
+def sharedStore(folder_path):
+	"""
+	Return the consolidated store of a dataset, kept open for the current
+	thread
+
+	Reading and writing entries one at a time (see ``StoredXMPFile``) then
+	reuses the same connection. The store is opened again if its file was
+	replaced, or in a new process.
+
+	:param folder_path: Path of the dataset
+	:type folder_path: str
+	:rtype: ConsolidatedStore
+
+	.. note::
+		The returned store must not be closed.
+	"""
+	path = storePath(folder_path)
+	if getattr(_shared_stores, "pid", None) != os.getpid():
+		# Connections cannot be used by a forked process
+		_shared_stores.pid = os.getpid()
+		_shared_stores.stores = dict()
+	stores = _shared_stores.stores
+	identity = _fileIdentity(path)
+	store, store_identity = stores.get(path, (None, None))
+	if store is None or identity is None or identity != store_identity:
+		if store is not None:
+			store.close()
+		store = ConsolidatedStore(folder_path)
+		stores[path] = (store, _fileIdentity(path))
+	return store
+
+def closeSharedStore(folder_path):
+	"""
+	Close the store of a dataset kept open for the current thread, if any
+	(see ``sharedStore``)
+	"""
+	if getattr(_shared_stores, "pid", None) != os.getpid():
+		return
+	store, _ = _shared_stores.stores.pop(storePath(folder_path), (None, None))
+	if store is not None:
+		store.close()
+
+def _toXMPValue(value):
+	"""
+	Convert a value the way the XMP toolkit stores it
+
+	Mappings (including metadata objects) become structures, lists become
+	arrays and everything else becomes a unicode string.
+	"""
+	if isinstance(value, collections.Mapping):
+		out = _XMPStruct()
+		for key in value:
+			out[key] = value[key]
+		return out
+	if isinstance(value, (list, tuple)):
+		return _XMPArray(value)
+	if isinstance(value, str):
+		return value.decode("utf-8")
+	return unicode(value)
+
+def _plainValue(value):
+	"""
+	Return a copy of a value made of plain OrderedDict, list and unicode
+	"""
+	if isinstance(value, collections.Mapping):
+		return collections.OrderedDict(
+		  (key, _plainValue(value[key])) for key in value
+		)
+	if isinstance(value, list):
+		return [_plainValue(element) for element in value]
+	return value
+
+class _XMPStruct(collections.OrderedDict):
+	"""
+	Structure converting the values assigned to it with ``_toXMPValue``
+	"""
+	def __setitem__(self, key, value):
+		collections.OrderedDict.__setitem__(self, str(key), _toXMPValue(value))
+
+class _XMPArray(list):
+	"""
+	Array converting the values added to it with ``_toXMPValue``
+	"""
+	def __init__(self, values=()):
+		list.__init__(self, [_toXMPValue(value) for value in values])
+
+	def __setitem__(self, index, value):
+		list.__setitem__(self, index, _toXMPValue(value))
+
+	def append(self, value):
+		list.append(self, _toXMPValue(value))
+
+	def extend(self, values):
+		list.extend(self, [_toXMPValue(value) for value in values])
+
+	def insert(self, index, value):
+		list.insert(self, index, _toXMPValue(value))
+
+class ConsolidatedStore(object):
+	"""
+	SQLite file holding the metadata of every file and frame of a dataset
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, folder_path):
+		"""
+		Open (and create if needed) the consolidated store of a dataset
+
+		:param folder_path: Path of the dataset
+		:type folder_path: str
+		"""
+		self._connection = sqlite3.connect(storePath(folder_path))
+		self._connection.executescript(_SCHEMA)
+
+	# ──────────
+	# Public API
+
+	def close(self):
+		"""
+		Close the store
+		"""
+		self._connection.close()
+
+	def get(self, name):
+		"""
+		Return the metadata of an entry
+
+		:param name: Name of the file or frame in the dataset
+		:type name: str
+		:return: Content of each namespace, or None if there is no entry
+		:rtype: collections.OrderedDict
+		"""
+		row = self._connection.execute(
+		        "SELECT metadata FROM entries WHERE name = ?",
+		        (name,)
+		      ).fetchone()
+		if row is None:
+			return None
+		return json.loads(row[0], object_pairs_hook=collections.OrderedDict)
+
+	def items(self):
+		"""
+		Return the metadata of every entry
+
+		:return: List of (name, metadata) pairs, sorted by name
+		:rtype: list
+		"""
+		return [
+		  (
+		    str(name),
+		    json.loads(metadata, object_pairs_hook=collections.OrderedDict)
+		  ) for name, metadata in self._connection.execute(
+		      "SELECT name, metadata FROM entries ORDER BY name"
+		    )
+		]
+
+	def names(self):
+		"""
+		Return the sorted names of the entries
+		"""
+		return [
+		  str(row[0]) for row in self._connection.execute(
+		    "SELECT name FROM entries ORDER BY name"
+		  )
+		]
+
+	def put(self, name, metadata):
+		"""
+		Replace the metadata of an entry
+
+		:param name: Name of the file or frame in the dataset
+		:type name: str
+		:param metadata: Content of each namespace
+		:type metadata: dict
+		"""
+		self.putMany([(name, metadata)])
+
+	def putMany(self, entries):
+		"""
+		Replace the metadata of several entries, in a single transaction
+
+		:param entries: List of (name, metadata) pairs
+		:type entries: list
+		"""
+		with self._connection:
+			revision = self._connection.execute(
+			             "SELECT COALESCE(MAX(revision), 0) FROM entries"
+			           ).fetchone()[0]
+			for name, metadata in entries:
+				revision += 1
+				self._connection.execute(
+				  "INSERT OR REPLACE INTO entries (name, revision, metadata)"
+				  " VALUES (?, ?, ?)",
+				  (name, revision, json.dumps(metadata))
+				)
+
+	def remove(self, name):
+		"""
+		Remove an entry, if it exists
+
+		:param name: Name of the file or frame in the dataset
+		:type name: str
+		"""
+		with self._connection:
+			self._connection.execute(
+			  "DELETE FROM entries WHERE name = ?",
+			  (name,)
+			)
+
+	def revisions(self):
+		"""
+		Return the revision of every entry
+
+		A revision changes each time its entry is written.
+
+		:rtype: dict
+		"""
+		return dict(
+		  (str(name), revision) for name, revision in self._connection.execute(
+		    "SELECT name, revision FROM entries"
+		  )
+		)
+
+	# ───────────────
+	# Context Manager
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+class StoredXMPFile(object):
+	"""
+	Replacement of ``xmp.xmp.XMPFile`` for an entry of a consolidated store
+
+	Only the parts of ``XMPFile`` used by qidata are provided
+	(``metadata[namespace]``, ``rw`` and the open/close methods). In "rw"
+	mode, the entry is written when the file is closed, unless the context
+	manager exits with an exception.
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, folder_path, name, rw=False):
+		"""
+		Prepare an entry of a consolidated store
+
+		:param folder_path: Path of the dataset
+		:type folder_path: str
+		:param name: Name of the file or frame in the dataset
+		:type name: str
+		:param rw: True to write the entry when closing
+		:type rw: bool
+		"""
+		self.rw = rw
+		self._folder_path = folder_path
+		self._name = name
+		self._namespaces = None
+
+	# ──────────
+	# Properties
+
+	@property
+	def metadata(self):
+		"""
+		Content of the entry, indexed by namespace URI
+		"""
+		if self._namespaces is None:
+			self._load()
+		return _StoredNamespaces(self._namespaces)
+
+	# ──────────
+	# Public API
+
+	def close(self):
+		"""
+		Close the entry, writing it in "rw" mode
+		"""
+		if self.rw and self._namespaces is not None:
+			metadata = collections.OrderedDict(
+			  (namespace, values)
+			    for namespace, values in self._namespaces.iteritems()
+			      if values
+			)
+			sharedStore(self._folder_path).put(self._name, metadata)
+		self._namespaces = None
+
+	# ───────────
+	# Private API
+
+	def _load(self):
+		"""
+		Read the entry from the store
+		"""
+		metadata = sharedStore(self._folder_path).get(self._name) or dict()
+		self._namespaces = dict(
+		  (namespace, _toXMPValue(values))
+		    for namespace, values in metadata.iteritems()
+		)
+
+	# ───────────────
+	# Context Manager
+
+	def __enter__(self):
+		self._load()
+		return self
+
+	def __exit__(self, type, value, traceback):
+		if type is None:
+			self.close()
+		else:
+			# Do not write anything
+			self._namespaces = None
+
+class _StoredNamespaces(object):
+	"""
+	Namespaces of a ``StoredXMPFile``
+	"""
+	def __init__(self, namespaces):
+		self._namespaces = namespaces
+
+	def __getitem__(self, namespace):
+		if not self._namespaces.has_key(namespace):
+			self._namespaces[namespace] = _XMPStruct()
+		return _StoredNamespace(self._namespaces[namespace])
+
+class _StoredNamespace(object):
+	"""
+	Content of a namespace of a ``StoredXMPFile``
+
+	Top-level properties can be read and written as items or as attributes.
+	"""
+	has_prefixes = False
+
+	def __init__(self, values):
+		object.__setattr__(self, "_values", values)
+
+	@property
+	def children(self):
+		"""
+		Names of the namespace's top-level properties
+		"""
+		return self._values.keys()
+
+	@property
+	def value(self):
+		"""
+		Namespace content. A new structure is built at each call, so it can be
+		modified freely.
+
+		:rtype: collections.OrderedDict
+		"""
+		return _plainValue(self._values)
+
+	def attributes(self):
+		return self._values.keys()
+
+	def pop(self, key, *default):
+		return self._values.pop(key, *default)
+
+	def __getitem__(self, key):
+		return self._values[key]
+
+	def __setitem__(self, key, value):
+		self._values[key] = value
+
+	def __delitem__(self, key):
+		del self._values[key]
+
+	def __setattr__(self, name, value):
+		self[name] = value
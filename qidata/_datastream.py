@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Storage of the data streams of a dataset.
+
+A stream is kept as two parallel lists sorted by time: the timestamps, in
+nanoseconds, and the corresponding file names. Lookups by time use a binary
+search.
+"""
+
+# Standard libraries
+import bisect
+
+# Third-party libraries
+import numpy
+
+ALIGNMENT_DIRECTIONS = ["backward", "forward", "nearest"]
+
+def toNanoseconds(timestamp):
+	"""
+	Convert a timestamp into an integer number of nanoseconds
+
+	:param timestamp: Timestamp to convert
+	:type timestamp: tuple (seconds, nanoseconds) or
+	 ``qidata.metadata_objects.TimeStamp``
+	:rtype: int
+	"""
+	if isinstance(timestamp, (tuple, list)):
+		return int(timestamp[0])*1000000000 + int(timestamp[1])
+	try:
+		return int(timestamp.seconds)*1000000000 + int(timestamp.nanoseconds)
+	except AttributeError:
+		raise TypeError("%s is not a valid timestamp"%str(timestamp))
+
+def fromNanoseconds(nanoseconds):
+	"""
+	Convert a number of nanoseconds into a (seconds, nanoseconds) tuple
+
+	:param nanoseconds: Timestamp to convert
+	:type nanoseconds: int
+	:rtype: tuple
+	"""
+	return divmod(int(nanoseconds), 1000000000)
+
+def matchTimestamps(reference, timestamps, tolerance=None, direction="nearest"):
+	"""
+	For each reference timestamp, find the index of the matching timestamp
+
+	:param reference: Timestamps to match, in nanoseconds
+	:type reference: numpy.ndarray
+	:param timestamps: Sorted timestamps to search in, in nanoseconds
+	:type timestamps: numpy.ndarray
+	:param tolerance: Maximal accepted time difference, in nanoseconds
+	:type tolerance: int
+	:param direction: "backward" to match the last timestamp before (or at) the
+	 reference one, "forward" for the first one after (or at), and "nearest"
+	 for the closest one (the earliest one in case of a tie)
+	:type direction: str
+	:return: Index of the match for each reference timestamp (-1 if there is
+	 no match)
+	:rtype: numpy.ndarray
+	:raises: ValueError if direction is not valid
+	"""
+	if not direction in ALIGNMENT_DIRECTIONS:
+		raise ValueError(
+		  "%s is not a valid direction (%s)"%(
+		    direction,
+		    ", ".join(ALIGNMENT_DIRECTIONS)
+		  )
+		)
+	if len(timestamps) == 0:
+		return numpy.full(len(reference), -1, dtype=numpy.int64)
+
+	if direction == "backward":
+		index = numpy.searchsorted(timestamps, reference, side="right") - 1
+	elif direction == "forward":
+		index = numpy.searchsorted(timestamps, reference, side="left")
+	else:
+		# The closest is either the last one before or the first one after
+		after = numpy.searchsorted(timestamps, reference, side="left")
+		before = after - 1
+		_after = numpy.minimum(after, len(timestamps)-1)
+		_before = numpy.maximum(before, 0)
+		after_is_closer = (
+		  timestamps[_after] - reference < reference - timestamps[_before]
+		) & (after < len(timestamps))
+		index = numpy.where((before < 0) | after_is_closer, after, before)
+
+	valid = (index >= 0) & (index < len(timestamps))
+	if tolerance is not None:
+		_index = numpy.clip(index, 0, len(timestamps)-1)
+		valid &= numpy.abs(timestamps[_index] - reference) <= tolerance
+	return numpy.where(valid, index, -1)
+
+class DataStream(object):
+	"""
+	Time-ordered sequence of files of the same type
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, data_type, timestamp_file_pairs=()):
+		"""
+		Create a stream
+
+		:param data_type: Type of the files in the stream
+		:type data_type: ``qidata.DataType``
+		:param timestamp_file_pairs: Pairs of timestamp and file name
+		:type timestamp_file_pairs: list
+		"""
+		self.data_type = data_type
+		pairs = dict()
+		for timestamp, filename in timestamp_file_pairs:
+			pairs[toNanoseconds(timestamp)] = filename
+		self._timestamps = sorted(pairs.keys())
+		self._filenames = [pairs[ts] for ts in self._timestamps]
+		self._arrays = None
+
+	# ──────────
+	# Properties
+
+	@property
+	def arrays(self):
+		"""
+		Timestamps (int64 nanoseconds) and file names of the stream, as numpy
+		arrays. They are cached until the stream is modified, and must not be
+		modified.
+
+		:rtype: tuple
+		"""
+		if self._arrays is None:
+			filenames = numpy.empty(len(self._filenames), dtype=object)
+			filenames[:] = self._filenames
+			self._arrays = (
+			  numpy.array(self._timestamps, dtype=numpy.int64),
+			  filenames
+			)
+		return self._arrays
+
+	# ──────────
+	# Public API
+
+	def add(self, timestamp, filename):
+		"""
+		Add a file to the stream. If there is already a file at the same
+		timestamp, it is replaced.
+
+		:param timestamp: Timestamp of the file
+		:type timestamp: tuple
+		:param filename: Name of the file
+		:type filename: str
+		"""
+		ts = toNanoseconds(timestamp)
+		i = bisect.bisect_left(self._timestamps, ts)
+		if i < len(self._timestamps) and self._timestamps[i] == ts:
+			self._filenames[i] = filename
+		else:
+			self._timestamps.insert(i, ts)
+			self._filenames.insert(i, filename)
+		self._arrays = None
+
+	def remove(self, filename):
+		"""
+		Remove a file from the stream
+
+		:param filename: Name of the file to remove
+		:type filename: str
+		:raises: ValueError if the file is not in the stream
+		"""
+		i = self._filenames.index(filename)
+		self._timestamps.pop(i)
+		self._filenames.pop(i)
+		self._arrays = None
+
+	def between(self, start, end):
+		"""
+		Return the files whose timestamp is between ``start`` and ``end``
+		(both included)
+
+		:param start: First timestamp of the range
+		:type start: tuple
+		:param end: Last timestamp of the range
+		:type end: tuple
+		:return: Time-ordered list of (timestamp, file name) pairs
+		:rtype: list
+		"""
+		first = bisect.bisect_left(self._timestamps, toNanoseconds(start))
+		last = bisect.bisect_right(self._timestamps, toNanoseconds(end))
+		return [
+		  (fromNanoseconds(self._timestamps[i]), self._filenames[i])
+		    for i in xrange(first, last)
+		]
+
+	def nearest(self, timestamp, tolerance=None):
+		"""
+		Return the file whose timestamp is the closest to ``timestamp``
+
+		:param timestamp: Requested timestamp
+		:type timestamp: tuple
+		:param tolerance: Maximal accepted time difference
+		:type tolerance: tuple
+		:return: The closest (timestamp, file name) pair, or None if the
+		 stream is empty or if no file is close enough
+		:rtype: tuple
+		"""
+		ts = toNanoseconds(timestamp)
+		i = bisect.bisect_left(self._timestamps, ts)
+		candidates = [j for j in (i-1, i) if 0 <= j < len(self._timestamps)]
+		if not candidates:
+			return None
+		best = min(candidates, key=lambda j: abs(self._timestamps[j] - ts))
+		if tolerance is not None\
+		   and abs(self._timestamps[best] - ts) > toNanoseconds(tolerance):
+			return None
+		return (fromNanoseconds(self._timestamps[best]), self._filenames[best])
+
+	def toDict(self):
+		"""
+		Return the stream as a dict of file names indexed by timestamps
+
+		:rtype: dict
+		"""
+		return dict(self)
+
+	# ─────────
+	# Operators
+
+	def __iter__(self):
+		for i in xrange(len(self._timestamps)):
+			yield (fromNanoseconds(self._timestamps[i]), self._filenames[i])
+
+	def __len__(self):
+		return len(self._timestamps)
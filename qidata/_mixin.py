@@ -1,3 +1,5 @@
+# -*- coding: utf-8 -*-
+
 # Copyright (c) 2017, Softbank Robotics Europe
 # All rights reserved.
 
@@ -27,16 +29,36 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 # Standard libraries
+import base64
+import collections
 from collections import OrderedDict
+import json
+import uuid
+import zlib
+import xml.etree.cElementTree as ElementTree
 
 # Third-party libraries
 from qidata import makeMetadataObject, MetadataType
 from xmp.xmp import registerNamespace
 
+# Local modules
+from qidata.qidataobject import Annotation
+
 # Namespace reserved for annotation
 QIDATA_NS=u"http://softbank-robotics.com/qidata/1"
 registerNamespace(QIDATA_NS, "qidata")
 
+# Namespace holding annotations stored in the "packed" format
+QIDATA_PACKED_NS=u"http://softbank-robotics.com/qidata/packed/1"
+registerNamespace(QIDATA_PACKED_NS, "qidatapacked")
+
+# RDF namespace, used to read XMP files without the XMP toolkit
+RDF_NS=u"http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+_RDF_RDF = "{%s}RDF"%RDF_NS
+_RDF_DESCRIPTION = "{%s}Description"%RDF_NS
+_RDF_PARSE_TYPE = "{%s}parseType"%RDF_NS
+_RDF_CONTAINERS = ["{%s}%s"%(RDF_NS, c) for c in ["Seq", "Bag", "Alt"]]
+
 def _unicodeListToBuiltInList(list_to_convert):
 	"""
 	Convert a list containing unicode values into a list of built-in types.
@@ -119,61 +141,537 @@ def _removePrefixes(map_from_xmp):
 		for element in map_from_xmp:
 			_removePrefixes(element)
 
+def _namespaceValue(raw_metadata):
+	"""
+	Return the content of an XMP namespace, without prefixes
+
+	:param raw_metadata: Namespace content, as given by the ``metadata``
+	 attribute of an ``xmp.xmp.XMPFile`` or of an ``XMPSidecarReader``
+	:rtype: collections.OrderedDict
+	"""
+	data = raw_metadata.value
+	if getattr(raw_metadata, "has_prefixes", True):
+		_removePrefixes(data)
+	return data
+
+def _localName(tag):
+	"""
+	Removes the namespace part of an ElementTree tag
+
+	:Example:
+
+		>>> _localName("{http://softbank-robotics.com/qidata/1}key")
+		'key'
+	"""
+	return tag.split("}")[-1]
+
+def _isTopLevelDescription(element, parent):
+	"""
+	Tell if an element is an ``rdf:Description`` placed directly under
+	``rdf:RDF``. The children of such an element are the top-level properties
+	of the file, whereas nested descriptions only hold structure fields.
+
+	:param element: Element to test
+	:type element: xml.etree.ElementTree.Element
+	:param parent: Parent of ``element``, or None if it is the root
+	:type parent: xml.etree.ElementTree.Element
+	"""
+	return (
+	  element.tag == _RDF_DESCRIPTION
+	  and parent is not None
+	  and parent.tag == _RDF_RDF
+	)
+
+def _parseXMPValue(element):
+	"""
+	Convert an RDF property element into the value the XMP toolkit would give,
+	without the prefixes (see ``_removePrefixes``).
+
+	:param element: Property element to convert
+	:type element: xml.etree.ElementTree.Element
+	:return: An OrderedDict for structures, a list for arrays, a unicode
+	 string otherwise
+	"""
+	if element.get(_RDF_PARSE_TYPE) == "Resource":
+		return _parseXMPStructure(element)
+
+	for child in element:
+		if child.tag == _RDF_DESCRIPTION:
+			return _parseXMPStructure(child)
+		if child.tag in _RDF_CONTAINERS:
+			return [_parseXMPValue(item) for item in child]
+
+	fields = [k for k in element.keys() if not k.startswith("{%s}"%RDF_NS)]
+	if fields:
+		return _parseXMPStructure(element)
+
+	return unicode(element.text or u"")
+
+def _parseXMPStructure(element):
+	"""
+	Convert the fields of an RDF structure into an OrderedDict. Fields can be
+	given as child elements or, in the compact form, as attributes.
+
+	:param element: Element containing the fields
+	:type element: xml.etree.ElementTree.Element
+	:rtype: collections.OrderedDict
+	"""
+	out = OrderedDict()
+	for key, value in element.items():
+		if not key.startswith("{%s}"%RDF_NS):
+			out[_localName(key)] = unicode(value)
+	for child in element:
+		out[_localName(child.tag)] = _parseXMPValue(child)
+	return out
+
+def _readXMPProperties(xmp_path, namespace, names):
+	"""
+	Read some top-level properties of a namespace from an XMP file, without
+	the XMP toolkit. The file is parsed incrementally and reading stops as
+	soon as all requested properties were found.
+
+	:param xmp_path: Path of the XMP file (an XMP sidecar or packet)
+	:type xmp_path: str
+	:param namespace: URI of the properties' namespace
+	:type namespace: unicode
+	:param names: Names of the requested properties, without prefix
+	:type names: list
+	:return: The found properties (see ``_parseXMPValue``), or None if the file
+	 contains no property at all in ``namespace``
+	:rtype: collections.OrderedDict
+	:raises: SyntaxError if the file is not a valid XML document
+	"""
+	prefix = "{%s}"%namespace
+	remaining = set(names)
+	found = OrderedDict()
+	namespace_seen = False
+	stack = []
+	for event, element in ElementTree.iterparse(xmp_path, ("start", "end")):
+		if event == "start":
+			if _isTopLevelDescription(element, stack[-1] if stack else None):
+				for key, value in element.items():
+					if key.startswith(prefix):
+						namespace_seen = True
+						if _localName(key) in remaining:
+							found[_localName(key)] = unicode(value)
+							remaining.discard(_localName(key))
+			stack.append(element)
+			continue
+
+		stack.pop()
+		if len(stack) < 2 or not _isTopLevelDescription(stack[-1], stack[-2]):
+			continue
+
+		# element is a top-level property
+		if element.tag.startswith(prefix):
+			namespace_seen = True
+			if _localName(element.tag) in remaining:
+				found[_localName(element.tag)] = _parseXMPValue(element)
+				remaining.discard(_localName(element.tag))
+		element.clear()
+		if not remaining:
+			break
+
+	return found if namespace_seen else None
+
+class _XMPNamespace(object):
+	"""
+	Content of a namespace read by ``XMPSidecarReader``
+	"""
+	has_prefixes = False
+
+	def __init__(self, elements):
+		self._elements = elements
+
+	@property
+	def children(self):
+		"""
+		Names of the namespace's top-level properties
+		"""
+		return [_localName(element.tag) for element in self._elements]
+
+	@property
+	def value(self):
+		"""
+		Namespace content, without prefixes. A new structure is built at each
+		call, so it can be modified freely.
+
+		:rtype: collections.OrderedDict
+		"""
+		out = OrderedDict()
+		for element in self._elements:
+			out[_localName(element.tag)] = _parseXMPValue(element)
+		return out
+
+class XMPSidecarReader(object):
+	"""
+	Read-only replacement of ``xmp.xmp.XMPFile`` for XMP sidecar files, which
+	does not use the XMP toolkit.
+
+	The file is parsed incrementally with ElementTree and its top-level
+	properties are grouped by namespace. Only the parts of ``XMPFile`` used by
+	qidata are provided (``metadata[namespace].children``,
+	``metadata[namespace].value``, ``rw`` and the open/close methods).
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, xmp_path):
+		"""
+		Read an XMP sidecar file
+
+		:param xmp_path: Path of the file to read
+		:type xmp_path: str
+		:raises: SyntaxError if the file is not a valid XML document
+		"""
+		self.path = xmp_path
+		self.rw = False
+		self._namespaces = dict()
+
+		stack = []
+		for event, element in ElementTree.iterparse(xmp_path, ("start","end")):
+			if event == "start":
+				parent = stack[-1] if stack else None
+				if _isTopLevelDescription(element, parent):
+					# Simple properties can be given as attributes
+					for key, value in element.items():
+						if not key.startswith("{%s}"%RDF_NS):
+							_property = ElementTree.Element(key)
+							_property.text = value
+							self._addProperty(_property)
+				stack.append(element)
+				continue
+			stack.pop()
+			if len(stack) >= 2 and _isTopLevelDescription(stack[-1], stack[-2]):
+				self._addProperty(element)
+
+	# ──────────
+	# Properties
+
+	@property
+	def metadata(self):
+		"""
+		Content of the file, indexed by namespace URI
+		"""
+		return _XMPNamespaces(self._namespaces)
+
+	# ──────────
+	# Public API
+
+	def close(self):
+		pass
+
+	# ───────────
+	# Private API
+
+	def _addProperty(self, element):
+		"""
+		Register a top-level property element in its namespace
+		"""
+		namespace = element.tag[1:].split("}")[0]
+		self._namespaces.setdefault(namespace, []).append(element)
+
+	# ───────────────
+	# Context Manager
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+class _XMPNamespaces(object):
+	"""
+	Namespaces of an ``XMPSidecarReader``
+	"""
+	def __init__(self, namespaces):
+		self._namespaces = namespaces
+
+	def __getitem__(self, namespace):
+		return _XMPNamespace(self._namespaces.get(namespace, []))
+
+# ──────────────────
+# Annotation formats
+
+def _toBuiltIn(value):
+	"""
+	Convert a metadata object (or any nested value) into built-in types
+
+	Mappings become OrderedDicts and tuples become lists. Values which are
+	not numbers or strings are converted into unicode strings.
+	"""
+	if isinstance(value, collections.Mapping):
+		return OrderedDict((str(key), _toBuiltIn(value[key])) for key in value)
+	if isinstance(value, (list, tuple)):
+		return [_toBuiltIn(element) for element in value]
+	if value is None or isinstance(value, (basestring, bool, int, long, float)):
+		return value
+	return unicode(value)
+
+def _rawAnnotations(annotations):
+	"""
+	Convert annotations into the structure stored by annotation formats
+
+	:param annotations: OrderedDict containing annotations
+	:type annotations: collections.OrderedDict
+	:return: For each annotator and metadata type, the list of
+	 {"info": ..., "id": ..., "location": ...} dicts. "info" holds the
+	 metadata object's attributes and version, "location" is absent when
+	 there is none. "id" is absent for annotations created without ID.
+	:rtype: collections.OrderedDict
+	"""
+	out = OrderedDict()
+	for (annotation_maker, personal_annotations) in annotations.iteritems():
+		out[annotation_maker] = OrderedDict()
+		for (annotation_typename, typed_annotations) in personal_annotations.iteritems():
+			out[annotation_maker][annotation_typename] = []
+			for annotation in typed_annotations:
+				info = _toBuiltIn(annotation[0])
+				info["version"] = annotation[0].version
+				tmp_dict = OrderedDict(info=info)
+				if isinstance(annotation, Annotation):
+					tmp_dict["id"] = annotation.id
+				if annotation[1] is not None:
+					tmp_dict["location"] = _toBuiltIn(annotation[1])
+				out[annotation_maker][annotation_typename].append(tmp_dict)
+	return out
+
+class _AnnotationFormat(object):
+	"""
+	Way of storing annotations in an XMP namespace
+	"""
+	name = None
+	namespace = None
+
+	@classmethod
+	def isUsedBy(cls, xmp_file):
+		"""
+		Return True if ``xmp_file`` contains annotations in this format
+		"""
+		return bool(xmp_file.metadata[cls.namespace].children)
+
+	@classmethod
+	def clear(cls, xmp_file):
+		"""
+		Remove the annotations stored in this format from ``xmp_file``
+		"""
+		_raw_metadata = xmp_file.metadata[cls.namespace]
+		for key in _raw_metadata.children:
+			_raw_metadata.pop(key)
+
+	@classmethod
+	def read(cls, xmp_file):
+		"""
+		Return the annotation structure (see ``_rawAnnotations``)
+		"""
+		raise NotImplementedError
+
+	@classmethod
+	def write(cls, xmp_file, raw_annotations):
+		"""
+		Store the annotation structure (see ``_rawAnnotations``)
+		"""
+		raise NotImplementedError
+
+class _XMPFormat(_AnnotationFormat):
+	"""
+	Annotations stored as XMP structures, one per annotator
+	"""
+	name = "xmp"
+	namespace = QIDATA_NS
+
+	@classmethod
+	def read(cls, xmp_file):
+		# Remove all "qidata" prefixes
+		return _namespaceValue(xmp_file.metadata[cls.namespace])
+
+	@classmethod
+	def write(cls, xmp_file, raw_annotations):
+		_raw_metadata = xmp_file.metadata[cls.namespace]
+		for (annotation_maker, personal_annotations) in raw_annotations.iteritems():
+			# Make a new dict for each annotator
+			_raw_metadata[annotation_maker] = dict()
+
+			for (annotation_typename, typed_annotations) in personal_annotations.iteritems():
+				# Make a new list for each annotation type
+				_raw_metadata[annotation_maker][annotation_typename] = []
+
+				for annotation in typed_annotations:
+					_raw_metadata[annotation_maker][annotation_typename].append(
+					  annotation
+					)
+
+class _PackedFormat(_AnnotationFormat):
+	"""
+	Annotations stored as a single compressed binary property
+
+	The annotation structure is encoded in JSON, compressed with zlib and
+	prefixed by a byte identifying the encoding. The result is stored in
+	base64, as the only property of its own namespace, so that reading it
+	does not require to parse one RDF element per annotation field.
+	"""
+	name = "packed"
+	namespace = QIDATA_PACKED_NS
+
+	@classmethod
+	def read(cls, xmp_file):
+		_raw_metadata = xmp_file.metadata[cls.namespace]
+		data = base64.b64decode(_namespaceValue(_raw_metadata)["annotations"])
+		if data[:1] != "z":
+			raise ValueError("Unknown annotation encoding: %r"%data[:1])
+		return json.loads(zlib.decompress(data[1:]), object_pairs_hook=OrderedDict)
+
+	@classmethod
+	def write(cls, xmp_file, raw_annotations):
+		data = "z" + zlib.compress(json.dumps(raw_annotations))
+		setattr(
+		    xmp_file.metadata[cls.namespace],
+		    "annotations",
+		    base64.b64encode(data)
+		)
+
+# Available annotation formats, by name
+ANNOTATION_FORMATS = OrderedDict(
+  (_format.name, _format) for _format in [_XMPFormat, _PackedFormat]
+)
+
+def _annotationFormat(xmp_file):
+	"""
+	Return the name of the format used by the annotations of an XMP file
+
+	:param xmp_file: XMP file to read from
+	:type xmp_file: xmp.xmp.XMPFile or XMPSidecarReader
+	:return: Name of the format, None if there are no annotations
+	:rtype: str
+	"""
+	for _format in ANNOTATION_FORMATS.values():
+		if _format.isUsedBy(xmp_file):
+			return _format.name
+	return None
+
+def _readRawAnnotations(xmp_file):
+	"""
+	Read the annotations of an XMP file, without decoding them
+
+	:param xmp_file: XMP file to read from
+	:type xmp_file: xmp.xmp.XMPFile or XMPSidecarReader
+	:return: Annotation structure (see ``_rawAnnotations``), empty if there
+	 are no annotations
+	:rtype: collections.OrderedDict
+	"""
+	annotation_format = _annotationFormat(xmp_file)
+	if annotation_format is None:
+		return OrderedDict()
+	return ANNOTATION_FORMATS[annotation_format].read(xmp_file)
+
+def _writeRawAnnotations(xmp_file, raw_annotations, annotation_format):
+	"""
+	Replace the annotations of an XMP file
+
+	:param xmp_file: XMP file to write in
+	:type xmp_file: xmp.xmp.XMPFile
+	:param raw_annotations: Annotation structure (see ``_rawAnnotations``)
+	:type raw_annotations: collections.OrderedDict
+	:param annotation_format: Name of the format to use
+	:type annotation_format: str
+	:raises: KeyError if the format is unknown
+	"""
+	_format = ANNOTATION_FORMATS[annotation_format]
+	for _other_format in ANNOTATION_FORMATS.values():
+		_other_format.clear(xmp_file)
+	_format.write(xmp_file, raw_annotations)
+
+def _convert_annotations(xmp_file, annotation_format):
+	"""
+	Store the annotations of an XMP file in another format
+
+	The annotations are moved as they are stored, without being decoded, so
+	the conversion is lossless (converting them back gives the exact same
+	content).
+
+	:param xmp_file: XMP file to convert
+	:type xmp_file: xmp.xmp.XMPFile
+	:param annotation_format: Name of the format to use
+	:type annotation_format: str
+	"""
+	_writeRawAnnotations(
+	  xmp_file,
+	  _readRawAnnotations(xmp_file),
+	  annotation_format
+	)
+
+def _storedAnnotationId(annotation, annotator, metadata_type, position):
+	"""
+	Return the ID of a stored annotation
+
+	Annotations stored before IDs existed get an ID derived from their
+	position, so that it stays the same until the annotations are written
+	(which stores it).
+	"""
+	if annotation.has_key("id"):
+		return str(annotation["id"])
+	return uuid.uuid5(
+	  uuid.NAMESPACE_URL,
+	  (u"%s/%s/%s/%d"%(QIDATA_NS, annotator, metadata_type, position))\
+	    .encode("utf-8")
+	).hex
+
 def _load_annotations(xmp_file):
 	"""
 	Load annotations from XMPFile into an OrderedDict with MetadataObject
 	instances.
 
 	:param xmp_file: XMP file to read from
-	:type xmp_file: xmp.xmp.XMPFile
+	:type xmp_file: xmp.xmp.XMPFile or XMPSidecarReader
 	:return: OrderedDict containing annotations
 	:rtype: collections.OrderedDict
 	"""
 	out = OrderedDict()
 
-	# Retrieve all metadata from the annotation namespace
-	_raw_metadata = xmp_file.metadata[QIDATA_NS]
-
-	# If there are annotations
-	if _raw_metadata.children:
-		# Remove all "qidata" prefixes
-		data = _raw_metadata.value
-		_removePrefixes(data)
-
-		# Build the annotation structure
-		for annotatorID in data.keys():
-			out[annotatorID] = dict()
-			for metadata_type in list(MetadataType):
-				try:
-					if len(data[annotatorID][str(metadata_type)]) != 0:
-						out[annotatorID][str(metadata_type)] = []
-					else:
-						continue
-				except KeyError:
-					# metadata_type does not exist in file => it's ok
+	# Retrieve all annotations, whatever their format
+	data = _readRawAnnotations(xmp_file)
+
+	# Build the annotation structure
+	for annotatorID in data.keys():
+		out[annotatorID] = dict()
+		for metadata_type in list(MetadataType):
+			try:
+				if len(data[annotatorID][str(metadata_type)]) != 0:
+					out[annotatorID][str(metadata_type)] = []
+				else:
 					continue
-
-				for annotation in data[annotatorID][str(metadata_type)]:
-					obj = makeMetadataObject(
-						    metadata_type,
-						    annotation["info"]
-						  )
-					if annotation.has_key("location"):
-						loc = annotation["location"]
-						if isinstance(loc, list):
-							_unicodeListToBuiltInList(loc)
-						else:
-							loc = _unicodeToBuiltInType(loc)
-						out[annotatorID][str(metadata_type)].append(
-						                                       [obj, loc]
-						                                     )
-					else:
-						out[annotatorID][str(metadata_type)].append(
-							                                   [obj, None]
-							                                 )
+			except KeyError:
+				# metadata_type does not exist in file => it's ok
+				continue
+
+			for i, annotation in enumerate(data[annotatorID][str(metadata_type)]):
+				obj = makeMetadataObject(
+					    metadata_type,
+					    annotation["info"]
+					  )
+				annotation_id = _storedAnnotationId(
+				                  annotation,
+				                  annotatorID,
+				                  metadata_type,
+				                  i
+				                )
+				if annotation.has_key("location"):
+					loc = annotation["location"]
+					if isinstance(loc, list):
+						_unicodeListToBuiltInList(loc)
+					elif isinstance(loc, basestring):
+						loc = _unicodeToBuiltInType(loc)
+					out[annotatorID][str(metadata_type)].append(
+					  Annotation([obj, loc], annotation_id)
+					)
+				else:
+					out[annotatorID][str(metadata_type)].append(
+					  Annotation([obj, None], annotation_id)
+					)
 	return out
 
-def _save_annotations(xmp_file, annotations):
+def _save_annotations(xmp_file, annotations, annotation_format="xmp"):
 	"""
 	Save changes made to annotations
 
@@ -181,30 +679,17 @@ def _save_annotations(xmp_file, annotations):
 	:type xmp_file: xmp.xmp.XMPFile
 	:param annotations: OrderedDict containing annotations
 	:type annotations: collections.OrderedDict
+	:param annotation_format: Name of the format to use (see
+	 ``ANNOTATION_FORMATS``)
+	:type annotation_format: str
 
 	.. note::
 
 		This prepares the metadata to be written in the file, but
 		it is actually saved only when the file is closed.
 	"""
-	# Get metadata from annotation namespace and erase it
-	_raw_metadata = xmp_file.metadata[QIDATA_NS]
-	for key in _raw_metadata.children:
-		_raw_metadata.pop(key)
-
-	for (annotation_maker, personal_annotations) in annotations.iteritems():
-		# Make a new dict for each annotator
-		_raw_metadata[annotation_maker] = dict()
-
-		for (annotation_typename, typed_annotations) in personal_annotations.iteritems():
-			# Make a new list for each annotation type
-			_raw_metadata[annotation_maker][annotation_typename] = []
-
-			for annotation in typed_annotations:
-				# Store annotion details and location in a dict along with
-				# the metadata object version
-				tmp_dict = dict(info=annotation[0])
-				if annotation[1] is not None:
-					tmp_dict["location"]=annotation[1]
-				_raw_metadata[annotation_maker][annotation_typename].append(tmp_dict)
-				_raw_metadata[annotation_maker][annotation_typename][-1]["info"]["version"] = annotation[0].version
+	_writeRawAnnotations(
+	  xmp_file,
+	  _rawAnnotations(annotations),
+	  annotation_format
+	)
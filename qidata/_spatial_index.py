@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Softbank Robotics Europe
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Indexes of rectangles and intervals, used to search annotations by location.
+
+Rectangles are registered in a uniform grid. Intervals are given as
+rectangles of null height, and kept sorted by their start.
+"""
+
+# Standard libraries
+import bisect
+import math
+
+DEFAULT_CELL_SIZE = 64
+MIN_CELL_SIZE = 8
+# Rectangles touching more cells are kept aside (see ``GridIndex``)
+MAX_CELLS_PER_KEY = 64
+
+def normalizedRectangle(location):
+	"""
+	Return the bounds of a rectangular location
+
+	:param location: Location of the form [[x0, y0], [x1, y1]], the corners
+	 being given in any order
+	:return: (x0, y0, x1, y1) with x0 <= x1 and y0 <= y1, or None if
+	 ``location`` is not a rectangle
+	:rtype: tuple
+	"""
+	try:
+		(xa, ya), (xb, yb) = location
+		return (min(xa, xb), min(ya, yb), max(xa, xb), max(ya, yb))
+	except (TypeError, ValueError):
+		return None
+
+def intervalBounds(location):
+	"""
+	Return the bounds of an interval location, as a rectangle of null height
+
+	:param location: Location of the form [start, end], ``start`` being
+	 included and ``end`` excluded
+	:return: (start, 0, end-1, 0), or None if ``location`` is not a non-empty
+	 interval of integers
+	:rtype: tuple
+	"""
+	try:
+		start, end = location
+	except (TypeError, ValueError):
+		return None
+	if not isinstance(start, (int, long)) or not isinstance(end, (int, long))\
+	   or end <= start:
+		return None
+	return (start, 0, end-1, 0)
+
+def overlaps(bounds, other_bounds):
+	"""
+	Return True if two rectangles (as returned by ``normalizedRectangle``)
+	share at least one point
+	"""
+	return bounds[0] <= other_bounds[2] and other_bounds[0] <= bounds[2]\
+	   and bounds[1] <= other_bounds[3] and other_bounds[1] <= bounds[3]
+
+def cellSizeFor(bounds_list):
+	"""
+	Choose the size of the cells of a grid holding the given rectangles
+
+	The median side of the rectangles is used, so that most rectangles are
+	registered in a few cells only.
+
+	:param bounds_list: Rectangles, as returned by ``normalizedRectangle``
+	:type bounds_list: list
+	:rtype: int
+	"""
+	if not bounds_list:
+		return DEFAULT_CELL_SIZE
+	sides = sorted(
+	          max(bounds[2]-bounds[0], bounds[3]-bounds[1])
+	            for bounds in bounds_list
+	        )
+	return max(MIN_CELL_SIZE, int(sides[len(sides)/2]))
+
+def gridFor(bounds_list):
+	"""
+	Return an empty grid suited to the given rectangles (see
+	``cellSizeFor``)
+
+	:param bounds_list: Rectangles, as returned by ``normalizedRectangle``
+	:type bounds_list: list
+	:rtype: GridIndex
+	"""
+	return GridIndex(cellSizeFor(bounds_list))
+
+def intervalsFor(bounds_list):
+	"""
+	Return an empty interval index, whatever the intervals to hold
+
+	:param bounds_list: Intervals, as returned by ``intervalBounds``
+	:type bounds_list: list
+	:rtype: IntervalIndex
+	"""
+	return IntervalIndex()
+
+class GridIndex(object):
+	"""
+	Rectangles registered in the cells of a uniform grid
+
+	Each key is registered in every cell its rectangle touches. Searching
+	for a region only looks at the keys registered in the cells the region
+	touches. Results are candidates: they must be checked against the exact
+	rectangles by the caller.
+
+	Rectangles much larger than the cells would be registered in too many
+	cells. They are kept in a separate list instead, which is returned
+	with every search.
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+		"""
+		Create an empty grid
+
+		:param cell_size: Side of the cells
+		:type cell_size: int
+		"""
+		self._cell_size = float(cell_size)
+		self._cells = dict()
+		self._large = set()
+		self._count = 0
+
+	# ──────────
+	# Public API
+
+	def candidates(self, bounds):
+		"""
+		Return the keys registered in the cells touched by a rectangle
+
+		:param bounds: Rectangle, as returned by ``normalizedRectangle``
+		:type bounds: tuple
+		:rtype: set
+		"""
+		found = set(self._large)
+		i0, j0, i1, j1 = self._cellRange(bounds)
+		if (i1-i0+1)*(j1-j0+1) > len(self._cells):
+			# Large region, it is faster to go through the non-empty cells
+			for (i, j), keys in self._cells.iteritems():
+				if i0 <= i <= i1 and j0 <= j <= j1:
+					found.update(keys)
+			return found
+		for cell in self._cellsOf(bounds):
+			keys = self._cells.get(cell)
+			if keys:
+				found.update(keys)
+		return found
+
+	def insert(self, key, bounds):
+		"""
+		Register a key
+
+		:param key: Key to register
+		:param bounds: Rectangle of the key, as returned by
+		 ``normalizedRectangle``
+		:type bounds: tuple
+		"""
+		self._count += 1
+		if self._isLarge(bounds):
+			self._large.add(key)
+			return
+		for cell in self._cellsOf(bounds):
+			if not self._cells.has_key(cell):
+				self._cells[cell] = set()
+			self._cells[cell].add(key)
+
+	def remove(self, key, bounds):
+		"""
+		Unregister a key
+
+		:param key: Key to unregister
+		:param bounds: Rectangle the key was registered with
+		:type bounds: tuple
+		"""
+		self._count -= 1
+		if self._isLarge(bounds):
+			self._large.discard(key)
+			return
+		for cell in self._cellsOf(bounds):
+			keys = self._cells.get(cell)
+			if keys is not None:
+				keys.discard(key)
+				if not keys:
+					del self._cells[cell]
+
+	# ───────────
+	# Private API
+
+	def _cellRange(self, bounds):
+		"""
+		Return the indexes of the first and last cells touched by a rectangle
+		"""
+		size = self._cell_size
+		return (
+		  int(math.floor(bounds[0]/size)),
+		  int(math.floor(bounds[1]/size)),
+		  int(math.floor(bounds[2]/size)),
+		  int(math.floor(bounds[3]/size))
+		)
+
+	def _isLarge(self, bounds):
+		"""
+		Return True if a rectangle touches too many cells to be registered
+		in each of them
+		"""
+		i0, j0, i1, j1 = self._cellRange(bounds)
+		return (i1-i0+1)*(j1-j0+1) > MAX_CELLS_PER_KEY
+
+	def _cellsOf(self, bounds):
+		i0, j0, i1, j1 = self._cellRange(bounds)
+		for i in xrange(i0, i1+1):
+			for j in xrange(j0, j1+1):
+				yield (i, j)
+
+	def __len__(self):
+		return self._count
+
+class IntervalIndex(object):
+	"""
+	Intervals sorted by their start, in classes of similar lengths
+
+	Intervals are given as rectangles of null height (see
+	``intervalBounds``). The intervals of class k are shorter than 2**k, so
+	the ones overlapping a region start less than 2**k before it. Searching
+	looks at these intervals only, in each class: very long intervals do not
+	make the short ones slower to find, and inserting or removing an
+	interval does not depend on its length.
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self):
+		# Class -> sorted list of (start, end, key)
+		self._classes = dict()
+		self._count = 0
+
+	# ──────────
+	# Public API
+
+	def candidates(self, bounds):
+		"""
+		Return the keys of the intervals overlapping an interval
+
+		:param bounds: Interval, as returned by ``intervalBounds``
+		:type bounds: tuple
+		:rtype: set
+		"""
+		found = set()
+		start, end = bounds[0], bounds[2]
+		for length_class, intervals in self._classes.iteritems():
+			first = bisect.bisect_left(
+			          intervals,
+			          (start - (1 << length_class),)
+			        )
+			last = bisect.bisect_right(intervals, (end, float("inf")))
+			for i in xrange(first, last):
+				if intervals[i][1] >= start:
+					found.add(intervals[i][2])
+		return found
+
+	def insert(self, key, bounds):
+		"""
+		Register a key
+
+		:param key: Key to register
+		:param bounds: Interval of the key, as returned by ``intervalBounds``
+		:type bounds: tuple
+		"""
+		length_class = self._lengthClass(bounds)
+		if not self._classes.has_key(length_class):
+			self._classes[length_class] = []
+		bisect.insort(self._classes[length_class], (bounds[0], bounds[2], key))
+		self._count += 1
+
+	def remove(self, key, bounds):
+		"""
+		Unregister a key
+
+		:param key: Key to unregister
+		:param bounds: Interval the key was registered with
+		:type bounds: tuple
+		"""
+		length_class = self._lengthClass(bounds)
+		intervals = self._classes.get(length_class, [])
+		entry = (bounds[0], bounds[2], key)
+		i = bisect.bisect_left(intervals, entry)
+		if i < len(intervals) and intervals[i] == entry:
+			del intervals[i]
+			self._count -= 1
+			if not intervals:
+				del self._classes[length_class]
+
+	# ───────────
+	# Private API
+
+	@staticmethod
+	def _lengthClass(bounds):
+		"""
+		Return the smallest k such that the interval is shorter than 2**k
+		"""
+		return int(bounds[2] - bounds[0]).bit_length()
+
+	def __len__(self):
+		return self._count
+
+class LocationIndex(object):
+	"""
+	Index of the locations of an object's annotations, by annotation ID
+
+	The index is built from an annotation tree whose pairs carry IDs (see
+	``qidata.qidataobject.Annotation``). It must be built again when the
+	tree is replaced (see ``isBuiltFrom``), or when locations may have been
+	modified in place (see ``invalidate``).
+	"""
+
+	# ───────────
+	# Constructor
+
+	def __init__(self, structure_function=gridFor):
+		"""
+		Create an empty index
+
+		:param structure_function: Function returning the empty structure
+		 holding the locations, given the bounds of all of them (``gridFor``
+		 for rectangles, ``intervalsFor`` for intervals)
+		"""
+		self._structure_function = structure_function
+		self._structure = None
+		self._annotations = None
+		self._bounds = dict()
+		self._order = dict()
+		self._next_order = 0
+
+	# ──────────
+	# Public API
+
+	def build(self, annotations, bounds_function):
+		"""
+		Index the locations of all annotations
+
+		:param annotations: Annotation tree
+		:type annotations: collections.OrderedDict
+		:param bounds_function: Function giving the bounds of a location, or
+		 None if the location must not be indexed
+		"""
+		entries = [(pair.id, bounds_function(pair[1]))
+		             for typed_annotations in annotations.values()
+		               for annotation_list in typed_annotations.values()
+		                 for pair in annotation_list]
+		entries = [(annotation_id, bounds)
+		             for annotation_id, bounds in entries if bounds is not None]
+		self._structure = self._structure_function(
+		                    [bounds for _, bounds in entries]
+		                  )
+		self._annotations = annotations
+		self._bounds = dict()
+		self._order = dict()
+		self._next_order = 0
+		for annotation_id, bounds in entries:
+			self.insert(annotation_id, bounds)
+
+	def insert(self, annotation_id, bounds):
+		"""
+		Index the location of an annotation
+
+		:param annotation_id: ID of the annotation
+		:type annotation_id: str
+		:param bounds: Bounds of its location (nothing is indexed if None)
+		:type bounds: tuple
+		"""
+		if bounds is None:
+			return
+		self._structure.insert(annotation_id, bounds)
+		self._bounds[annotation_id] = bounds
+		if not self._order.has_key(annotation_id):
+			self._order[annotation_id] = self._next_order
+			self._next_order += 1
+
+	def isBuiltFrom(self, annotations):
+		"""
+		Return True if the index was built from the given annotation tree
+		"""
+		return self._structure is not None and self._annotations is annotations
+
+	def invalidate(self):
+		"""
+		Forget all locations, so that the index is built again
+		"""
+		self._structure = None
+		self._annotations = None
+		self._bounds = dict()
+		self._order = dict()
+
+	def move(self, annotation_id, bounds):
+		"""
+		Index a new location for an annotation, keeping its order
+
+		:param annotation_id: ID of the annotation
+		:type annotation_id: str
+		:param bounds: Bounds of its new location (the annotation is
+		 forgotten if None)
+		:type bounds: tuple
+		"""
+		if bounds is None:
+			self.remove(annotation_id)
+			return
+		old_bounds = self._bounds.get(annotation_id)
+		if old_bounds is not None:
+			self._structure.remove(annotation_id, old_bounds)
+		self.insert(annotation_id, bounds)
+
+	def remove(self, annotation_id):
+		"""
+		Forget the location of an annotation, if it was indexed
+		"""
+		bounds = self._bounds.pop(annotation_id, None)
+		if bounds is not None:
+			self._structure.remove(annotation_id, bounds)
+		self._order.pop(annotation_id, None)
+
+	def search(self, bounds):
+		"""
+		Return the IDs of the annotations whose location overlaps ``bounds``
+
+		:param bounds: Bounds of the searched region
+		:type bounds: tuple
+		:return: IDs, in the order they were indexed
+		:rtype: list
+		"""
+		return sorted(
+		  [annotation_id
+		     for annotation_id in self._structure.candidates(bounds)
+		       if overlaps(bounds, self._bounds[annotation_id])],
+		  key=self._order.get
+		)
@@ -35,6 +35,7 @@ QiDataSensorFile specialization for audio files
 # Local modules
 from qidata import DataType
 from qidata.qidatasensorfile import QiDataSensorFile
+import _spatial_index
 
 class QiDataAudioFile(QiDataSensorFile):
 	# ───────────
@@ -66,6 +67,62 @@ class QiDataAudioFile(QiDataSensorFile):
 		"""
 		raise NotImplementedError
 
+	# ──────────
+	# Public API
+
+	def queryAt(self, sample, annotator=None, annotation_type=None):
+		"""
+		Return the IDs of the annotations whose location contains a sample
+
+		See ``queryInterval``.
+
+		:param sample: Index of the sample
+		:type sample: int
+		:param annotator: Only return annotations made by this annotator
+		:type annotator: str
+		:param annotation_type: Only return annotations of this type
+		:type annotation_type: str or ``qidata.MetadataType``
+		:rtype: list
+		"""
+		return self.queryInterval(sample, sample+1, annotator, annotation_type)
+
+	def queryInterval(self, start, end, annotator=None, annotation_type=None):
+		"""
+		Return the IDs of the annotations whose location overlaps an interval
+
+		:param start: First sample of the interval (included)
+		:type start: int
+		:param end: Last sample of the interval (excluded)
+		:type end: int
+		:param annotator: Only return annotations made by this annotator
+		:type annotator: str
+		:param annotation_type: Only return annotations of this type
+		:type annotation_type: str or ``qidata.MetadataType``
+		:return: IDs of the matching annotations (see
+		 ``getAnnotationById``), the most recently added ones last
+		:rtype: list
+		:raises: TypeError if [start, end] is not a non-empty interval of
+		 samples
+
+		:Example:
+			>>> with qidata.open("speech.wav", "r") as f:
+			>>>     for annotation_id in f.queryAt(16000, "jdoe"):
+			>>>         print f.getAnnotationById(annotation_id)
+
+		.. note::
+
+			Intervals are kept sorted by their start, in an index built on the
+			first query and kept up to date when annotations are added, updated
+			or removed. Annotations without location are never returned.
+		"""
+		bounds = _spatial_index.intervalBounds([start, end])
+		if bounds is None:
+			raise TypeError("[%s, %s] is not an interval"%(start, end))
+		return self._queryLocations(bounds, annotator, annotation_type)
+
+	# ───────────
+	# Private API
+
 	def _isLocationValid(self, location):
 		"""
 		Checks if a location given with an annotation is correct
@@ -86,4 +143,10 @@ class QiDataAudioFile(QiDataSensorFile):
 				 and isinstance(location[1],int)
 			)
 		except Exception:
-			return False
\ No newline at end of file
+			return False
+
+	def _locationBounds(self, location):
+		return _spatial_index.intervalBounds(location)
+
+	def _locationStructure(self, bounds_list):
+		return _spatial_index.intervalsFor(bounds_list)
\ No newline at end of file
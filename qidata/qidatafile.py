@@ -38,19 +38,39 @@ QiDataFile factory to easily open files as QiDataObjects.
 
 # Standard libraries
 import abc
+import contextlib
 import copy
 import os
 import re
+import threading
 from collections import OrderedDict
 
 # Third-party libraries
 from xmp.xmp import XMPFile, registerNamespace
 
 # Local modules
+import qidata
 from qidata import DataType
-from qidata.qidataobject import QiDataObject
+from qidata.qidataobject import QiDataObject, throwIfReadOnly
+import _annotation_index
+import _atomic_write
+import _consolidated_store
 import _mixin as xmp_tools
 
+# Format used to store annotations in files which have none yet (see
+# ``_mixin.ANNOTATION_FORMATS``). Files keep the format of their existing
+# annotations, unless converted with ``QiDataFile.convertAnnotations``.
+ANNOTATION_FORMAT = "xmp"
+
+# If True, XMP sidecar files opened in "r" mode are read without the XMP
+# toolkit, by ``_mixin.XMPSidecarReader``
+FAST_SIDECAR_READING = False
+
+# Number of objects opened in "w" mode which were closed with and without
+# writing their metadata
+_write_statistics = dict(written=0, skipped=0)
+_write_statistics_lock = threading.Lock()
+
 class ClosedFileException(Exception):pass
 
 def throwIfClosed(f):
@@ -61,6 +81,66 @@ def throwIfClosed(f):
 		return f(*args)
 	return wraps
 
+def openXMPFile(xmp_path, mode):
+	"""
+	Prepare an XMP file to be opened
+
+	:param xmp_path: Path of the file
+	:type xmp_path: str
+	:param mode: opening mode, "r" for reading, "w" for writing
+	:type mode: str
+	:return: XMP file, to open with its context manager
+	:rtype: xmp.xmp.XMPFile or _mixin.XMPSidecarReader
+
+	.. note::
+
+		If ``FAST_SIDECAR_READING`` is True and the file is an XMP sidecar
+		opened in "r" mode, it is read without the XMP toolkit (unless it
+		cannot be parsed that way).
+	"""
+	if FAST_SIDECAR_READING\
+	   and mode == "r"\
+	   and os.path.splitext(xmp_path)[1] == ".xmp":
+		try:
+			return xmp_tools.XMPSidecarReader(xmp_path)
+		except SyntaxError:
+			pass
+	return XMPFile(xmp_path, rw=(mode=="w"))
+
+def getWriteStatistics():
+	"""
+	Count the objects opened in "w" mode which were closed so far
+
+	:return: Number of closings which wrote metadata ("written") and of
+	         closings which had nothing to write ("skipped")
+	:rtype: dict
+
+	.. note::
+
+		Files opened by worker processes (see ``QiDataSet.examineContent``)
+		are not counted.
+	"""
+	with _write_statistics_lock:
+		return dict(_write_statistics)
+
+def resetWriteStatistics():
+	"""
+	Set the counters returned by ``getWriteStatistics`` back to 0
+	"""
+	with _write_statistics_lock:
+		for key in _write_statistics:
+			_write_statistics[key] = 0
+
+def _countWrite(written):
+	"""
+	Record the closing of an object opened in "w" mode
+
+	:param written: True if metadata had to be written
+	:type written: bool
+	"""
+	with _write_statistics_lock:
+		_write_statistics["written" if written else "skipped"] += 1
+
 # def getFileDataType(path):
 # 	"""
 # 	Return type of data stored in given file
@@ -95,42 +175,76 @@ class QiDataFile(QiDataObject):
 			The mode behavior is different from the regular Python file mode.
 			The file is NEVER created if it does not exist. Besides, opening
 			an existing file in "w" mode does not overwrite it.
+
+		.. note::
+			Modified metadata is always written in an external annotation file
+			(``file_path`` + ".xmp"). If it does not exist yet, it is created
+			when the file is closed, and only if something was modified.
+			If the file's folder is a dataset with a consolidated store, its
+			metadata is read from and written to that store instead.
 		"""
-		if os.path.splitext(file_path)[1] == ".xmp":
+		self._store_entry = _consolidated_store.storeOf(file_path)
+		if self._store_entry is not None:
+			# Metadata is kept in the dataset's consolidated store
+			file_path = os.path.join(
+			              os.path.dirname(file_path),
+			              self._store_entry[1]
+			            )
+			xmp_path = None
+
+		elif os.path.splitext(file_path)[1] == ".xmp":
 			# If file is a .xmp, just read it normally
 			# If the filename without xmp extension is an existing
 			# file, then mark it as the real file opened
 			xmp_path = file_path
 			if os.path.exists(os.path.splitext(file_path)[0]):
 				file_path = os.path.splitext(file_path)[0]
+			if mode=="w" and not os.path.exists(xmp_path):
+				# Create an empty XMP file that can be read
+				with XMPFile(xmp_path, rw=True):
+					pass
 
 		elif os.path.exists(file_path + ".xmp"):
 			# If there is an external annotation file, use it
 			xmp_path = file_path + ".xmp"
 
-		elif mode=="w":
-			# If there is no external annotation file but we are in "w" mode
-			# Copy the internal annotations in an external annotation file
-			xmp_path = file_path + ".xmp"
-			with XMPFile(file_path, rw=False) as _internal:
-				with XMPFile(xmp_path, rw=True) as _external:
-					_external.libxmp_metadata = _internal.libxmp_metadata
 		else:
 			# Open the internal annotations
+			# If we are in "w" mode, they will be copied in an external
+			# annotation file, but only if they are modified
 			xmp_path = file_path
 
 
 		# Store the file path
 		self._file_path = file_path
 
-		# And prepare the xmp file
-		self._xmp_file = XMPFile(xmp_path, rw=(mode=="w"))
+		# And prepare the xmp file. It is only read here, it will be opened
+		# for writing when closing, if anything was modified.
+		self._xmp_path = xmp_path
+		self._sidecar_path = xmp_path if xmp_path != file_path\
+		                      else file_path + ".xmp"
+		self._xmp_file = self._openXMPForReading()
+		self._mode = mode
 		self._is_closed = True
+		# Set while a dataset keeps the file open in its cache (only read-only
+		# files are cached)
+		self._cached = False
+		# Cleared by writers storing the file's annotations in the index
+		# themselves
+		self._update_index = True
 		self._open()
 
 	# ──────────
 	# Properties
 
+	@property
+	def annotation_format(self):
+		"""
+		Name of the format used to store the annotations (see
+		``_mixin.ANNOTATION_FORMATS``)
+		"""
+		return self._annotation_format
+
 	@property
 	def closed(self):
 		"""
@@ -146,7 +260,7 @@ class QiDataFile(QiDataObject):
 		"r" => read-only mode
 		"w" => read/write mode
 		"""
-		return "w" if self._xmp_file.rw else "r"
+		return self._mode
 
 	@property
 	def read_only(self):
@@ -165,48 +279,223 @@ class QiDataFile(QiDataObject):
 	def close(self):
 		"""
 		Closes the file after writing the metadata
+
+		.. note::
+
+			Metadata is only written if it was modified since the file was
+			opened. It is written in a temporary file, which then atomically
+			replaces the XMP file.
+			If the file belongs to a dataset having an annotation index, the
+			index is updated as well.
+			A read-only file returned by a dataset with a child cache is not
+			closed: it is only closed when it leaves the cache.
 		"""
-		if self.mode != "r":
-			xmp_tools._save_annotations(self._xmp_file, self.annotations)
-		self._xmp_file.close()
+		if self._cached:
+			return
+		read_only = self.read_only
+		modified = not read_only and self._isModified()
+		annotations_modified = not read_only and self._areAnnotationsModified()
+		self._releaseXMPFile()
+		if modified:
+			with self._openXMPForWriting() as _xmp_file:
+				self._saveMetadata(_xmp_file)
+		if not read_only:
+			_countWrite(modified)
 		self._is_closed = True
+		if annotations_modified and self._update_index\
+		   and qidata.isSupportedDataFile(self._file_path):
+			_annotation_index.updateIndexOf(self._file_path, self._annotations)
 
 	@throwIfClosed
 	def cancelChanges(self):
 		"""
 		Erase changes by reloading metadata from file
 		"""
-		# Re-load annotations
-		self._loadAnnotations()
+		# Drop annotations, they will be re-loaded on next access
+		self._loaded_annotations = None
+		self._annotation_format = self._stored_annotation_format\
+		                            or ANNOTATION_FORMAT
+
+	@throwIfClosed
+	@throwIfReadOnly
+	def convertAnnotations(self, annotation_format):
+		"""
+		Change the format used to store the annotations
+
+		:param annotation_format: Name of the new format (see
+		 ``_mixin.ANNOTATION_FORMATS``)
+		:type annotation_format: str
+		:raises: TypeError if the format is unknown
+
+		.. note::
+
+			The annotations are converted when the file is closed. If they
+			were not modified, they are moved without being decoded, so that
+			converting them back gives the exact same content.
+		"""
+		if not xmp_tools.ANNOTATION_FORMATS.has_key(annotation_format):
+			raise TypeError(
+			        "%s is not a valid annotation format"%annotation_format
+			      )
+		self._annotation_format = annotation_format
 
 	@throwIfClosed
 	def addAnnotation(self, annotator, annotation, location=None):
-		QiDataObject.addAnnotation(self, annotator, annotation, location)
+		return QiDataObject.addAnnotation(self, annotator, annotation, location)
 
 	@throwIfClosed
 	def removeAnnotation(self, annotator, annotation, location=None):
-		QiDataObject.removeAnnotation(self, annotator, annotation, location)
+		return QiDataObject.removeAnnotation(self, annotator, annotation, location)
+
+	@throwIfClosed
+	def removeAnnotationById(self, annotation_id):
+		QiDataObject.removeAnnotationById(self, annotation_id)
+
+	@throwIfClosed
+	def updateAnnotation(self, annotation_id, annotation, location=None):
+		QiDataObject.updateAnnotation(self, annotation_id, annotation, location)
 
 	# ───────────
 	# Private API
 
+	@property
+	def _annotations(self):
+		"""
+		Annotations of the file, loaded from the XMP on first access
+		"""
+		if self._loaded_annotations is None:
+			self._loadAnnotations()
+		return self._loaded_annotations
+
+	@_annotations.setter
+	def _annotations(self, new_annotations):
+		self._loaded_annotations = new_annotations
+
+	def _areAnnotationsModified(self):
+		"""
+		Return True if the annotations differ from the stored ones
+
+		.. note::
+
+			Annotations that were never loaded cannot have been modified.
+		"""
+		return self._loaded_annotations is not None\
+		   and self._loaded_annotations != self._saved_annotations
+
+	def _isModified(self):
+		"""
+		Return True if any metadata must be written when closing the file
+
+		Subclasses storing more metadata must extend it.
+		"""
+		return self._areAnnotationsModified()\
+		   or (self._stored_annotation_format is not None\
+		       and self._stored_annotation_format != self._annotation_format)
+
+	def _saveMetadata(self, xmp_file):
+		"""
+		Write the metadata in the given XMP file
+
+		:param xmp_file: XMP file opened for writing
+		:type xmp_file: xmp.xmp.XMPFile
+
+		Subclasses storing more metadata must extend it.
+
+		.. note::
+
+			Annotations are left as they are stored if they were not
+			modified (unless their format changed).
+		"""
+		if self._areAnnotationsModified():
+			xmp_tools._save_annotations(
+			  xmp_file,
+			  self._annotations,
+			  self._annotation_format
+			)
+		elif self._stored_annotation_format != self._annotation_format:
+			xmp_tools._convert_annotations(xmp_file, self._annotation_format)
+
+	def _openXMPForReading(self):
+		"""
+		Prepare the file's XMP metadata to be read
+
+		:return: XMP file, to open with its context manager
+		"""
+		if self._store_entry is not None:
+			return _consolidated_store.StoredXMPFile(*self._store_entry)
+		return openXMPFile(self._xmp_path, "r")
+
+	@contextlib.contextmanager
+	def _openXMPForWriting(self):
+		"""
+		Open the file's XMP metadata to be written
+
+		:return: Context manager giving the XMP file to write in
+		"""
+		if self._store_entry is not None:
+			with _consolidated_store.StoredXMPFile(*self._store_entry,
+			                                       rw=True) as _xmp_file:
+				yield _xmp_file
+			return
+
+		# On first modification, the external annotation file is created
+		# from the internal annotations
+		with _atomic_write.openForWriting(self._sidecar_path,
+		                                  self._xmp_path) as _xmp_file:
+			yield _xmp_file
+		self._xmp_path = self._sidecar_path
+
 	def _open(self):
 		"""
 		Open the file
+
+		.. note::
+
+			Annotations are not decoded here, but on first access to
+			``annotations``, ``getAnnotations`` or ``addAnnotation``.
 		"""
 		# file.__init__(self, self._file_path, "r")
 		self._xmp_file.__enter__()
 		self._is_closed = False
-		self._loadAnnotations()
+		self._loaded_annotations = None
+		self._saved_annotations = None
+		self._stored_annotation_format = xmp_tools._annotationFormat(
+		                                   self._xmp_file
+		                                 )
+		self._annotation_format = self._stored_annotation_format\
+		                            or ANNOTATION_FORMAT
 		return self
 
-	@throwIfClosed
+	def _releaseXMPFile(self):
+		"""
+		Close the XMP file opened for reading, if still open
+
+		.. note::
+
+			The file itself stays open: metadata read later, like the
+			annotations, is read from a new handle which is closed right away.
+		"""
+		if self._xmp_file is not None:
+			self._xmp_file.close()
+			self._xmp_file = None
+
 	def _loadAnnotations(self):
 		"""
 		Loads annotations
+
+		.. note::
+
+			If the XMP file was released before the annotations were ever
+			accessed, it is opened again, in read-only mode, to load them.
 		"""
-		# Load annotations
-		self._annotations = xmp_tools._load_annotations(self._xmp_file)
+		if self._xmp_file is not None:
+			self._annotations = xmp_tools._load_annotations(self._xmp_file)
+		else:
+			with self._openXMPForReading() as _xmp_file:
+				self._annotations = xmp_tools._load_annotations(_xmp_file)
+		if not self.read_only:
+			# Keep what is stored, to know if it must be written again
+			self._saved_annotations = copy.deepcopy(self._loaded_annotations)
 
 	# ───────────────
 	# Context Manager
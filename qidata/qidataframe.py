@@ -122,23 +122,23 @@ class QiDataFrame(QiDataFile):
 	def annotations(self):
 		return QiDataFile.annotations.__get__(self)
 
-	# ──────────
-	# Public API
-
-	def close(self):
-		"""
-		Closes the file frame after writing the metadata
-		"""
-		if self.mode != "r":
-			# Erase current frame content's metadata
-			_raw_metadata = self._xmp_file.metadata[QIDATA_FRAME_NS]
-			setattr(_raw_metadata, "files", list(self._files))
-
-		QiDataFile.close(self)
+	@property
+	@throwIfInvalid
+	def annotators(self):
+		return QiDataFile.annotators.__get__(self)
 
 	# ───────────
 	# Private API
 
+	def _isModified(self):
+		return QiDataFile._isModified(self) or self._files != self._saved_files
+
+	def _saveMetadata(self, xmp_file):
+		QiDataFile._saveMetadata(self, xmp_file)
+		# Erase current frame content's metadata
+		_raw_metadata = xmp_file.metadata[QIDATA_FRAME_NS]
+		setattr(_raw_metadata, "files", list(self._files))
+
 	def _isLocationValid(self, location):
 		"""
 		Checks if a location given with an annotation is correct
@@ -178,7 +178,10 @@ class QiDataFrame(QiDataFile):
 		# Load content info stored in metadata
 		_raw_metadata = self._xmp_file.metadata[QIDATA_FRAME_NS]
 		if _raw_metadata.children:
-			data = _raw_metadata.value
-			xmp_tools._removePrefixes(data)
+			data = xmp_tools._namespaceValue(_raw_metadata)
 			self._files = set(data["files"])
+			self._saved_files = set(self._files)
+		else:
+			# Nothing stored yet, the files must be written
+			self._saved_files = None
 		return self
@@ -42,13 +42,15 @@ from image import Image
 # Local modules
 from qidata import DataType
 from qidata.qidatasensorfile import QiDataSensorFile
+import _spatial_index
 
 class QiDataImageFile(QiDataSensorFile):
 	# ───────────
 	# Constructor
 
 	def __init__(self, file_path, mode = "r"):
-		self._raw_data = Image(file_path)
+		# Image is only decoded when ``raw_data`` is accessed
+		self._raw_data = None
 		QiDataSensorFile.__init__(self, file_path, mode)
 
 	# ──────────
@@ -69,9 +71,79 @@ class QiDataImageFile(QiDataSensorFile):
 	def raw_data(self):
 		"""
 		Returns the image opened with OpenCV
+
+		.. note::
+
+			The image is decoded on first access, and kept until
+			``release_raw_data`` is called.
 		"""
+		if self._raw_data is None:
+			self._raw_data = Image(self.name)
 		return self._raw_data
 
+	# ──────────
+	# Public API
+
+	def queryPoint(self, x, y, annotator=None, annotation_type=None):
+		"""
+		Return the IDs of the annotations whose location contains a point
+
+		See ``queryRegion``.
+
+		:param x: Abscissa of the point
+		:param y: Ordinate of the point
+		:param annotator: Only return annotations made by this annotator
+		:type annotator: str
+		:param annotation_type: Only return annotations of this type
+		:type annotation_type: str or ``qidata.MetadataType``
+		:rtype: list
+		"""
+		return self.queryRegion([[x, y], [x, y]], annotator, annotation_type)
+
+	def queryRegion(self, region, annotator=None, annotation_type=None):
+		"""
+		Return the IDs of the annotations whose location overlaps a region
+
+		:param region: Rectangle of the form [[x0, y0], [x1, y1]] (borders
+		 included)
+		:type region: list
+		:param annotator: Only return annotations made by this annotator
+		:type annotator: str
+		:param annotation_type: Only return annotations of this type
+		:type annotation_type: str or ``qidata.MetadataType``
+		:return: IDs of the matching annotations (see
+		 ``getAnnotationById``), the most recently added ones last
+		:rtype: list
+		:raises: TypeError if ``region`` is not a rectangle
+
+		:Example:
+			>>> with qidata.open("image.png", "r") as f:
+			>>>     for annotation_id in f.queryPoint(120, 45):
+			>>>         print f.getAnnotationById(annotation_id)
+
+		.. note::
+
+			Rectangular locations are registered in a uniform grid, built on
+			the first query and kept up to date when annotations are added,
+			updated or removed. Annotations without location are never
+			returned.
+		"""
+		bounds = _spatial_index.normalizedRectangle(region)
+		if bounds is None:
+			raise TypeError("%s is not a rectangle"%str(region))
+		return self._queryLocations(bounds, annotator, annotation_type)
+
+	def release_raw_data(self):
+		"""
+		Free the decoded image, if any
+
+		It will be decoded again on next access to ``raw_data``.
+		"""
+		self._raw_data = None
+
+	# ───────────
+	# Private API
+
 	def _isLocationValid(self, location):
 		"""
 		Checks if a location given with an annotation is correct
@@ -95,10 +167,16 @@ class QiDataImageFile(QiDataSensorFile):
 		except Exception:
 			return False
 
+	def _locationBounds(self, location):
+		return _spatial_index.normalizedRectangle(location)
+
 	# ──────────────
 	# Textualization
 
 	def __unicode__(self):
 		res_str = QiDataSensorFile.__unicode__(self)
+		was_decoded = self._raw_data is not None
 		res_str += "Image shape: " + str(self.raw_data.numpy_image.shape) + "\n"
+		if not was_decoded:
+			self.release_raw_data()
 		return res_str
\ No newline at end of file
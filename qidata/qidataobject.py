@@ -32,6 +32,7 @@
 from collections import OrderedDict
 import copy
 import abc
+import uuid
 
 # Local modules
 from qidata import MetadataType
@@ -51,6 +52,133 @@ def throwIfReadOnly(f):
 	wraps.__doc__ = f.__doc__
 	return wraps
 
+def newAnnotationId():
+	"""
+	Return a new annotation ID
+	"""
+	return uuid.uuid4().hex
+
+class Annotation(list):
+	"""
+	[annotation, location] pair, carrying the ID of the annotation
+
+	It compares equal to the plain [annotation, location] list, so that IDs
+	do not change how annotations are compared. The ID is kept by copies.
+	"""
+	def __init__(self, pair=(), annotation_id=None):
+		"""
+		:param pair: The [annotation, location] pair
+		:type pair: list
+		:param annotation_id: ID of the annotation (a new one by default)
+		:type annotation_id: str
+		"""
+		list.__init__(self, pair)
+		self.id = annotation_id if annotation_id is not None\
+		            else newAnnotationId()
+
+def _throwReadOnly(self, *args, **kwargs):
+	raise TypeError("Annotations returned by a QiDataObject are read-only")
+
+class _ReadOnlyMapping(object):
+	"""
+	Mixin disabling the methods modifying a mapping
+	"""
+	__setitem__ = __delitem__ = _throwReadOnly
+	clear = pop = popitem = setdefault = update = _throwReadOnly
+
+	def __deepcopy__(self, memo):
+		# Copies can be modified
+		out = self._modifiable_type()
+		for key, value in self.iteritems():
+			out[key] = copy.deepcopy(value, memo)
+		return out
+
+class _ReadOnlyDict(_ReadOnlyMapping, dict):
+	_modifiable_type = dict
+
+	def __init__(self, items=()):
+		dict.__init__(self, items)
+
+class _ReadOnlyOrderedDict(_ReadOnlyMapping, OrderedDict):
+	_modifiable_type = OrderedDict
+
+	def __init__(self, items=()):
+		OrderedDict.__init__(self)
+		if isinstance(items, dict):
+			items = items.iteritems()
+		for key, value in items:
+			OrderedDict.__setitem__(self, key, value)
+
+class _ReadOnlyList(list):
+	"""
+	List whose content cannot be modified
+	"""
+	__setitem__ = __delitem__ = __setslice__ = __delslice__ = _throwReadOnly
+	__iadd__ = __imul__ = _throwReadOnly
+	append = extend = insert = pop = remove = reverse = sort = _throwReadOnly
+
+	def __deepcopy__(self, memo):
+		# Copies can be modified
+		return [copy.deepcopy(value, memo) for value in list.__iter__(self)]
+
+class _ReadOnlyAnnotation(_ReadOnlyList):
+	"""
+	Read-only [annotation, location] pair, sharing the annotation and the
+	location of an ``Annotation``
+
+	They are copied each time they are accessed, so that they cannot be
+	modified through the pair.
+	"""
+	def __init__(self, pair):
+		list.__init__(self, pair)
+		self.id = getattr(pair, "id", None)
+
+	def __getitem__(self, index):
+		return copy.deepcopy(list.__getitem__(self, index))
+
+	def __getslice__(self, start, stop):
+		return copy.deepcopy(list.__getslice__(self, start, stop))
+
+	def __iter__(self):
+		for value in list.__iter__(self):
+			yield copy.deepcopy(value)
+
+	def __deepcopy__(self, memo):
+		return Annotation(
+		  [copy.deepcopy(value, memo) for value in list.__iter__(self)],
+		  self.id
+		)
+
+def _readOnlyAnnotations(annotations):
+	"""
+	Return a read-only copy of an annotation tree
+
+	Only the containers are copied, the metadata objects and the locations
+	are shared with ``annotations`` (see ``_ReadOnlyAnnotation``).
+	"""
+	def _readOnlyMapping(mapping, items):
+		if isinstance(mapping, OrderedDict):
+			return _ReadOnlyOrderedDict(items)
+		return _ReadOnlyDict(items)
+
+	return _readOnlyMapping(
+	  annotations,
+	  [
+	    (
+	      annotator,
+	      _readOnlyMapping(
+	        typed_annotations,
+	        [
+	          (
+	            annotation_name,
+	            _ReadOnlyList([_ReadOnlyAnnotation(pair) for pair in pairs])
+	          ) for annotation_name, pairs in typed_annotations.iteritems()
+	        ]
+	      )
+	    ) for annotator, typed_annotations in annotations.iteritems()
+	  ]
+	)
+
 class QiDataObject(object):
 	"""
 	Interface class representing a generic "data" element.
@@ -74,22 +202,31 @@ class QiDataObject(object):
 		"""
 		Return metadata content in the form of a ``collections.OrderedDict`` containing
 		metadata object instances or built-in types.
-		The returned object is a copy of the real metadata, therefore modifying it has no
-		impact on the underlying object.
+		The returned object is a read-only snapshot of the real metadata: it
+		cannot be modified, and the metadata objects it contains are copied
+		when accessed, therefore it has no impact on the underlying object.
+		``copy.deepcopy`` gives a modifiable copy.
 
-		:return: Copy of the registered annotations
+		:return: Read-only snapshot of the registered annotations
 		:rtype: ``collections.OrderedDict``
+
+		.. note::
+			The snapshot is only built again after the annotations are
+			modified, so reading them several times does not copy them.
 		"""
 		if not hasattr(self, "_annotations"):
 			self._annotations = OrderedDict()
-		return copy.deepcopy(self._annotations)
+		return self._annotationsSnapshot()
 
 	@property
 	def annotators(self):
 		"""
 		Return the list of annotators for this object
 		"""
-		return self.annotations.keys()
+		# Make sure self._annotations exists
+		assert(hasattr(self, "_annotations") or self.annotations is not None)
+
+		return self._annotations.keys()
 
 	@abc.abstractproperty
 	def read_only(self):
@@ -112,6 +249,9 @@ class QiDataObject(object):
 		:param annotation: The annotation to add
 		:type annotation: ``qidata.metadata_objects.MetadataObject``
 		:param location: The area of the annotation
+		:return: The ID of the new annotation (see ``removeAnnotationById``
+		 and ``updateAnnotation``)
+		:rtype: str
 
 		:raises: TypeError if ``annotation`` is not a
 		         ``qidata.metadata_objects.MetadataObject``
@@ -126,18 +266,7 @@ class QiDataObject(object):
 		# Make sure self._annotations exists
 		assert(hasattr(self, "_annotations") or self.annotations is not None)
 
-		# Check given annotation is a proper metadata objects
-		annotation_name = type(annotation).__name__
-		try:
-			MetadataType[annotation_name]
-			if not isinstance(annotation, MetadataObject):
-				raise KeyError
-		except KeyError:
-			raise TypeError("annotation is not a proper MetadataObject")
-
-		# Check if location is valid
-		if not self._isLocationValid(location):
-			raise Exception("Location %s is invalid"%str(location))
+		annotation_name = self._checkAnnotation(annotation, location)
 
 		# Create a new annotator if unknown
 		if not self._annotations.has_key(annotator):
@@ -147,44 +276,57 @@ class QiDataObject(object):
 		if not self._annotations[annotator].has_key(annotation_name):
 			self._annotations[annotator][annotation_name] = list()
 
-		self._annotations[annotator][annotation_name].append(
-		  [annotation, location]
-		)
+		pair = Annotation([annotation, location])
+		pairs = self._annotations[annotator][annotation_name]
+		pairs.append(pair)
+		self._annotationsById()[pair.id] = (annotator, annotation_name, pair)
+		self._id_positions[pair.id] = len(pairs) - 1
+		self._annotations_snapshot = None
+		return pair.id
+
+	def getAnnotationById(self, annotation_id):
+		"""
+		Return an annotation from its ID
+
+		:param annotation_id: ID of the annotation
+		:type annotation_id: str
+		:return: The annotator, the annotation and its location
+		:rtype: tuple
+		:raises: ValueError if no annotation has this ID
+		"""
+		annotator, _, pair = self._findAnnotation(annotation_id)
+		if self.read_only:
+			return (annotator,) + tuple(copy.deepcopy(pair))
+		else:
+			return (annotator, pair[0], pair[1])
+
+	def getAnnotationIds(self, annotator, annotation_type=None):
+		"""
+		Return the IDs of the annotations made by ``annotator`` of type
+		``annotation_type``, in the order of ``getAnnotations``
+		"""
+		pairs = self._selectAnnotations(annotator, annotation_type)
+		if not self._ensureIndexed(pairs):
+			pairs = self._selectAnnotations(annotator, annotation_type)
+		return [pair.id for pair in pairs]
 
 	def getAnnotations(self, annotator, annotation_type=None):
 		"""
 		Return the list of annotations made by ``annotator`` of type
 		``annotation_type``
 		"""
-		# Make sure self._annotations exists
-		assert(hasattr(self, "_annotations") or self.annotations is not None)
-
-		if not self._annotations.has_key(annotator):
-			return []
-
-		if annotation_type is not None:
-			# Check given type
-			try:
-				annotation_type = MetadataType[annotation_type]
-			except KeyError:
-				try:
-					annotation_type = MetadataType(annotation_type)
-				except ValueError:
-					raise TypeError(
-					          "%s is not a valid MetadataType"%annotation_type
-					      )
-
-			if not self._annotations[annotator].has_key(str(annotation_type)):
-				return []
-			else:
-				out = self._annotations[annotator][str(annotation_type)]
-		else:
-			out = [a for b in self._annotations[annotator].values() for a in b]
-
 		if self.read_only:
-			return copy.deepcopy(out)
-		else:
-			return out
+			# Parts of the read-only snapshot can be shared
+			out = self._selectAnnotations(annotator,
+			                              annotation_type,
+			                              self._annotationsSnapshot())
+			return out if isinstance(out, _ReadOnlyList)\
+			           else _ReadOnlyList(out)
+		# The returned annotations can be modified in place: the snapshot and
+		# the index of the IDs must be built again
+		self._annotations_snapshot = None
+		self._id_index_owner = None
+		return self._selectAnnotations(annotator, annotation_type)
 
 	@throwIfReadOnly
 	def removeAnnotation(self, annotator, annotation, location=None):
@@ -196,6 +338,8 @@ class QiDataObject(object):
 		:param annotation: The annotation to remove
 		:type annotation: ``qidata.metadata_objects.MetadataObject``
 		:param location: The area of the annotation
+		:return: The ID of the removed annotation
+		:rtype: str
 
 		:raises: TypeError if ``annotation`` is not a
 		         ``qidata.metadata_objects.MetadataObject``
@@ -214,14 +358,7 @@ class QiDataObject(object):
 		# Make sure self._annotations exists
 		assert(hasattr(self, "_annotations") or self.annotations is not None)
 
-		# Check given annotation is a proper metadata objects
-		annotation_name = type(annotation).__name__
-		try:
-			MetadataType[annotation_name]
-			if not isinstance(annotation, MetadataObject):
-				raise KeyError
-		except KeyError:
-			raise TypeError("annotation is not a proper MetadataObject")
+		annotation_name = self._checkAnnotation(annotation)
 
 		# Do we know the annotator ?
 		if not self._annotations.has_key(annotator):
@@ -231,27 +368,21 @@ class QiDataObject(object):
 		# Otherwise, raise
 		if self._annotations[annotator].has_key(annotation_name):
 			first_matching = None
-			for annot, loc in self._annotations[annotator][annotation_name]:
+			pairs = self._annotations[annotator][annotation_name]
+			self._ensureIndexed(pairs)
+			for i, (annot, loc) in enumerate(pairs):
 				if annot == annotation and loc == location:
-					self._annotations[annotator][annotation_name].remove(
-					    [annot, loc]
-					)
-					if len(self._annotations[annotator][annotation_name])==0:
-						self._annotations[annotator].pop(annotation_name)
-						if len(self._annotations[annotator])==0:
-							self._annotations.pop(annotator)
-					return
+					return self._removeAnnotationAt(annotator, annotation_name, i)
 				elif annot == annotation\
 				  and first_matching is None\
 				  and location is None:
-					first_matching = [annot, loc]
+					first_matching = i
 			if first_matching is not None:
-				self._annotations[annotator][annotation_name].remove(first_matching)
-				if len(self._annotations[annotator][annotation_name])==0:
-					self._annotations[annotator].pop(annotation_name)
-					if len(self._annotations[annotator])==0:
-						self._annotations.pop(annotator)
-				return
+				return self._removeAnnotationAt(
+				  annotator,
+				  annotation_name,
+				  first_matching
+				)
 
 		raise ValueError(
 		  "Could not remove annotation %s for %s at location %s"%(
@@ -261,10 +392,260 @@ class QiDataObject(object):
 		  )
 		)
 
+	@throwIfReadOnly
+	def removeAnnotationById(self, annotation_id):
+		"""
+		Removes an annotation from its ID
+
+		:param annotation_id: ID of the annotation to remove, as returned by
+		 ``addAnnotation`` or ``getAnnotationIds``
+		:type annotation_id: str
+		:raises: ValueError if no annotation has this ID
+
+		.. note::
+			Unlike ``removeAnnotation``, no metadata object is compared: the
+			annotation and its position are found through an index of the IDs.
+		"""
+		annotator, annotation_name, pair = self._findAnnotation(annotation_id)
+		self._removeAnnotationAt(
+		  annotator,
+		  annotation_name,
+		  self._positionOfId(annotator, annotation_name, pair)
+		)
+
+	@throwIfReadOnly
+	def updateAnnotation(self, annotation_id, annotation, location=None):
+		"""
+		Replaces an annotation, keeping its ID
+
+		:param annotation_id: ID of the annotation to replace
+		:type annotation_id: str
+		:param annotation: The new annotation
+		:type annotation: ``qidata.metadata_objects.MetadataObject``
+		:param location: The new area of the annotation
+
+		:raises: ValueError if no annotation has this ID
+		:raises: TypeError if ``annotation`` is not a
+		         ``qidata.metadata_objects.MetadataObject``
+		:raises: Exception if ``_isLocationValid(location)`` returns False
+
+		.. note::
+			The annotation keeps its position, unless its type changes. In
+			that case, it is moved at the end of the annotations of its new
+			type.
+		"""
+		annotator, annotation_name, pair = self._findAnnotation(annotation_id)
+		new_annotation_name = self._checkAnnotation(annotation, location)
+		if new_annotation_name != annotation_name:
+			self._removeAnnotationAt(
+			  annotator,
+			  annotation_name,
+			  self._positionOfId(annotator, annotation_name, pair)
+			)
+			if not self._annotations.has_key(annotator):
+				self._annotations[annotator] = dict()
+			if not self._annotations[annotator].has_key(new_annotation_name):
+				self._annotations[annotator][new_annotation_name] = list()
+			pairs = self._annotations[annotator][new_annotation_name]
+			pairs.append(pair)
+			self._annotationsById()[annotation_id] = (
+			  annotator,
+			  new_annotation_name,
+			  pair
+			)
+			self._id_positions[annotation_id] = len(pairs) - 1
+		pair[0] = annotation
+		pair[1] = location
+		self._annotations_snapshot = None
 
 	# ───────────
 	# Private API
 
+	def _annotationsById(self):
+		"""
+		Return the index of the annotations by ID
+
+		The index maps each ID to the annotator, the type and the
+		[annotation, location] pair. It is built on first use, giving an ID
+		to annotations which have none, and kept up to date by the methods
+		modifying annotations. It is built again if the annotations are
+		replaced (for instance when they are loaded).
+		The position of each annotation in its list is kept alongside, in
+		``_id_positions``.
+		"""
+		# Make sure self._annotations exists
+		assert(hasattr(self, "_annotations") or self.annotations is not None)
+
+		if getattr(self, "_id_index_owner", None) is not self._annotations:
+			index = dict()
+			positions = dict()
+			for annotator, typed_annotations in self._annotations.iteritems():
+				for annotation_name, pairs in typed_annotations.iteritems():
+					for i, pair in enumerate(pairs):
+						if not isinstance(pair, Annotation):
+							pair = pairs[i] = Annotation(pair)
+						index[pair.id] = (annotator, annotation_name, pair)
+						positions[pair.id] = i
+			self._id_index = index
+			self._id_positions = positions
+			self._id_index_owner = self._annotations
+		return self._id_index
+
+	def _annotationsSnapshot(self):
+		"""
+		Return a read-only copy of the annotations (see ``annotations``)
+
+		The copy is kept until the annotations are modified or replaced (for
+		instance when they are loaded).
+		"""
+		if getattr(self, "_annotations_snapshot", None) is None\
+		   or self._snapshot_owner is not self._annotations:
+			self._annotations_snapshot = _readOnlyAnnotations(self._annotations)
+			self._snapshot_owner = self._annotations
+		return self._annotations_snapshot
+
+	def _checkAnnotation(self, annotation, location=None):
+		"""
+		Checks an annotation and its location before it is stored
+
+		:return: Name of the annotation's type
+		:rtype: str
+		:raises: TypeError if ``annotation`` is not a
+		         ``qidata.metadata_objects.MetadataObject``
+		:raises: Exception if ``_isLocationValid(location)`` returns False
+		"""
+		# Check given annotation is a proper metadata objects
+		annotation_name = type(annotation).__name__
+		try:
+			MetadataType[annotation_name]
+			if not isinstance(annotation, MetadataObject):
+				raise KeyError
+		except KeyError:
+			raise TypeError("annotation is not a proper MetadataObject")
+
+		# Check if location is valid
+		if not self._isLocationValid(location):
+			raise Exception("Location %s is invalid"%str(location))
+
+		return annotation_name
+
+	def _ensureIndexed(self, pairs):
+		"""
+		Make sure the given annotations have an ID and are indexed
+
+		Annotations can be added in place to the lists returned by
+		``getAnnotations``, as plain [annotation, location] lists. If some
+		are found, the index of the IDs is built again, which gives them one.
+
+		:param pairs: Annotations of this object
+		:type pairs: iterable
+		:return: False if the index had to be built again, True otherwise
+		:rtype: bool
+		"""
+		self._annotationsById()
+		if all(isinstance(pair, Annotation) for pair in pairs):
+			return True
+		self._id_index_owner = None
+		self._annotationsById()
+		return False
+
+	def _findAnnotation(self, annotation_id):
+		"""
+		Return the annotator, the type and the pair of an annotation ID
+
+		:raises: ValueError if no annotation has this ID
+		"""
+		try:
+			return self._annotationsById()[annotation_id]
+		except KeyError:
+			raise ValueError("No annotation has the ID %s"%annotation_id)
+
+	@staticmethod
+	def _positionOf(pairs, pair):
+		"""
+		Return the position of ``pair`` in ``pairs``, comparing identities
+		"""
+		for i, other in enumerate(pairs):
+			if other is pair:
+				return i
+		raise ValueError("Annotation is not in the list")
+
+	def _positionOfId(self, annotator, annotation_name, pair):
+		"""
+		Return the position of an indexed annotation in its list
+
+		.. note::
+			Lists returned by ``getAnnotations`` can be modified in place. If
+			the annotation is not at its recorded position, it is searched.
+		"""
+		pairs = self._annotations[annotator][annotation_name]
+		position = self._id_positions.get(pair.id)
+		if position is None or position >= len(pairs)\
+		   or pairs[position] is not pair:
+			position = self._positionOf(pairs, pair)
+		return position
+
+	def _removeAnnotationAt(self, annotator, annotation_name, position):
+		"""
+		Removes an annotation, and the annotator and type if they become empty
+
+		:return: The ID of the removed annotation
+		"""
+		index = self._annotationsById()
+		pairs = self._annotations[annotator][annotation_name]
+		pair = pairs.pop(position)
+		index.pop(pair.id, None)
+		self._id_positions.pop(pair.id, None)
+		self._annotations_snapshot = None
+
+		# The following annotations moved back by one
+		for i in xrange(position, len(pairs)):
+			if isinstance(pairs[i], Annotation):
+				self._id_positions[pairs[i].id] = i
+
+		if len(pairs)==0:
+			self._annotations[annotator].pop(annotation_name)
+			if len(self._annotations[annotator])==0:
+				self._annotations.pop(annotator)
+		return pair.id
+
+	def _selectAnnotations(self, annotator, annotation_type=None,
+	                             annotations=None):
+		"""
+		Return the annotations made by ``annotator`` of type
+		``annotation_type``, without copying them
+
+		:param annotations: Annotation tree to select from (the object's
+		 annotations by default)
+		:raises: TypeError if ``annotation_type`` is not a valid MetadataType
+		"""
+		# Make sure self._annotations exists
+		assert(hasattr(self, "_annotations") or self.annotations is not None)
+
+		if annotations is None:
+			annotations = self._annotations
+		if not annotations.has_key(annotator):
+			return []
+
+		if annotation_type is not None:
+			# Check given type
+			try:
+				annotation_type = MetadataType[annotation_type]
+			except KeyError:
+				try:
+					annotation_type = MetadataType(annotation_type)
+				except ValueError:
+					raise TypeError(
+					          "%s is not a valid MetadataType"%annotation_type
+					      )
+
+			if not annotations[annotator].has_key(str(annotation_type)):
+				return []
+			else:
+				return annotations[annotator][str(annotation_type)]
+		else:
+			return [a for b in annotations[annotator].values() for a in b]
+
 	@abc.abstractmethod
 	def _isLocationValid(self, location):
 		"""
@@ -284,10 +665,14 @@ class QiDataObject(object):
 		return unicode(self).encode(encoding="utf-8")
 
 	def __unicode__(self):
+		# Make sure self._annotations exists
+		assert(hasattr(self, "_annotations") or self.annotations is not None)
+
+		# Annotations are only read here, there is no need to copy them
 		res_str = ""
-		for annotator in self.annotators:
+		for annotator in self._annotations.keys():
 			annotator_str = "Annotator: " + unicode(annotator)
 			res_str += annotator_str
-			res_str += textualize_metadata(self.annotations[annotator])
+			res_str += textualize_metadata(self._annotations[annotator])
 			res_str += "\n"
 		return res_str
\ No newline at end of file
@@ -28,6 +28,9 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+# Standard libraries
+import copy
+
 # Third-party libraries
 from xmp.xmp import XMPFile, registerNamespace
 
@@ -38,6 +41,7 @@ from qidata.qidatafile import QiDataFile, throwIfClosed
 from qidata.qidataobject import QiDataObject
 from qidata.qidatasensorobject import QiDataSensorObject
 import _mixin as xmp_tools
+import _spatial_index
 
 QIDATA_SENSOR_NS=u"http://softbank-robotics.com/qidatasensor/1"
 registerNamespace(QIDATA_SENSOR_NS, "qidatasensor")
@@ -47,33 +51,182 @@ class QiDataSensorFile(QiDataSensorObject, QiDataFile):
 	# ──────────
 	# Public API
 
-	def close(self):
+	def addAnnotation(self, annotator, annotation, location=None):
+		annotation_id = super(QiDataSensorFile, self).addAnnotation(
+		                  annotator,
+		                  annotation,
+		                  location
+		                )
+		if self._location_index.isBuiltFrom(self._annotations):
+			self._location_index.insert(
+			  annotation_id,
+			  self._locationBounds(location)
+			)
+		return annotation_id
+
+	def getAnnotations(self, annotator, annotation_type=None):
+		if not self.read_only:
+			# Locations can be modified in place, they must be indexed again
+			self._location_index.invalidate()
+		return super(QiDataSensorFile, self).getAnnotations(
+		         annotator,
+		         annotation_type
+		       )
+
+	@throwIfClosed
+	def cancelChanges(self):
 		"""
-		Closes the file after writing the metadata
+		Erase changes by reloading metadata from file
 		"""
-		if self.mode != "r":
-			_raw_metadata = self._xmp_file.metadata[QIDATA_SENSOR_NS]
-			setattr(_raw_metadata, "data_type", self.type)
-			setattr(_raw_metadata, "transform", self.transform)
-			setattr(_raw_metadata, "timestamp", self.timestamp)
-
-		super(QiDataSensorFile, self).close()
+		super(QiDataSensorFile, self).cancelChanges()
+		self._loadSensorMetadata()
+
+	def removeAnnotation(self, annotator, annotation, location=None):
+		annotation_id = super(QiDataSensorFile, self).removeAnnotation(
+		                  annotator,
+		                  annotation,
+		                  location
+		                )
+		if self._location_index.isBuiltFrom(self._annotations):
+			self._location_index.remove(annotation_id)
+		return annotation_id
+
+	def removeAnnotationById(self, annotation_id):
+		super(QiDataSensorFile, self).removeAnnotationById(annotation_id)
+		if self._location_index.isBuiltFrom(self._annotations):
+			self._location_index.remove(annotation_id)
+
+	def updateAnnotation(self, annotation_id, annotation, location=None):
+		super(QiDataSensorFile, self).updateAnnotation(
+		  annotation_id,
+		  annotation,
+		  location
+		)
+		if self._location_index.isBuiltFrom(self._annotations):
+			self._location_index.move(
+			  annotation_id,
+			  self._locationBounds(location)
+			)
 
 	# ───────────
 	# Private API
 
+	def _locationBounds(self, location):
+		"""
+		Return the bounds of a location in the location index
+
+		Subclasses whose locations can be searched must override it (see
+		``_spatial_index.normalizedRectangle`` and
+		``_spatial_index.intervalBounds``).
+
+		:return: Bounds of the location, or None if it must not be indexed
+		:rtype: tuple
+		"""
+		return None
+
+	def _locationStructure(self, bounds_list):
+		"""
+		Return the empty structure holding the location index
+
+		Subclasses whose locations are intervals must override it (see
+		``_spatial_index.intervalsFor``).
+
+		:param bounds_list: Bounds of all the indexed locations
+		:type bounds_list: list
+		"""
+		return _spatial_index.gridFor(bounds_list)
+
+	def _queryLocations(self, bounds, annotator=None, annotation_type=None):
+		"""
+		Return the IDs of the annotations whose location overlaps ``bounds``
+
+		The location index is built on the first query, and kept up to date
+		when annotations are added, updated or removed. It is built again if
+		the annotations are loaded again, or after ``getAnnotations`` gave
+		modifiable annotations.
+
+		:param bounds: Bounds of the searched region
+		:type bounds: tuple
+		:param annotator: Only return annotations made by this annotator
+		:type annotator: str
+		:param annotation_type: Only return annotations of this type
+		:type annotation_type: str or ``qidata.MetadataType``
+		:return: IDs of the matching annotations, the most recently added
+		 ones last
+		:rtype: list
+		"""
+		if annotation_type is not None:
+			annotation_type = str(annotation_type)
+		if not self._location_index.isBuiltFrom(self._annotations):
+			self._ensureIndexed(
+			  pair for typed_annotations in self._annotations.values()
+			         for pairs in typed_annotations.values()
+			           for pair in pairs
+			)
+			self._location_index.build(self._annotations, self._locationBounds)
+		annotations_by_id = self._annotationsById()
+
+		found = []
+		for annotation_id in self._location_index.search(bounds):
+			if not annotations_by_id.has_key(annotation_id):
+				# Removed from a list given by ``getAnnotations``, forget it
+				self._location_index.remove(annotation_id)
+				continue
+			_annotator, _annotation_type, _ = annotations_by_id[annotation_id]
+			if annotator is not None and annotator != _annotator:
+				continue
+			if annotation_type is not None\
+			   and annotation_type != _annotation_type:
+				continue
+			found.append(annotation_id)
+		return found
+
+	def _sensorMetadata(self):
+		"""
+		Return the sensor header, as it would be written
+		"""
+		return (self.type, self.transform, self.timestamp)
+
+	def _isModified(self):
+		return super(QiDataSensorFile, self)._isModified()\
+		   or self._sensorMetadata() != self._saved_sensor_metadata
+
+	def _saveMetadata(self, xmp_file):
+		super(QiDataSensorFile, self)._saveMetadata(xmp_file)
+		_raw_metadata = xmp_file.metadata[QIDATA_SENSOR_NS]
+		setattr(_raw_metadata, "data_type", self.type)
+		setattr(_raw_metadata, "transform", self.transform)
+		setattr(_raw_metadata, "timestamp", self.timestamp)
+
+	def _open(self):
+		super(QiDataSensorFile, self)._open()
+		self._loadSensorMetadata()
+		self._location_index = _spatial_index.LocationIndex(
+		                         self._locationStructure
+		                       )
+		return self
+
 	@throwIfClosed
-	def _loadAnnotations(self):
-		super(QiDataSensorFile, self)._loadAnnotations()
+	def _loadSensorMetadata(self):
+		"""
+		Loads the sensor header (data type, transform and timestamp)
 
-		# Load data type
+		.. note::
+
+			This is independent from the annotations, which are only decoded
+			when needed.
+		"""
 		_raw_metadata = self._xmp_file.metadata[QIDATA_SENSOR_NS]
 		if _raw_metadata.children:
-			data = _raw_metadata.value
-			xmp_tools._removePrefixes(data)
+			data = xmp_tools._namespaceValue(_raw_metadata)
 			self._type = DataType[data["data_type"]]
 			self._position = Transform(**data["transform"])
 			self._timestamp = TimeStamp(**data["timestamp"])
+			self._saved_sensor_metadata = copy.deepcopy(self._sensorMetadata())
+		else:
+			# Nothing stored yet: the default header is only written if it is
+			# modified, or with other metadata
+			self._saved_sensor_metadata = copy.deepcopy(self._sensorMetadata())
 
 	# ──────────────
 	# Textualization
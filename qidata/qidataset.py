@@ -29,31 +29,280 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 # Standard libraries
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import copy
+import functools
 import glob
+import itertools
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 
 # Third-party libraries
+import numpy
 from xmp.xmp import XMPFile, registerNamespace
 from strong_typing._textualize import textualize_sequence, textualize_mapping
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
 
 # Local modules
 import qidata
-from qidata import qidataframe, DataType, _BaseEnum
+from qidata import qidataframe, qidatafile, qidatasensorfile
+from qidata import DataType, _BaseEnum
 from qidata.metadata_objects import Context
-from qidata.qidataobject import QiDataObject, throwIfReadOnly
+from qidata.qidataobject import QiDataObject, ReadOnlyException
+from qidata.qidataobject import throwIfReadOnly
+from qidata._datastream import DataStream, matchTimestamps, toNanoseconds
+import _annotation_index
+import _atomic_write
+import _child_cache
+import _columnar_export
+import _consolidated_store
 import _mixin as xmp_tools
 
 QIDATA_CONTENT_NS=u"http://softbank-robotics.com/qidataset/1"
 registerNamespace(QIDATA_CONTENT_NS, "qidataset")
 
 METADATA_FILENAME = "metadata.xmp" # Place-holder
+MANIFEST_FILENAME = "metadata.manifest"
+MANIFEST_VERSION = 2
 
 def isDataset(path):
     return os.path.isdir(path)\
              and os.path.isfile(os.path.join(path, METADATA_FILENAME))
 
+def loadBoxes(path):
+	"""
+	Open a bundle written by ``QiDataSet.exportBoxes``
+
+	Columns of the returned bundle are memory-mapped, so opening it is cheap
+	and several processes reading it share the same pages.
+
+	:param path: Path of the bundle's folder
+	:type path: str
+	:rtype: qidata._columnar_export.BoxBundle
+	"""
+	return _columnar_export.BoxBundle(path)
+
+def _inspectChild(path):
+	"""
+	Open a data file and summarize its content
+
+	:param path: Path of the file to inspect
+	:type path: str
+	:return: The file's type name and the set of (annotator, metadata type)
+	 pairs it contains
+	:rtype: tuple
+
+	.. note::
+
+		This is a module-level function so that it can be sent to worker
+		processes.
+	"""
+	with qidata.open(path, "r") as _f:
+		return (
+		  str(_f.type),
+		  set(
+		    [
+		      (annotator, annotation_type)
+		        for annotator, annotations in _f._annotations.iteritems()
+		          for annotation_type in annotations.keys()
+		    ]
+		  )
+		)
+
+def _indexChild(path):
+	"""
+	Open a data file and convert its annotations into index rows
+
+	:param path: Path of the file to index
+	:type path: str
+	:return: Rows as returned by ``_annotation_index.annotationRows``
+	:rtype: list
+	"""
+	with qidata.open(path, "r") as _f:
+		return _annotation_index.annotationRows(_f._annotations)
+
+def _boxChild(path, attributes=()):
+	"""
+	Open a data file and extract its rectangle annotations
+
+	:param path: Path of the file
+	:type path: str
+	:param attributes: Names of the attributes to extract
+	:type attributes: list
+	:return: Rows as returned by ``_columnar_export.boxRows`` (empty if the
+	 file is not an image)
+	:rtype: list
+	"""
+	with qidata.open(path, "r") as _f:
+		if not str(_f.type).startswith("IMAGE"):
+			return []
+		return _columnar_export.boxRows(_f._annotations, attributes)
+
+def _annotateChild(path, annotator, annotations, indexed=False):
+	"""
+	Add several annotations to a data file
+
+	All annotations are checked before the file is modified, so that either
+	all of them or none of them are added.
+
+	:param path: Path of the file to annotate
+	:type path: str
+	:param annotator: The identifier of the annotations' maker
+	:type annotator: str
+	:param annotations: List of (MetadataObject, location) pairs
+	:type annotations: list
+	:param indexed: True if the file's dataset has an annotation index
+	:type indexed: bool
+	:return: The exception raised while annotating the file (None if it
+	 succeeded) and, if the dataset is indexed, the rows to store in the
+	 index for the file (see ``_annotation_index.annotationRows``)
+	:rtype: tuple
+
+	.. note::
+
+		The file does not update the annotation index itself when it is
+		closed: the caller must store the returned rows.
+	"""
+	rows = None
+	try:
+		with qidata.open(path, "w") as _f:
+			_f._update_index = False
+			for annotation, location in annotations:
+				_f._checkAnnotation(annotation, location)
+			for annotation, location in annotations:
+				_f.addAnnotation(annotator, annotation, location)
+			if indexed:
+				rows = _annotation_index.annotationRows(_f._annotations)
+	except Exception as e:
+		return e, None
+	return None, rows
+
+def _statChild(path):
+	"""
+	Return what must be unchanged for a file summary to still be valid
+
+	:param path: Path of the data file
+	:type path: str
+	:return: The file size, its modification time, the modification time of
+	 its external annotation file (None if there is none), then the inode
+	 number and change time of the file and of its external annotation file
+	:rtype: list
+
+	.. note::
+
+		Inode numbers and change times detect files replaced or restored
+		with their original modification time.
+	"""
+	file_stat = os.stat(path)
+	try:
+		xmp_stat = os.stat(path + ".xmp")
+		xmp_mtime, xmp_ino, xmp_ctime = xmp_stat.st_mtime,\
+		                                xmp_stat.st_ino,\
+		                                xmp_stat.st_ctime
+	except OSError:
+		xmp_mtime, xmp_ino, xmp_ctime = None, None, None
+	return [
+	  file_stat.st_size,
+	  file_stat.st_mtime,
+	  xmp_mtime,
+	  file_stat.st_ino,
+	  file_stat.st_ctime,
+	  xmp_ino,
+	  xmp_ctime
+	]
+
+def _readAnnotationContent(folder_path):
+	"""
+	Read the annotation content declared by a dataset
+
+	Only the "annotation_content" block of the dataset's metadata is read:
+	neither the frames nor the children are opened. If the metadata cannot be
+	read this way (for instance because it contains no dataset information
+	yet), the dataset is fully opened instead.
+
+	:param folder_path: Path of the dataset
+	:type folder_path: str
+	:return: Status name of every (annotator, metadata type) pair
+	:rtype: dict
+	"""
+	metadata_path = os.path.join(folder_path, METADATA_FILENAME)
+	try:
+		data = xmp_tools._readXMPProperties(
+		         metadata_path,
+		         QIDATA_CONTENT_NS,
+		         ["annotation_content"]
+		       )
+	except SyntaxError:
+		data = None
+
+	if data is None:
+		with QiDataSet(folder_path, "r") as ds:
+			return dict(
+			  (key, str(value))
+			    for key, value in ds.annotations_available.iteritems()
+			)
+
+	out = dict()
+	for annotator, content in data.get("annotation_content", dict()).iteritems():
+		for annot_type, value in content.iteritems():
+			out[(annotator, annot_type)] = str(value)
+	return out
+
+def _readNamespaces(xmp_path):
+	"""
+	Read the content of the qidata namespaces of an XMP file
+
+	:param xmp_path: Path of the file holding XMP metadata
+	:type xmp_path: str
+	:return: Content of each non-empty namespace, as read from XMP
+	:rtype: collections.OrderedDict
+	"""
+	out = OrderedDict()
+	with qidatafile.openXMPFile(xmp_path, "r") as _xmp_file:
+		for namespace in [xmp_tools.QIDATA_NS,
+		                  xmp_tools.QIDATA_PACKED_NS,
+		                  qidatasensorfile.QIDATA_SENSOR_NS,
+		                  qidataframe.QIDATA_FRAME_NS]:
+			_raw_metadata = _xmp_file.metadata[namespace]
+			if _raw_metadata.children:
+				out[namespace] = xmp_tools._namespaceValue(_raw_metadata)
+	return out
+
+def _mapPaths(function, paths, workers=None):
+	"""
+	Apply ``function`` on every path, possibly in a pool of processes
+
+	:param function: Module-level function to apply
+	:param paths: Paths to give to ``function``
+	:type paths: list
+	:param workers: Number of processes to use (None or 1 to stay in the
+	 current process)
+	:type workers: int
+	:return: Results of ``function``, in the same order as ``paths``
+	:rtype: list
+	"""
+	if workers is None or workers <= 1 or len(paths) <= 1:
+		return map(function, paths)
+
+	pool = multiprocessing.Pool(min(workers, len(paths)))
+	try:
+		return pool.map(
+		         function,
+		         paths,
+		         chunksize=max(1, len(paths)/(4*workers))
+		       )
+	finally:
+		pool.close()
+		pool.join()
+
 class QiDataSet(object):
 
 	class AnnotationStatus(_BaseEnum):
@@ -75,7 +324,7 @@ class QiDataSet(object):
 	# ───────────
 	# Constructor
 
-	def __init__(self, folder_path, mode="r"):
+	def __init__(self, folder_path, mode="r", cache_size=0):
 		"""
 		Open a QiDataSet.
 
@@ -83,6 +332,9 @@ class QiDataSet(object):
 		:type folder_path: str
 		:param mode: opening mode, "r" for reading, "w" for writing
 		:type mode: str
+		:param cache_size: Number of read-only children kept open by
+		 ``openChild`` (0 to open them again on each call)
+		:type cache_size: int
 
 		.. warnings::
 
@@ -121,10 +373,23 @@ class QiDataSet(object):
 
 		self._annotation_content = dict()
 		self._files_type = dict()
-		self._xmp_file = XMPFile(metadata_path, rw=(mode=="w"))
+		# metadata.xmp is only read here, it will be opened for writing when
+		# closing, if anything was modified
+		self._metadata_path = metadata_path
+		self._xmp_file = qidatafile.openXMPFile(metadata_path, "r")
+		self._mode = mode
+		self._saved_content = None
 		self._is_closed = True
 		self._streams = dict()
-		self._frames = list()
+		self._frame_paths = None
+		self._frame_files = dict()
+		self._loaded_frames = dict()
+		self._children = []
+		self._children_set = set()
+		self._children_mtime = None
+		self._manifest = self._loadManifest()
+		self._manifest_modified = False
+		self._child_cache = _child_cache.ChildCache(cache_size)
 		self._open()
 
 	# ──────────
@@ -151,17 +416,39 @@ class QiDataSet(object):
 		"""
 		return set([i[0] for i in self._annotation_content])
 
+	@property
+	def child_cache_statistics(self):
+		"""
+		Hits, misses and evictions of the cache of open children, and number
+		of children it holds (see ``openChild``)
+
+		:Example:
+			>>> with QiDataSet("dummy/dataset", "r", cache_size=2) as d:
+			>>>     d.child_cache_statistics
+			>>> {"hits": 0, "misses": 0, "evictions": 0, "size": 0}
+		"""
+		return self._child_cache.statistics
+
 	@property
 	def children(self):
 		"""
 		Return the list of supported files contained by the data set.
+
+		.. note::
+
+			The list is cached and only computed again when the folder's
+			modification time changes, or when ``refresh`` is called.
 		"""
-		ret = [fn
-		           for fn in os.listdir(self.name)
-		               if (qidata.isSupportedDataFile(fn))
-		      ]
-		ret.sort()
-		return ret
+		self._updateChildren()
+		return list(self._children)
+
+	@property
+	def consolidated(self):
+		"""
+		True if the metadata of the dataset's files and frames is kept in a
+		consolidated store instead of XMP files (see ``consolidate``)
+		"""
+		return os.path.isfile(_consolidated_store.storePath(self._folder_path))
 
 	@property
 	def context(self):
@@ -195,7 +482,7 @@ class QiDataSet(object):
 		"r" => read-only mode
 		"w" => read/write mode
 		"""
-		return "w" if self._xmp_file.rw else "r"
+		return self._mode
 
 	@property
 	def read_only(self):
@@ -229,62 +516,226 @@ class QiDataSet(object):
 			      )
 		with self.openChild(timestamp_file_pairs[0][1]) as f:
 			data_type = f.type
+		same_type_files = set(self._files_type.get(str(data_type), []))
 		for i in range(1,len(timestamp_file_pairs)):
-			if timestamp_file_pairs[i][1] in self._files_type[str(data_type)]:
+			if timestamp_file_pairs[i][1] in same_type_files:
 				continue
 			with self.openChild(timestamp_file_pairs[i][1]) as f:
 				if data_type == f.type:
 					continue
 			raise TypeError("Given files are not all of the same type")
-		self._streams[name] = (data_type, dict(timestamp_file_pairs))
+		self._streams[name] = DataStream(data_type, timestamp_file_pairs)
 
-	def close(self):
+	@throwIfReadOnly
+	def bulkAnnotate(self, mapping, annotator, workers=None):
 		"""
-		Closes the dataset after writing the metadata
+		Add annotations to many files of the dataset at once
+
+		Files are annotated independently (possibly in parallel): a file
+		which cannot be annotated is reported but does not stop the others.
+
+		:param mapping: For each file name, the list of (MetadataObject,
+		 location) pairs to add
+		:type mapping: dict
+		:param annotator: The identifier of the annotations' maker
+		:type annotator: str
+		:param workers: Number of threads writing the files (None or 1 to
+		 write them one after the other)
+		:type workers: int
+		:return: The exception raised for each file which could not be
+		 annotated (an empty dict if all files were annotated)
+		:rtype: dict
+
+		.. note::
+
+			A file is annotated only if all its annotations are valid. In
+			that case, the dataset's available annotations are updated with a
+			PARTIAL status (unless it was already known).
+			If the dataset has an annotation index, it is updated once all
+			files are written, from the calling thread.
+
+		:Example:
+			>>> with QiDataSet("dummy/dataset", "w") as d:
+			>>>     d.bulkAnnotate(
+			...       {"file.png": [(Property("key", "value"), [[0,0],[5,5]])]},
+			...       "jdoe"
+			...     )
+			>>> {}
 		"""
-		if self.mode != "r":
-			# Erase current dataset content's metadata
-			_raw_metadata = self._xmp_file.metadata[QIDATA_CONTENT_NS]
-			for key in _raw_metadata.attributes():
-				del _raw_metadata[key]
-
-			# Save new dataset content's metadata
-			for (key, value) in self._annotation_content.iteritems():
-				setattr(
-				    _raw_metadata.annotation_content,
-				    key[0],
-				    {key[1]:value}
+		names = mapping.keys()
+		tasks = []
+		failures = dict()
+		for name in names:
+			if self._isChild(name):
+				tasks.append(name)
+			else:
+				failures[name] = IOError(
+				  "%s is not a child of the current dataset"%name
 				)
 
-			setattr(
-			    _raw_metadata,
-			    "files_type",
-			    self._files_type
-			)
+		indexed = os.path.isfile(_annotation_index.indexPath(self._folder_path))
+		def _annotate(name):
+			return _annotateChild(
+			         os.path.join(self._folder_path, name),
+			         annotator,
+			         list(mapping[name]),
+			         indexed
+			       )
+
+		with self.groupCommit():
+			if workers is None or workers <= 1 or len(tasks) <= 1:
+				results = map(_annotate, tasks)
+			else:
+				pool = ThreadPool(min(workers, len(tasks)))
+				try:
+					results = pool.map(_annotate, tasks)
+				finally:
+					pool.close()
+					pool.join()
+
+		index_rows = []
+		for name, (error, rows) in zip(tasks, results):
+			if error is not None:
+				failures[name] = error
+				continue
+			if rows is not None:
+				index_rows.append((name, rows))
+			for annotation, _ in mapping[name]:
+				key = (annotator, type(annotation).__name__)
+				if not self._annotation_content.has_key(key):
+					self._annotation_content[key] =\
+					  QiDataSet.AnnotationStatus.PARTIAL
+
+		# A single connection writes the index, the workers did not
+		if index_rows:
+			with _annotation_index.AnnotationIndex(self._folder_path) as index:
+				for name, rows in index_rows:
+					index.setFileAnnotations(name, rows)
+		return failures
+
+	def buildIndex(self, workers=None):
+		"""
+		Create (or re-create) the annotation index of the dataset
 
-			setattr(
-			    _raw_metadata,
-			    "context",
-			    self.context
-			)
+		Every child is opened and its annotations are stored in an SQLite file
+		next to "metadata.xmp". Once the index exists, it is kept up to date
+		each time a child is closed in "w" mode, and it can be searched with
+		``query``.
+
+		:param workers: Number of processes used to read the files (see
+		 ``examineContent``)
+		:type workers: int
+		"""
+		names = self.children
+		rows = _mapPaths(
+		         _indexChild,
+		         [os.path.join(self._folder_path, name) for name in names],
+		         workers
+		       )
+		with _annotation_index.AnnotationIndex(self._folder_path) as index:
+			# Files which left the dataset are forgotten
+			index.removeOtherFiles(names)
+			for name, file_rows in zip(names, rows):
+				index.setFileAnnotations(name, file_rows)
+
+	def exportBoxes(self, path, attributes=(), workers=None):
+		"""
+		Export the rectangles annotated on the dataset's images in columns
+
+		The bundle is a folder of ``.npy`` files, one per column, which can be
+		memory-mapped with ``loadBoxes`` and fed to numerical code without
+		parsing any XMP file. Only annotations located by a rectangle
+		([[x0, y0], [x1, y1]]) are exported.
+
+		:param path: Path of the bundle's folder
+		:type path: str
+		:param attributes: Names of the metadata attributes to export as
+		 additional columns (nested attributes are named with dots, like
+		 "translation.x")
+		:type attributes: list
+		:param workers: Number of processes used to read the files (see
+		 ``examineContent``)
+		:type workers: int
+		"""
+		attributes = list(attributes)
+		names = self.children
+		rows = _mapPaths(
+		         functools.partial(_boxChild, attributes=attributes),
+		         [os.path.join(self._folder_path, name) for name in names],
+		         workers
+		       )
+		_columnar_export.writeBundle(path, names, rows, attributes)
 
-			# Save data streams (they need to be a little be reworked to fit
-			# XMP base rules, namely numbers cannot be keys so we add the
-			# letter "t" in front of the timestamps)
-			tmp_streams = dict()
-			for stream_name, stream in self._streams.iteritems():
-				tmp_streams[stream_name] = (stream[0],dict())
-				for (timestamp,filename) in stream[1].iteritems():
-					tmp_streams[stream_name][1]["t%d.%09d"%timestamp] = filename
+	def close(self):
+		"""
+		Closes the dataset after writing the metadata
 
-			setattr(_raw_metadata, "streams", tmp_streams)
+		.. note::
 
+			"metadata.xmp" and the manifest are only written if their content
+			was modified since the dataset was opened. "metadata.xmp" is
+			replaced atomically.
+		"""
+		self._child_cache.clear()
 		self._xmp_file.close()
-		for f in self._frames:
-			f.close()
+		if self.mode != "r":
+			modified = (self._contentMetadata() != self._saved_content)
+			if modified:
+				with _atomic_write.openForWriting(self._metadata_path)\
+				       as _xmp_file:
+					self._saveMetadata(_xmp_file)
+			if self._manifest_modified:
+				self._saveManifest()
+			qidatafile._countWrite(modified)
+
+		for f in self._loaded_frames.values():
+			if not f.closed:
+				f.close()
 		self._is_closed = True
 
-	def examineContent(self):
+	@throwIfReadOnly
+	def consolidate(self):
+		"""
+		Move the metadata of every file and frame into a consolidated store
+
+		The qidata namespaces of each child and frame are copied into a single
+		SQLite file next to "metadata.xmp". The external annotation files and
+		frame files are then removed. From then on, files of the dataset
+		(opened with ``openChild`` or directly with ``qidata.open``) read and
+		write their metadata in the store.
+
+		.. note::
+
+			Frames previously returned by the dataset are closed.
+			Internal annotations of the data files are left untouched, but
+			they are ignored as long as the dataset is consolidated.
+		"""
+		if self.consolidated:
+			return
+		self._forgetFrames()
+
+		entries = []
+		sidecars = []
+		for name in self.children:
+			path = os.path.join(self._folder_path, name)
+			if os.path.isfile(path + ".xmp"):
+				sidecars.append(path + ".xmp")
+				entries.append((name, _readNamespaces(path + ".xmp")))
+			else:
+				entries.append((name, _readNamespaces(path)))
+		for frame_path in self._discoverFrames():
+			sidecars.append(frame_path)
+			entries.append(
+			  (os.path.basename(frame_path), _readNamespaces(frame_path))
+			)
+
+		with _consolidated_store.ConsolidatedStore(self._folder_path) as store:
+			store.putMany(entries)
+		for sidecar in sidecars:
+			os.remove(sidecar)
+		self._frame_paths = None
+
+	def examineContent(self, workers=None):
 		"""
 		Examine all dataset's files to infer content information.
 
@@ -296,26 +747,78 @@ class QiDataSet(object):
 		Once all files have been studied, remaining annotations will be updated
 		with any known status that might have been present before this function
 		was called.
+
+		:param workers: Number of processes used to inspect the files. If None
+		or 1, files are inspected one after the other in the current process.
+		:type workers: int
+
+		.. note::
+
+			The result does not depend on ``workers``: summaries are merged in
+			the same order as ``children``.
+
+		.. note::
+
+			A summary of every file is kept in a manifest stored next to
+			"metadata.xmp". Only files whose size, modification time, inode
+			or change time (or the ones of their external annotation file)
+			changed since the last examination are opened again.
 		"""
 		_annotation_content = dict()
 		self._files_type = dict()
-		for name in self.children:
-			path = os.path.join(self._folder_path, name)
-			with qidata.open(path, "r") as _f:
-				for annotator, annotations in _f.annotations.iteritems():
-					for annotation_type in annotations.keys():
-						_annotation_content[
-						  (
-						    annotator,
-						    annotation_type
-						  )
-						] = QiDataSet.AnnotationStatus.PARTIAL
-				if not self._files_type.has_key(str(_f.type)):
-					self._files_type[str(_f.type)] = []
-				self._files_type[str(_f.type)].append(name)
-
-		for _f in self.getAllFrames():
-			for annotator, annotations in _f.annotations.iteritems():
+
+		# Only open the files which changed since their summary was made
+		names = self.children
+		stats = dict()
+		outdated = []
+		revisions = None
+		if self.consolidated:
+			# Metadata changes are tracked by the store revisions
+			with _consolidated_store.ConsolidatedStore(self._folder_path)\
+			       as store:
+				revisions = store.revisions()
+		for name in names:
+			stats[name] = _statChild(os.path.join(self._folder_path, name))
+			if revisions is not None:
+				stats[name][2] = revisions.get(name)
+			if not self._manifest.has_key(name)\
+			   or self._manifest[name]["stat"] != stats[name]:
+				outdated.append(name)
+		summaries = _mapPaths(
+		              _inspectChild,
+		              [os.path.join(self._folder_path, name) for name in outdated],
+		              workers
+		            )
+
+		manifest = dict()
+		for name in names:
+			manifest[name] = self._manifest.get(name)
+		for name, (file_type, file_annotations) in zip(outdated, summaries):
+			manifest[name] = dict(
+			                   stat=stats[name],
+			                   type=file_type,
+			                   annotations=file_annotations
+			                 )
+		if manifest != self._manifest:
+			self._manifest = manifest
+			self._manifest_modified = True
+
+		for name in names:
+			file_type = self._manifest[name]["type"]
+			for key in self._manifest[name]["annotations"]:
+				_annotation_content[key] = QiDataSet.AnnotationStatus.PARTIAL
+			if not self._files_type.has_key(file_type):
+				self._files_type[file_type] = []
+			self._files_type[file_type].append(name)
+
+		# Frames which were not requested yet are opened one at a time
+		for frame_path in self._discoverFrames():
+			if self._loaded_frames.has_key(frame_path):
+				frame_annotations = self._loaded_frames[frame_path].annotations
+			else:
+				with qidataframe.QiDataFrame(frame_path, "r") as _f:
+					frame_annotations = _f._annotations
+			for annotator, annotations in frame_annotations.iteritems():
 				for annotation_type in annotations.keys():
 					_annotation_content[
 					  (
@@ -391,7 +894,8 @@ class QiDataSet(object):
 	    dataset_list,
 	    only_annotated_by=None,
 	    only_with_annotations=None,
-	    only_total_annotations=False):
+	    only_total_annotations=False,
+	    workers=None):
 
 		"""
 		Filters out dataset not fitting the given criteria.
@@ -405,6 +909,11 @@ class QiDataSet(object):
 		:param only_total_annotations: States if only total annotations should
 		be considered
 		:type only_total_annotations: bool
+		:param workers: Number of processes used to read the datasets (None or
+		1 to read them one after the other)
+		:type workers: int
+		:return: The accepted datasets, in the same order as ``dataset_list``
+		:rtype: list
 
 		:Example:
 			The following command will only accept datasets containing total
@@ -417,23 +926,28 @@ class QiDataSet(object):
 			exclusively
 			>>> QiDataSet.filter(
 			...     dataset_lists,["jdoe"],["Property","Dummy"], False)
+
+		.. note::
+
+			Only the "annotation_content" part of each dataset's metadata is
+			read, the datasets are not opened.
 		"""
 		filtered = []
 
-		for dataset_path in dataset_list:
-			with QiDataSet(dataset_path,"r") as ds:
-				for a_ref, a_status in ds.annotations_available.iteritems():
-					if only_total_annotations\
-					   and a_status==QiDataSet.AnnotationStatus.PARTIAL:
-						continue
-					if only_annotated_by is not None\
-					   and not a_ref[0] in only_annotated_by:
-						continue
-					if only_with_annotations is not None\
-					   and not a_ref[1] in only_with_annotations:
-						continue
-					filtered.append(dataset_path)
-					break
+		contents = _mapPaths(_readAnnotationContent, dataset_list, workers)
+		for dataset_path, content in zip(dataset_list, contents):
+			for a_ref, a_status in content.iteritems():
+				if only_total_annotations\
+				   and a_status==str(QiDataSet.AnnotationStatus.PARTIAL):
+					continue
+				if only_annotated_by is not None\
+				   and not a_ref[0] in only_annotated_by:
+					continue
+				if only_with_annotations is not None\
+				   and not a_ref[1] in only_with_annotations:
+					continue
+				filtered.append(dataset_path)
+				break
 		return filtered
 
 	def getAllFilesOfType(self, type_name):
@@ -462,10 +976,8 @@ class QiDataSet(object):
 		:return: Every stream known by the data set
 		:rtype: dict
 		"""
-		return copy.deepcopy(
-			dict(
-				(name, data[1]) for (name, data) in self._streams.iteritems()
-			)
+		return dict(
+			(name, data.toDict()) for (name, data) in self._streams.iteritems()
 		)
 
 	def getStreamsOfType(self, data_type):
@@ -477,10 +989,8 @@ class QiDataSet(object):
 		:return: Every stream of the requested type known by the data set
 		:rtype: dict
 		"""
-		return copy.deepcopy(
-			dict(
-				(name, data[1]) for (name, data) in self._streams.iteritems() if data[0]==data_type
-			)
+		return dict(
+			(name, data.toDict()) for (name, data) in self._streams.iteritems() if data.data_type==data_type
 		)
 
 	def getStream(self, stream_name):
@@ -493,7 +1003,7 @@ class QiDataSet(object):
 		:rtype: dict
 		:raises: KeyError if stream_name does not exist
 		"""
-		return copy.deepcopy(self._streams[stream_name][1])
+		return self._streams[stream_name].toDict()
 
 	def getStreamType(self, stream_name):
 		"""
@@ -504,7 +1014,115 @@ class QiDataSet(object):
 		:return: The requested stream's data type
 		:rtype: ``qidata.DataType``
 		"""
-		return self._streams[stream_name][0]
+		return self._streams[stream_name].data_type
+
+	def getStreamRange(self, stream_name, start, end):
+		"""
+		Returns the files of a stream recorded between two timestamps
+
+		:param stream_name: Data stream of interest
+		:type stream_name: str
+		:param start: First timestamp of the range, as (seconds, nanoseconds)
+		:type start: tuple
+		:param end: Last timestamp of the range (included)
+		:type end: tuple
+		:return: Time-ordered list of (timestamp, filename) pairs
+		:rtype: list
+		:raises: KeyError if stream_name does not exist
+		"""
+		return self._streams[stream_name].between(start, end)
+
+	def getNearest(self, stream_name, timestamp, tolerance=None):
+		"""
+		Returns the file of a stream recorded the closest to a timestamp
+
+		:param stream_name: Data stream of interest
+		:type stream_name: str
+		:param timestamp: Requested timestamp, as (seconds, nanoseconds)
+		:type timestamp: tuple
+		:param tolerance: Maximal accepted time difference, as (seconds,
+		 nanoseconds)
+		:type tolerance: tuple
+		:return: The closest (timestamp, filename) pair, or None if no file
+		 is close enough
+		:rtype: tuple
+		:raises: KeyError if stream_name does not exist
+		"""
+		return self._streams[stream_name].nearest(timestamp, tolerance)
+
+	def iterStream(self, stream_name):
+		"""
+		Iterates over a stream in time order
+
+		:param stream_name: Data stream of interest
+		:type stream_name: str
+		:return: Generator of (timestamp, filename) pairs
+		:raises: KeyError if stream_name does not exist
+		"""
+		return iter(self._streams[stream_name])
+
+	def alignStreams(self,
+	                 reference,
+	                 others,
+	                 tolerance=None,
+	                 direction="nearest",
+	                 as_array=False):
+		"""
+		Pairs each file of a stream with the matching files of other streams
+
+		:param reference: Name of the stream whose files must be matched
+		:type reference: str
+		:param others: Names of the streams to search matching files in
+		:type others: list
+		:param tolerance: Maximal accepted time difference, as (seconds,
+		 nanoseconds)
+		:type tolerance: tuple
+		:param direction: "backward" to match the last file recorded before
+		 (or at the same time as) the reference one, "forward" for the first
+		 one recorded after, "nearest" for the closest one
+		:type direction: str
+		:param as_array: If True, returns a numpy structured array with a
+		 "timestamp" field (in nanoseconds) and one field per stream
+		:type as_array: bool
+		:return: For each file of the reference stream, in time order, a tuple
+		 with its name followed by the names of the matching files (None
+		 when there is no match)
+		:rtype: list or numpy.ndarray
+		:raises: KeyError if one of the streams does not exist
+		:raises: ValueError if direction is not valid
+
+		:Example:
+			>>> with QiDataSet("dummy/dataset", "r") as d:
+			>>>     d.alignStreams("front", ["depth"], tolerance=(0,50000000))
+			>>> [("front_0.png", "depth_0.png"), ("front_1.png", None)]
+		"""
+		ref_timestamps, ref_filenames = self._streams[reference].arrays
+		tolerance = None if tolerance is None else toNanoseconds(tolerance)
+		columns = [ref_filenames]
+		for name in others:
+			timestamps, filenames = self._streams[name].arrays
+			index = matchTimestamps(
+			          ref_timestamps,
+			          timestamps,
+			          tolerance,
+			          direction
+			        )
+			column = numpy.empty(len(index), dtype=object)
+			column[index >= 0] = filenames[index[index >= 0]]
+			columns.append(column)
+
+		if not as_array:
+			return zip(*columns) if others else [(f,) for f in ref_filenames]
+
+		out = numpy.empty(
+		        len(ref_timestamps),
+		        dtype=[("timestamp", numpy.int64)]\
+		             + [(str(name), object) for name in [reference] + others]
+		      )
+		out["timestamp"] = ref_timestamps
+		for name, column in zip([reference] + others, columns):
+			out[str(name)] = column
+		return out
 
 	def addToStream(self, stream_name, file_timestamp_pair_to_add):
 		"""
@@ -518,9 +1136,9 @@ class QiDataSet(object):
 		:raises: ValueError if file is not in the dataset
 		"""
 		_tmp=file_timestamp_pair_to_add
-		if not _tmp[1] in self.children:
+		if not self._isChild(_tmp[1]):
 			raise ValueError("Given file is not in the dataset")
-		self._streams[stream_name][1][_tmp[0]]=_tmp[1]
+		self._streams[stream_name].add(_tmp[0], _tmp[1])
 
 	def removeFromStream(self, stream_name, file_to_remove):
 		"""
@@ -533,11 +1151,9 @@ class QiDataSet(object):
 		:raises: KeyError if stream does not exist
 		:raises: ValueError if file is not in the stream
 		"""
-		for (ts, filename) in self._streams[stream_name][1].iteritems():
-			if filename == file_to_remove:
-				self._streams[stream_name][1].pop(ts)
-				break
-		else:
+		try:
+			self._streams[stream_name].remove(file_to_remove)
+		except ValueError:
 			raise ValueError("Given file is not in the stream")
 		# si le stream devient vide, on devrait le supprimer
 
@@ -554,8 +1170,12 @@ class QiDataSet(object):
 		"""
 		if len(files) < 2:
 			raise TypeError("createNewFrame needs at least 2 files (%d given)"%len(files))
+		self._discoverFrames()
 		frame = qidataframe.QiDataFrame.create(files, self._folder_path)
-		self._frames.append(frame)
+		frame._releaseXMPFile()
+		self._frame_paths.append(frame._file_path)
+		self._frame_files[frame._file_path] = set(files)
+		self._loaded_frames[frame._file_path] = frame
 		return frame
 
 	@throwIfReadOnly
@@ -576,14 +1196,19 @@ class QiDataSet(object):
 			f = self.getFrame(*files)
 		if f is None:
 			return
-		try:
-			self._frames.remove(f)
-		except ValueError:
-			pass
-		else:
-			f.close()
+		if self._loaded_frames.get(f._file_path) is f:
+			self._loaded_frames.pop(f._file_path)
+			self._frame_paths.remove(f._file_path)
+			self._frame_files.pop(f._file_path, None)
+			if not f.closed:
+				f.close()
 			f._is_valid=False
-			os.remove(f._file_path)
+			if self.consolidated:
+				with _consolidated_store.ConsolidatedStore(self._folder_path)\
+				       as store:
+					store.remove(os.path.basename(f._file_path))
+			else:
+				os.remove(f._file_path)
 
 	def getAllFrames(self):
 		"""
@@ -591,8 +1216,16 @@ class QiDataSet(object):
 
 		:return: Every frames of the dataset
 		:rtype: list
+
+		.. note::
+
+			Frames are opened the first time they are requested. Their
+			content is loaded and their XMP file is closed right away, so no
+			file handle is kept open for them. In "w" mode, the frames stay
+			open and their modifications are written when the dataset is
+			closed.
 		"""
-		return copy.copy(self._frames)
+		return [self._loadFrame(path) for path in self._discoverFrames()]
 
 	def getFrame(self, *files):
 		"""
@@ -603,11 +1236,80 @@ class QiDataSet(object):
 		:return: Researched frame
 		:rtype: :class:``QiDataFrame``
 		:raises: IndexError if no frame matches the requested files
+
+		.. note::
+
+			Only the list of files of each frame is read to find the
+			requested frame, and only the matching frame is opened.
 		"""
-		try:
-			return [f for f in self._frames if set(files)==f._files][0]
-		except IndexError:
-			return None
+		files = set(files)
+		for path in self._discoverFrames():
+			if files == self._getFrameFiles(path):
+				return self._loadFrame(path)
+		return None
+
+	def groupCommit(self):
+		"""
+		Group the disk synchronizations of the files written in a block
+
+		Every file is still replaced atomically when it is closed, but the
+		folder is synchronized once at the end of the block, instead of once
+		per written file. ``bulkAnnotate`` always does so.
+
+		:return: Context manager delimiting the group
+
+		:Example:
+			>>> with QiDataSet("dummy/dataset", "w") as d:
+			>>>     with d.groupCommit():
+			>>>         for name in d.children:
+			>>>             with d.openChild(name) as f:
+			>>>                 f.addAnnotation("jdoe", Property("k", "v"))
+
+		.. note::
+
+			The group covers every file written by the process during the
+			block, including files of other datasets.
+		"""
+		return _atomic_write.groupCommit()
+
+	def iterChildren(self, names=None, mode="r", prefetch=4, workers=2):
+		"""
+		Iterates over opened children, in order
+
+		While a child is being used, the next ones are opened in background
+		threads. Each child is closed when the iteration moves to the next one
+		(or stops).
+
+		:param names: Names of the children to open (all children by default)
+		:type names: list
+		:param mode: Opening mode of the children ("r" or "w")
+		:type mode: str
+		:param prefetch: Maximum number of children opened in advance
+		:type prefetch: int
+		:param workers: Number of threads opening the children
+		:type workers: int
+		:return: Generator of opened :class:``QiDataFile``
+		:raises: IOError if one of the names is not a child of the dataset
+		:raises: ReadOnlyException if mode is "w" but the dataset is not
+
+		:Example:
+			>>> with QiDataSet("dummy/dataset", "r") as d:
+			>>>     for f in d.iterChildren(prefetch=8, workers=4):
+			>>>         print f.annotators
+
+		.. warning::
+
+			A child must not be used anymore once the iteration moved past it.
+			Use ``openChild`` to keep a child open.
+		"""
+		if mode == "w" and self.read_only:
+			raise ReadOnlyException("Children cannot be opened in \"w\" mode")
+		names = self.children if names is None else list(names)
+		for name in names:
+			if not self._isChild(name):
+				raise IOError("%s is not a child of the current dataset"%name)
+
+		return self._iterChildren(names, mode, max(0, prefetch), workers)
 
 	def openChild(self, name):
 		"""
@@ -619,17 +1321,73 @@ class QiDataSet(object):
 		.. note::
 			The opening mode used to open children is the opening mode of the
 			QiDataSet itself
+
+		.. note::
+			If the dataset was opened in "r" mode with a ``cache_size``, the
+			most recently used children are kept open and the same object is
+			returned each time, as long as the file and its metadata do not
+			change on disk. Closing such a child does nothing: it is closed
+			when it leaves the cache or when the dataset is closed.
+			Children opened in "w" mode are never cached, they are written
+			when they are closed.
 		"""
 		path = os.path.join(self._folder_path, name)
-		if not name in self.children:
+		if not self._isChild(name):
 			raise IOError("%s is not a child of the current dataset"%name)
 		if os.path.isfile(path):
-			return qidata.open(path, self.mode)
+			if not self.read_only:
+				return qidata.open(path, self.mode)
+			return self._child_cache.get(
+			         name,
+			         path,
+			         lambda: qidata.open(path, self.mode)
+			       )
 		# elif os.path.isdir(path):
 		# 	return QiDataSet(path, self.mode)
 		else:
 			raise IOError("%s is neither a file nor a folder"%name)
 
+	def query(self, annotator=None, metadata_type=None, attributes=None):
+		"""
+		Search annotations in the dataset's annotation index
+
+		:param annotator: Only return annotations made by this annotator
+		:type annotator: str
+		:param metadata_type: Only return annotations of this type
+		:type metadata_type: str or ``qidata.MetadataType``
+		:param attributes: Only return annotations whose attributes have the
+		 given values (nested attributes are named with dots)
+		:type attributes: dict
+		:return: List of (filename, annotator, metadata type, location)
+		:rtype: list
+		:raises: IOError if the index was never built
+
+		.. note::
+			The index is only read, and the annotations of files which are not
+			children of the dataset anymore are not returned.
+
+		:Example:
+			>>> with QiDataSet("dummy/dataset", "r") as d:
+			>>>     d.query(metadata_type="Property", attributes={"key":"X"})
+			>>> [("file.png", u"jdoe", "Property", None)]
+		"""
+		with _annotation_index.AnnotationIndex(self._folder_path, read_only=True)\
+		       as index:
+			rows = index.query(annotator, metadata_type, attributes)
+		self._updateChildren()
+		return [row for row in rows if row[0] in self._children_set]
+
+	def refresh(self):
+		"""
+		Forget the cached list of children
+
+		The folder will be listed again on the next access to ``children``.
+		This is only needed when files are added or removed without changing
+		the folder's modification time (which is the case on some network
+		filesystems).
+		"""
+		self._children_mtime = None
+
 	def setAnnotationStatus(self, annotator_name, metadata_type, is_total):
 		"""
 		Set an annotation's status
@@ -651,29 +1409,303 @@ class QiDataSet(object):
 		  QiDataSet.AnnotationStatus.TOTAL\
 		   if is_total else QiDataSet.AnnotationStatus.PARTIAL
 
+	@throwIfReadOnly
+	def unconsolidate(self):
+		"""
+		Move the metadata of the consolidated store back into XMP files
+
+		Each entry of the store is written in the external annotation file of
+		its data file, or in its frame file, and the store is removed. This
+		reverts ``consolidate``.
+
+		.. note::
+
+			Frames previously returned by the dataset are closed.
+		"""
+		if not self.consolidated:
+			return
+		self._forgetFrames()
+
+		store_path = _consolidated_store.storePath(self._folder_path)
+		_consolidated_store.closeSharedStore(self._folder_path)
+		with _consolidated_store.ConsolidatedStore(self._folder_path) as store:
+			entries = store.items()
+		for name, namespaces in entries:
+			path = os.path.join(self._folder_path, name)
+			if os.path.splitext(name)[1] != ".xmp":
+				path += ".xmp"
+			with _atomic_write.openForWriting(path) as _xmp_file:
+				for namespace, values in namespaces.iteritems():
+					_raw_metadata = _xmp_file.metadata[namespace]
+					for key in _raw_metadata.children:
+						_raw_metadata.pop(key)
+					for key, value in values.iteritems():
+						setattr(_raw_metadata, key, value)
+		os.remove(store_path)
+		self._frame_paths = None
+
 	# ───────────
 	# Private API
 
-	def _open(self):
+	def _isChild(self, name):
 		"""
-		Open the data set
+		Return True if ``name`` is one of the dataset's children
+		"""
+		self._updateChildren()
+		return name in self._children_set
+
+	def _updateChildren(self):
 		"""
-		frames = glob.glob(self._folder_path+"/*.frame.xmp")
-		for frame in frames:
-			self._frames.append(
-				qidataframe.QiDataFrame(
-					frame,
-					self.mode
+		List the supported files again if the folder changed
+		"""
+		mtime = os.stat(self._folder_path).st_mtime
+		if mtime == self._children_mtime:
+			return
+
+		if scandir is not None:
+			names = [entry.name
+			           for entry in scandir(self._folder_path)
+			               if qidata.isSupportedDataFile(entry.name)
+			        ]
+		else:
+			names = [fn
+			           for fn in os.listdir(self._folder_path)
+			               if qidata.isSupportedDataFile(fn)
+			        ]
+		names.sort()
+		self._children = names
+		self._children_set = set(names)
+		self._children_mtime = mtime
+
+	def _discoverFrames(self):
+		"""
+		List the frame files of the dataset, without opening them
+
+		:return: Paths of the frames
+		:rtype: list
+		"""
+		if self._frame_paths is None:
+			if self.consolidated:
+				with _consolidated_store.ConsolidatedStore(self._folder_path)\
+				       as store:
+					self._frame_paths = [
+					  os.path.join(self._folder_path, name)
+					    for name in store.names()
+					      if name.endswith(".frame.xmp")
+					]
+			else:
+				self._frame_paths = sorted(
+				  glob.glob(os.path.join(self._folder_path, "*.frame.xmp"))
+				)
+		return self._frame_paths
+
+	def _getFrameFiles(self, frame_path):
+		"""
+		Return the set of files composing a frame, without opening it
+
+		:param frame_path: Path of the frame
+		:type frame_path: str
+		:rtype: set
+		"""
+		if self._loaded_frames.has_key(frame_path):
+			return self._loaded_frames[frame_path]._files
+		if self.consolidated:
+			return self._loadFrame(frame_path)._files
+		if not self._frame_files.has_key(frame_path):
+			try:
+				data = xmp_tools._readXMPProperties(
+				         frame_path,
+				         qidataframe.QIDATA_FRAME_NS,
+				         ["files"]
+				       )
+				self._frame_files[frame_path] = set(
+				  [str(f) for f in data["files"]]
 				)
+			except (SyntaxError, TypeError, KeyError):
+				return self._loadFrame(frame_path)._files
+		return self._frame_files[frame_path]
+
+	def _forgetFrames(self):
+		"""
+		Close the loaded frames and forget everything known about frames
+		"""
+		for f in self._loaded_frames.values():
+			if not f.closed:
+				f.close()
+		self._frame_paths = None
+		self._frame_files = dict()
+		self._loaded_frames = dict()
+
+	def _loadFrame(self, frame_path):
+		"""
+		Return the frame stored in ``frame_path``, opening it if needed
+
+		:param frame_path: Path of the frame
+		:type frame_path: str
+		:rtype: :class:``QiDataFrame``
+		"""
+		if not self._loaded_frames.has_key(frame_path):
+			frame = qidataframe.QiDataFrame(frame_path, self.mode)
+			if self.read_only:
+				# Everything is loaded, the file is not needed anymore
+				frame.close()
+			else:
+				# Modifications are written through a new handle when the
+				# frame is closed, so the one used to load it can be released
+				frame._releaseXMPFile()
+			self._loaded_frames[frame_path] = frame
+		return self._loaded_frames[frame_path]
+
+	def _iterChildren(self, names, mode, prefetch, workers):
+		"""
+		Generator behind ``iterChildren``
+		"""
+		paths = iter([os.path.join(self._folder_path, name) for name in names])
+		pool = ThreadPool(max(1, workers))
+		pending = deque()
+		current = None
+		try:
+			for path in itertools.islice(paths, prefetch):
+				pending.append(pool.apply_async(qidata.open, (path, mode)))
+			while True:
+				# Open the child following the prefetched ones, which is the
+				# next one to yield when nothing is prefetched
+				for path in itertools.islice(paths, 1):
+					pending.append(pool.apply_async(qidata.open, (path, mode)))
+				if not pending:
+					break
+				current = pending.popleft().get()
+				yield current
+				_f, current = current, None
+				_f.close()
+		finally:
+			if current is not None:
+				current.close()
+			# Close the children opened in advance but never used
+			for result in pending:
+				try:
+					result.get().close()
+				except Exception:
+					pass
+			pool.close()
+			pool.join()
+
+	def _contentMetadata(self):
+		"""
+		Return the content metadata, as it would be written
+
+		Data streams need to be a little be reworked to fit XMP base rules,
+		namely numbers cannot be keys so we add the letter "t" in front of the
+		timestamps.
+		"""
+		tmp_streams = dict()
+		for stream_name, stream in self._streams.iteritems():
+			tmp_streams[stream_name] = (stream.data_type,dict())
+			for (timestamp,filename) in stream:
+				tmp_streams[stream_name][1]["t%d.%09d"%timestamp] = filename
+		return (
+		  self._annotation_content,
+		  self._files_type,
+		  self._context,
+		  tmp_streams
+		)
+
+	def _saveMetadata(self, xmp_file):
+		"""
+		Write the content metadata in the given XMP file
+
+		:param xmp_file: "metadata.xmp", opened for writing
+		:type xmp_file: xmp.xmp.XMPFile
+		"""
+		annotation_content, files_type, context, streams = \
+		  self._contentMetadata()
+
+		# Erase current dataset content's metadata
+		_raw_metadata = xmp_file.metadata[QIDATA_CONTENT_NS]
+		for key in _raw_metadata.attributes():
+			del _raw_metadata[key]
+
+		# Save new dataset content's metadata
+		for (key, value) in annotation_content.iteritems():
+			setattr(
+			    _raw_metadata.annotation_content,
+			    key[0],
+			    {key[1]:value}
+			)
+
+		setattr(
+		    _raw_metadata,
+		    "files_type",
+		    files_type
+		)
+
+		setattr(
+		    _raw_metadata,
+		    "context",
+		    context
+		)
+
+		setattr(_raw_metadata, "streams", streams)
+
+	def _loadManifest(self):
+		"""
+		Load the files summaries stored by the last content examination
+
+		:return: Summary of each known file
+		:rtype: dict
+
+		.. note::
+
+			A missing, unreadable or outdated manifest is simply ignored, and
+			every file will be examined again.
+		"""
+		manifest_path = os.path.join(self._folder_path, MANIFEST_FILENAME)
+		try:
+			with open(manifest_path, "r") as _f:
+				data = json.load(_f)
+			if data["version"] != MANIFEST_VERSION:
+				return dict()
+			manifest = dict()
+			for name, summary in data["files"].iteritems():
+				manifest[str(name)] = dict(
+				  stat=summary["stat"],
+				  type=str(summary["type"]),
+				  annotations=set(
+				    [tuple(key) for key in summary["annotations"]]
+				  )
+				)
+			return manifest
+		except (IOError, ValueError, KeyError, TypeError):
+			return dict()
+
+	def _saveManifest(self):
+		"""
+		Store the files summaries next to the dataset's metadata
+
+		The manifest is replaced atomically.
+		"""
+		files = dict()
+		for name, summary in self._manifest.iteritems():
+			files[name] = dict(
+			  stat=summary["stat"],
+			  type=summary["type"],
+			  annotations=sorted([list(key) for key in summary["annotations"]])
 			)
+		manifest_path = os.path.join(self._folder_path, MANIFEST_FILENAME)
+		with _atomic_write.openFileForWriting(manifest_path) as _f:
+			json.dump(dict(version=MANIFEST_VERSION, files=files), _f)
+
+	def _open(self):
+		"""
+		Open the data set
+		"""
 		self._xmp_file.__enter__()
 		self._is_closed = False
 
 		# Load content info stored in metadata
 		_raw_metadata = self._xmp_file.metadata[QIDATA_CONTENT_NS]
 		if _raw_metadata.children:
-			data = _raw_metadata.value
-			xmp_tools._removePrefixes(data)
+			data = xmp_tools._namespaceValue(_raw_metadata)
 			self._annotation_content = dict()
 			if data.has_key("annotation_content"):
 				content = data["annotation_content"]
@@ -721,10 +1753,16 @@ class QiDataSet(object):
 			# use, but they are saved as unicode)
 			if data.has_key("streams") and len(data["streams"])>0:
 				for stream_name, stream in data["streams"].iteritems():
-					self._streams[stream_name] = [DataType[stream[0]],dict()]
-					for (timestamp,filename) in stream[1].iteritems():
-						_ts = tuple(map(int, timestamp[1:].split(".")))
-						self._streams[stream_name][1][_ts] = str(filename)
+					self._streams[stream_name] = DataStream(
+					  DataType[stream[0]],
+					  [
+					    (tuple(map(int, timestamp[1:].split("."))), str(filename))
+					      for (timestamp,filename) in stream[1].iteritems()
+					  ]
+					)
+
+			# Keep what is stored, to know if it must be written again
+			self._saved_content = copy.deepcopy(self._contentMetadata())
 
 		else:
 			# if no content info was stored, infere it from the files
@@ -765,7 +1803,7 @@ class QiDataSet(object):
 		_sn.sort()
 		print _sn
 		_s = OrderedDict(
-		                  [(name, "%d files"%len(self._streams[name][1]))\
+		                  [(name, "%d files"%len(self._streams[name]))\
 		                      for name in _sn]
 		                )
 		res_str += "Available streams: " + textualize_mapping(
@@ -774,7 +1812,7 @@ class QiDataSet(object):
 		                                                     ) + "\n"
 
 		# Frames
-		res_str += "Defined frames: %d\n"%len(self._frames)
+		res_str += "Defined frames: %d\n"%len(self._discoverFrames())
 
 		# Context
 		res_str += "Context: " + unicode(self.context) + "\n"
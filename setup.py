@@ -70,6 +70,7 @@ setup(
         "xmp >= 0.3",
         "qidata_devices >= 0.0.3",
         "image.py >= 0.4.0",
+        "numpy",
     ],
     package_data={"qidata":["VERSION"]},
     entry_points={
@@ -81,6 +82,8 @@ setup(
         ],
         'qidata.commands': [
             'show = qidata.command_line.show_command',
+            'consolidate = qidata.command_line.consolidate_command',
+            'unconsolidate = qidata.command_line.unconsolidate_command',
         ],
         'console_scripts': [
             'qidata = qidata.__main__:main'
@@ -33,10 +33,12 @@ import pytest
 import subprocess
 
 # Third-party libraries
+import argparse
 
 # Local modules
 from qidata.command_line import main
-from qidata import VERSION
+from qidata.command_line import consolidate_command, unconsolidate_command
+from qidata import VERSION, QiDataSet
 
 @pytest.mark.parametrize("command_args",
 	[
@@ -231,6 +233,28 @@ def test_show_on_set_command(command_args, expected,show_command_parser):
 	print res
 	assert(expected == res)
 
+def test_consolidate_commands(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "w"):
+		pass
+
+	parser = consolidate_command.make_command_parser(argparse.ArgumentParser())
+	parsed_arguments = parser.parse_args([folder_with_annotations])
+	parsed_arguments.func(parsed_arguments)
+	with QiDataSet(folder_with_annotations, "r") as d:
+		assert(d.consolidated)
+
+	parser = unconsolidate_command.make_command_parser(
+	  argparse.ArgumentParser()
+	)
+	parsed_arguments = parser.parse_args([folder_with_annotations])
+	parsed_arguments.func(parsed_arguments)
+	with QiDataSet(folder_with_annotations, "r") as d:
+		assert(not d.consolidated)
+
+	parsed_arguments = parser.parse_args(["tests/data/SpringNebula.jpg"])
+	with pytest.raises(SystemExit):
+		parsed_arguments.func(parsed_arguments)
+
 def test_main_command():
   parser = main.parser()
   with pytest.raises(SystemExit):
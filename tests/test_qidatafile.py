@@ -29,15 +29,20 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 # Standard libraries
+import copy
 import os
 
 # Third-party libraries
 import pytest
+from xmp.xmp import XMPFile
 
 # Local modules
 import qidata
 from qidata import metadata_objects,DataType
-from qidata import QiDataFile, ClosedFileException
+from qidata import QiDataFile, ClosedFileException, ReadOnlyException
+from qidata import qidatafile
+from qidata import _atomic_write
+from qidata import _mixin as xmp_tools
 from qidata.qidataimagefile import QiDataImageFile
 from qidata.qidataaudiofile import QiDataAudioFile
 
@@ -99,8 +104,17 @@ def test_file_read_and_write(jpg_with_external_annotations,
 		  } == f.annotations
 		)
 
+	# Nothing was modified, no external annotation file is needed
+	assert(not os.path.exists(jpg_with_internal_annotations+".xmp"))
+
+	with FileForTests(jpg_with_internal_annotations, "w") as f:
+		f.addAnnotation("jdoe", metadata_objects.Property("key", "value"))
+
 	assert(os.path.exists(jpg_with_internal_annotations+".xmp"))
 
+	with FileForTests(jpg_with_internal_annotations, "r") as f:
+		assert(set(["sambrose", "jdoe"]) == set(f.annotators))
+
 def test_qidata_file(jpg_file_path):
 	# Open file in "w" mode and add annotation
 	a=metadata_objects.Property(key="prop", value="10")
@@ -211,4 +225,363 @@ def test_specify_type(jpg_file_path):
 			f.type = DataType.AUDIO
 
 	with qidata.open(jpg_file_path, "r") as f:
-		assert(DataType.IMAGE_2D == f.type)
\ No newline at end of file
+		assert(DataType.IMAGE_2D == f.type)
+
+def test_fast_sidecar_reading(jpg_file_path, monkeypatch):
+	with qidata.open(jpg_file_path, "w") as f:
+		f.type = DataType.IMAGE_2D
+		f.addAnnotation("jdoe", metadata_objects.Property("key", "value"),
+		                [[0,0],[10,10]])
+
+	with qidata.open(jpg_file_path, "r") as f:
+		expected_annotations = f.annotations
+
+	monkeypatch.setattr(qidatafile, "FAST_SIDECAR_READING", True)
+	with qidata.open(jpg_file_path, "r") as f:
+		assert(isinstance(f._xmp_file, xmp_tools.XMPSidecarReader))
+		assert(DataType.IMAGE_2D == f.type)
+		assert(expected_annotations == f.annotations)
+
+	# Files opened in "w" mode are only read by it, and written by the
+	# toolkit when closed
+	with qidata.open(jpg_file_path, "w") as f:
+		f.addAnnotation("jdoe", metadata_objects.Property("key", "other"))
+	with qidata.open(jpg_file_path, "r") as f:
+		assert(2 == len(f.getAnnotations("jdoe", "Property")))
+
+def test_lazy_annotation_loading(jpg_file_path):
+	a = metadata_objects.Property("key", "value")
+	with qidata.open(jpg_file_path, "w") as f:
+		f.type = DataType.IMAGE_2D
+		f.addAnnotation("jdoe", a, None)
+
+	# Sensor header is available without decoding the annotations
+	with qidata.open(jpg_file_path, "r") as f:
+		assert(DataType.IMAGE_2D == f.type)
+		assert(f._loaded_annotations is None)
+		assert([[a, None]] == f.getAnnotations("jdoe"))
+		assert(f._loaded_annotations is not None)
+
+	# Annotations can still be read once the file is closed
+	f = qidata.open(jpg_file_path, "r")
+	f.close()
+	assert({"jdoe":{"Property":[[a, None]]}} == f.annotations)
+
+	# Changing only the header does not rewrite the annotations
+	with qidata.open(jpg_file_path, "w") as f:
+		f.type = DataType.IMAGE_3D
+	with qidata.open(jpg_file_path, "r") as f:
+		assert(DataType.IMAGE_3D == f.type)
+		assert({"jdoe":{"Property":[[a, None]]}} == f.annotations)
+
+def test_reads_do_not_copy_annotations(jpg_file_path, monkeypatch):
+	from qidata import qidataobject
+	a = metadata_objects.Property("key", "value")
+	with qidata.open(jpg_file_path, "w") as f:
+		f.addAnnotation("jdoe", a, None)
+
+	copies = []
+	class _CountingCopy(object):
+		@staticmethod
+		def deepcopy(value, memo=None):
+			copies.append(value)
+			return copy.deepcopy(value, memo)
+	monkeypatch.setattr(qidataobject, "copy", _CountingCopy)
+
+	with qidata.open(jpg_file_path, "r") as f:
+		assert(["jdoe"] == f.annotators)
+		assert("Annotator: jdoe" in unicode(f))
+		annotations = f.annotations
+		assert(annotations is f.annotations)
+		assert([[a, None]] == f.getAnnotations("jdoe"))
+		assert({"jdoe":{"Property":[[a, None]]}} == annotations)
+		assert([] == copies)
+
+		# Returned annotations cannot be used to modify the file
+		with pytest.raises(TypeError):
+			annotations["jsmith"] = dict()
+		with pytest.raises(TypeError):
+			annotations["jdoe"]["Property"].append([a, None])
+		with pytest.raises(TypeError):
+			annotations["jdoe"]["Property"][0][1] = [[0,0],[10,10]]
+		with pytest.raises(TypeError):
+			f.getAnnotations("jdoe").pop()
+		annotations["jdoe"]["Property"][0][0].key = "other"
+		f.getAnnotations("jdoe")[0][0].key = "other"
+		assert({"jdoe":{"Property":[[a, None]]}} == f.annotations)
+
+		# But they can be copied to be modified
+		modified = copy.deepcopy(annotations)
+		modified["jdoe"]["Property"].append([a, None])
+		assert(2 == len(modified["jdoe"]["Property"]))
+		assert(1 == len(f.annotations["jdoe"]["Property"]))
+
+	# Modifying the annotations leaves the previous snapshots untouched
+	with qidata.open(jpg_file_path, "w") as f:
+		annotations = f.annotations
+		f.addAnnotation("jsmith", a, None)
+		assert(["jdoe"] == annotations.keys())
+		assert(annotations is not f.annotations)
+		assert(sorted(["jdoe", "jsmith"]) == sorted(f.annotations.keys()))
+		f.getAnnotations("jdoe")[0][1] = [[0,0],[10,10]]
+		assert([[0,0],[10,10]] == f.annotations["jdoe"]["Property"][0][1])
+
+def test_annotation_ids_are_stored(jpg_with_external_annotations):
+	a = metadata_objects.Property("key", "value")
+	b = metadata_objects.Property("other_key", "value")
+
+	# Annotations stored without ID get the same ID each time they are read
+	with qidata.open(jpg_with_external_annotations, "r") as f:
+		legacy_ids = f.getAnnotationIds("sambrose")
+	with qidata.open(jpg_with_external_annotations, "w") as f:
+		assert(legacy_ids == f.getAnnotationIds("sambrose"))
+		new_id = f.addAnnotation("jdoe", a, None)
+		other_id = f.addAnnotation("jdoe", a, None)
+
+	for annotation_format in ["packed", "xmp"]:
+		with qidata.open(jpg_with_external_annotations, "w") as f:
+			assert(legacy_ids == f.getAnnotationIds("sambrose"))
+			assert([new_id, other_id] == f.getAnnotationIds("jdoe"))
+			f.convertAnnotations(annotation_format)
+
+	with qidata.open(jpg_with_external_annotations, "w") as f:
+		f.removeAnnotationById(new_id)
+		f.updateAnnotation(other_id, b, None)
+	with qidata.open(jpg_with_external_annotations, "r") as f:
+		assert([other_id] == f.getAnnotationIds("jdoe"))
+		assert(("jdoe", b, None) == f.getAnnotationById(other_id))
+	f = qidata.open(jpg_with_external_annotations, "w")
+	f.close()
+	with pytest.raises(ClosedFileException):
+		f.removeAnnotationById(other_id)
+
+def test_spatial_queries(jpg_file_path):
+	a = metadata_objects.Property("key", "value")
+	b = metadata_objects.Property("other_key", "value")
+	with qidata.open(jpg_file_path, "w") as f:
+		id_a = f.addAnnotation("jdoe", a, [[0,0],[10,10]])
+		f.addAnnotation("jdoe", a, None)
+
+	with qidata.open(jpg_file_path, "w") as f:
+		assert([id_a] == f.queryPoint(10, 10))
+		assert([] == f.queryPoint(11, 10))
+
+		# Annotations added, updated or removed after the index was built
+		id_b = f.addAnnotation("sambrose", b, [[200,200],[5,5]])
+		id_c = f.addAnnotation("jdoe", b, [[300,0],[400,1000]])
+		assert([id_a, id_b] == f.queryPoint(8, 8))
+		assert([id_b] == f.queryPoint(8, 8, "sambrose"))
+		assert([id_a] == f.queryPoint(8, 8, annotation_type="Property",
+		                              annotator="jdoe"))
+		assert([id_a, id_b, id_c] == f.queryRegion([[0,0],[1000,1000]]))
+		f.updateAnnotation(id_c, b, [[500,500],[600,600]])
+		assert([id_b] == f.queryRegion([[150,150],[450,450]]))
+		f.removeAnnotationById(id_a)
+		assert(id_b == f.removeAnnotation("sambrose", b, [[200,200],[5,5]]))
+		assert([id_c] == f._location_index._bounds.keys())
+		assert([id_c] == f._location_index._order.keys())
+		assert([] == f.queryPoint(8, 8))
+		assert([id_c] == f.queryRegion([[-10,-10],[10000,10000]]))
+
+		# Rectangles much larger than the others are found too
+		id_d = f.addAnnotation("jdoe", b, [[0,0],[100000,100000]])
+		assert([id_c, id_d] == f.queryPoint(550, 550))
+		assert([id_d] == f.queryPoint(99999, 5))
+		f.removeAnnotationById(id_d)
+		assert([] == f.queryPoint(99999, 5))
+
+		# Locations modified in place are indexed again
+		for annotation, location in f.getAnnotations("jdoe"):
+			if location == [[500,500],[600,600]]:
+				location[1] = [700,700]
+		assert([id_c] == f.queryPoint(650, 650))
+
+		with pytest.raises(TypeError):
+			f.queryRegion([0, 0])
+
+	# The index is built again when annotations are reloaded
+	with qidata.open(jpg_file_path, "r") as f:
+		assert([id_c] == f.queryPoint(550, 550))
+
+def test_interval_queries():
+	wav_file_path = conftest.sandboxed(conftest.WAV_SOUND)
+	a = metadata_objects.Property("key", "value")
+	b = metadata_objects.Property("other_key", "value")
+	with qidata.open(wav_file_path, "w") as f:
+		id_a = f.addAnnotation("jdoe", a, [0, 100])
+		f.addAnnotation("jdoe", a, None)
+		f.addAnnotation("jdoe", a, [50, 50])
+
+	with qidata.open(wav_file_path, "w") as f:
+		# Intervals include their start but not their end
+		assert([id_a] == f.queryAt(0))
+		assert([id_a] == f.queryAt(99))
+		assert([] == f.queryAt(100))
+		assert([] == f.queryInterval(100, 200))
+
+		# Annotations added, updated or removed after the index was built
+		id_b = f.addAnnotation("sambrose", b, [90, 1000000])
+		id_c = f.addAnnotation("jdoe", b, [150, 160])
+		assert([id_a, id_b] == f.queryInterval(95, 96))
+		assert([id_b] == f.queryAt(95, "sambrose"))
+		assert([id_a] == f.queryAt(95, annotation_type="Property",
+		                           annotator="jdoe"))
+		assert([id_b, id_c] == f.queryInterval(100, 200))
+		f.updateAnnotation(id_c, b, [2000000, 2000100])
+		assert([id_b] == f.queryInterval(100, 200))
+		f.removeAnnotationById(id_a)
+		assert(id_b == f.removeAnnotation("sambrose", b, [90, 1000000]))
+		assert([id_c] == f._location_index._bounds.keys())
+		assert([id_c] == f._location_index._order.keys())
+		assert([] == f.queryAt(95))
+		assert([id_c] == f.queryInterval(0, 3000000))
+
+		# Updated annotations keep their order, removed ones are forgotten
+		id_d = f.addAnnotation("sambrose", a, [0, 3000000])
+		f.updateAnnotation(id_c, b, [10, 20])
+		assert([id_c, id_d] == f.queryAt(15))
+		f.removeAnnotation("sambrose", a, [0, 3000000])
+		f.updateAnnotation(id_c, b, [2000000, 2000100])
+		assert([id_c] == f.queryInterval(0, 3000000))
+		assert([id_c] == f._location_index._order.keys())
+
+		# Locations modified in place are indexed again
+		for annotation, location in f.getAnnotations("jdoe"):
+			if location == [2000000, 2000100]:
+				location[0] = 1999000
+		assert([id_c] == f.queryAt(1999500))
+
+		# A long interval does not slow down the search of short ones
+		ids = [f.addAnnotation("sambrose", a, [i*10, i*10+5])
+		         for i in range(100)]
+		id_e = f.addAnnotation("sambrose", b, [0, 1000000])
+		assert([ids[3], id_e] == f.queryAt(32))
+		assert([ids[3], ids[4], id_e] == f.queryInterval(32, 41))
+		assert([id_e] == f.queryAt(999999))
+		for annotation_id in ids + [id_e]:
+			f.removeAnnotationById(annotation_id)
+		assert([] == f.queryAt(32))
+
+		with pytest.raises(TypeError):
+			f.queryInterval(10, 10)
+
+	# The index is built again when annotations are reloaded
+	with qidata.open(wav_file_path, "r") as f:
+		assert([id_c] == f.queryAt(2000000))
+
+def test_lazy_image_decoding(jpg_file_path, monkeypatch):
+	from qidata import qidataimagefile
+	decoded = []
+	def _countingImage(path):
+		decoded.append(path)
+		return object()
+	monkeypatch.setattr(qidataimagefile, "Image", _countingImage)
+
+	with qidata.open(jpg_file_path, "r") as f:
+		assert(DataType.IMAGE == f.type)
+		assert([] == decoded)
+		_image = f.raw_data
+		assert(_image is f.raw_data)
+		assert([jpg_file_path] == decoded)
+		f.release_raw_data()
+		assert(_image is not f.raw_data)
+		assert(2 == len(decoded))
+
+def test_unmodified_file_is_not_written(jpg_file_path):
+	a = metadata_objects.Property("key", "value")
+	with qidata.open(jpg_file_path, "w") as f:
+		f.addAnnotation("jdoe", a, None)
+	xmp_path = jpg_file_path + ".xmp"
+	os.utime(xmp_path, (0, 0))
+
+	qidatafile.resetWriteStatistics()
+	with qidata.open(jpg_file_path, "w") as f:
+		assert(DataType.IMAGE == f.type)
+		assert([[a, None]] == f.getAnnotations("jdoe"))
+	assert(0 == os.path.getmtime(xmp_path))
+	assert(dict(written=0, skipped=1) == qidatafile.getWriteStatistics())
+
+	with qidata.open(jpg_file_path, "w") as f:
+		f.getAnnotations("jdoe")[0][1] = [[0,0],[10,10]]
+	assert(0 != os.path.getmtime(xmp_path))
+	assert(dict(written=1, skipped=1) == qidatafile.getWriteStatistics())
+	with qidata.open(jpg_file_path, "r") as f:
+		assert([[a, [[0,0],[10,10]]]] == f.getAnnotations("jdoe"))
+
+def test_atomic_write(jpg_file_path, monkeypatch):
+	a = metadata_objects.Property("key", "value")
+	with qidata.open(jpg_file_path, "w") as f:
+		f.addAnnotation("jdoe", a, None)
+	folder = os.path.dirname(jpg_file_path)
+	content = sorted(os.listdir(folder))
+
+	def _failingSave(self, xmp_file):
+		xmp_tools._save_annotations(xmp_file, dict())
+		raise IOError("Interrupted write")
+	monkeypatch.setattr(QiDataImageFile, "_saveMetadata", _failingSave)
+	f = qidata.open(jpg_file_path, "w")
+	f.addAnnotation("jdoe", a, [[0,0],[10,10]])
+	with pytest.raises(IOError):
+		f.close()
+	monkeypatch.undo()
+
+	# The previous annotations are untouched and no temporary file remains
+	assert(content == sorted(os.listdir(folder)))
+	with qidata.open(jpg_file_path, "r") as f:
+		assert({"jdoe":{"Property":[[a, None]]}} == f.annotations)
+
+	# Regular files can be replaced atomically too
+	path = os.path.join(folder, "file.txt")
+	with _atomic_write.openFileForWriting(path) as _f:
+		_f.write("content")
+	with pytest.raises(IOError):
+		with _atomic_write.openFileForWriting(path) as _f:
+			_f.write("truncated")
+			raise IOError("Interrupted write")
+	with open(path, "r") as _f:
+		assert("content" == _f.read())
+	assert(sorted(content + ["file.txt"]) == sorted(os.listdir(folder)))
+
+def test_annotation_formats(jpg_with_external_annotations):
+	xmp_path = jpg_with_external_annotations + ".xmp"
+	def _storedAnnotations():
+		with XMPFile(xmp_path) as _f:
+			_raw_metadata = _f.metadata[xmp_tools.QIDATA_NS]
+			return (
+			  xmp_tools._namespaceValue(_raw_metadata)\
+			    if _raw_metadata.children else None,
+			  bool(_f.metadata[xmp_tools.QIDATA_PACKED_NS].children)
+			)
+
+	original_content, is_packed = _storedAnnotations()
+	assert(not is_packed)
+	with qidata.open(jpg_with_external_annotations, "r") as f:
+		assert("xmp" == f.annotation_format)
+		expected_annotations = f.annotations
+		with pytest.raises(ReadOnlyException):
+			f.convertAnnotations("packed")
+
+	with qidata.open(jpg_with_external_annotations, "w") as f:
+		with pytest.raises(TypeError):
+			f.convertAnnotations("unknown")
+		f.convertAnnotations("packed")
+	assert((None, True) == _storedAnnotations())
+	with qidata.open(jpg_with_external_annotations, "r") as f:
+		assert("packed" == f.annotation_format)
+		assert(expected_annotations == f.annotations)
+
+	# Conversion is lossless
+	with qidata.open(jpg_with_external_annotations, "w") as f:
+		f.convertAnnotations("xmp")
+	assert((original_content, False) == _storedAnnotations())
+
+	# Modified annotations keep the format of the file
+	a = metadata_objects.Property("key", "value")
+	with qidata.open(jpg_with_external_annotations, "w") as f:
+		f.convertAnnotations("packed")
+	with qidata.open(jpg_with_external_annotations, "w") as f:
+		f.addAnnotation("jdoe", a, [[0,0],[10,10]])
+	with qidata.open(jpg_with_external_annotations, "r") as f:
+		assert("packed" == f.annotation_format)
+		assert([[a, [[0,0],[10,10]]]] == f.getAnnotations("jdoe"))
+		assert(expected_annotations["sambrose"] == f.annotations["sambrose"])
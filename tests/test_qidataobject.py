@@ -101,9 +101,10 @@ def test_qidata_object():
 	# Annotations should be empty
 	assert(dict() == qidata_object.annotations)
 
-	# They should stay empty when modifying the returned dict
+	# They cannot be modified through the returned dict
 	annotations = qidata_object.annotations
-	annotations["test"] = 0
+	with pytest.raises(TypeError):
+		annotations["test"] = 0
 	assert(dict() == qidata_object.annotations)
 
 	# Annotation is not settable
@@ -355,4 +356,93 @@ def test_read_only_cannot_be_modified():
 	      ]
 	    ),
 	  ) == qidata_object.annotations
-	)
\ No newline at end of file
+	)
+
+def test_annotation_ids():
+	qidata_object = ObjectForTests()
+	a = metadata_objects.Property(key="a", value="0")
+	b = metadata_objects.Property(key="b", value="1")
+
+	id_a = qidata_object.addAnnotation("jdoe", a, None)
+	id_b = qidata_object.addAnnotation("jdoe", b, 0)
+	id_c = qidata_object.addAnnotation("jdoe", a, None)
+	assert(3 == len(set([id_a, id_b, id_c])))
+	assert([id_a, id_b, id_c] == qidata_object.getAnnotationIds("jdoe"))
+	assert([id_a, id_b, id_c] == qidata_object.getAnnotationIds("jdoe",
+	                                                             "Property"))
+	assert([] == qidata_object.getAnnotationIds("sambrose"))
+	assert(("jdoe", b, 0) == qidata_object.getAnnotationById(id_b))
+
+	# Identical annotations are told apart by their ID
+	qidata_object.removeAnnotationById(id_c)
+	assert([id_a, id_b] == qidata_object.getAnnotationIds("jdoe"))
+	with pytest.raises(ValueError):
+		qidata_object.removeAnnotationById(id_c)
+	with pytest.raises(ValueError):
+		qidata_object.getAnnotationById(id_c)
+
+	# Updated annotations keep their ID and position
+	qidata_object.updateAnnotation(id_a, b, 1)
+	assert([[b, 1], [b, 0]] == qidata_object.getAnnotations("jdoe"))
+	assert([id_a, id_b] == qidata_object.getAnnotationIds("jdoe"))
+	with pytest.raises(Exception):
+		qidata_object.updateAnnotation(id_a, b, -1)
+	with pytest.raises(TypeError):
+		qidata_object.updateAnnotation(id_a, FakeAnnotation(), None)
+
+	# Removing by value keeps the index up to date
+	qidata_object.removeAnnotation("jdoe", b, 0)
+	assert([id_a] == qidata_object.getAnnotationIds("jdoe"))
+	with pytest.raises(ValueError):
+		qidata_object.removeAnnotationById(id_b)
+	qidata_object.removeAnnotationById(id_a)
+	assert(dict() == qidata_object.annotations)
+
+	# Many annotations removed by ID, in any order, keep the others in place
+	properties = [metadata_objects.Property(key=str(i), value=str(i))
+	                for i in range(20)]
+	ids = [qidata_object.addAnnotation("jdoe", p, i)
+	         for i, p in enumerate(properties)]
+	for i in [3, 0, 19, 4, 10, 11, 18]:
+		qidata_object.removeAnnotationById(ids[i])
+	kept = [i for i in range(20) if i not in [0, 3, 4, 10, 11, 18, 19]]
+	assert([ids[i] for i in kept] == qidata_object.getAnnotationIds("jdoe"))
+	assert(
+	  [[properties[i], i] for i in kept]\
+	  == qidata_object.getAnnotations("jdoe", "Property")
+	)
+	qidata_object.removeAnnotationById(ids[kept[0]])
+	qidata_object.updateAnnotation(ids[kept[1]], b, None)
+	qidata_object.removeAnnotation("jdoe", properties[kept[-1]], kept[-1])
+	assert(
+	  [[b, None]] + [[properties[i], i] for i in kept[2:-1]]\
+	  == qidata_object.annotations["jdoe"]["Property"]
+	)
+	for i in kept[1:-1]:
+		qidata_object.removeAnnotationById(ids[i])
+	assert(dict() == qidata_object.annotations)
+
+	# Lists returned by getAnnotations can be kept and modified in place
+	id_a = qidata_object.addAnnotation("jdoe", a, None)
+	id_b = qidata_object.addAnnotation("jdoe", b, 0)
+	pairs = qidata_object.getAnnotations("jdoe", "Property")
+	qidata_object.removeAnnotationById(id_a)
+	assert([[b, 0]] == [[annot, loc] for annot, loc in pairs])
+	pairs.append([a, 1])
+	ids = qidata_object.getAnnotationIds("jdoe", "Property")
+	assert(2 == len(ids) and id_b == ids[0])
+	pairs.append([a, 2])
+	assert(ids == qidata_object.getAnnotationIds("jdoe")[:2])
+	qidata_object.removeAnnotation("jdoe", a, 2)
+	qidata_object.removeAnnotationById(ids[1])
+	assert([[b, 0]] == pairs)
+	qidata_object.removeAnnotationById(id_b)
+	assert(dict() == qidata_object.annotations)
+
+	# Annotations given without ID get one
+	qidata_object = ReadOnlyObjectWithAnnotationsForTests()
+	ids = qidata_object.getAnnotationIds("jdoe")
+	assert(1 == len(ids))
+	assert(ids == qidata_object.getAnnotationIds("jdoe"))
+	with pytest.raises(ReadOnlyException):
+		qidata_object.removeAnnotationById(ids[0])
@@ -28,6 +28,9 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+# Standard libraries
+import os
+
 # Third-party libraries
 import pytest
 
@@ -60,6 +63,11 @@ class SensorFileForTests(QiDataSensorFile):
 		return (location is None or location >= 0)
 
 def test_qidata_sensor_file(jpg_file_path):
+	# A file without sensor header is not written if nothing is modified
+	with SensorFileForTests(jpg_file_path, "w") as f:
+		pass
+	assert(not os.path.exists(jpg_file_path + ".xmp"))
+
 	# Open file in "w" mode and add annotation
 	ts=metadata_objects.TimeStamp(1000, 2)
 	p=metadata_objects.Transform(
@@ -30,10 +30,18 @@
 
 # Standard Library
 import os
+import shutil
+import sqlite3
 import pytest
 
+# Third-party libraries
+import numpy
+
 # Local modules
-from qidata import QiDataSet, isDataset, DataType
+import qidata
+from qidata import QiDataSet, isDataset, DataType, qidataset, qidatafile
+from qidata import _annotation_index, _atomic_write, _consolidated_store
+from qidata.qidataset import _inspectChild
 from qidata.qidataframe import FrameIsInvalid
 from qidata.qidatafile import ClosedFileException
 from qidata.qidataobject import ReadOnlyException
@@ -67,6 +75,29 @@ def test_dataset_creation(folder_with_non_annotated_files):
 	          os.path.join(folder_with_non_annotated_files, "metadata.xmp"))
 	       )
 
+def test_children_listing(folder_with_non_annotated_files):
+	with QiDataSet(folder_with_non_annotated_files, "w") as a:
+		assert(["JPG_file.jpg", "WAV_file.wav"] == a.children)
+		shutil.copyfile(
+		    os.path.join(folder_with_non_annotated_files, "JPG_file.jpg"),
+		    os.path.join(folder_with_non_annotated_files, "A_JPG_file.jpg")
+		)
+		a.refresh()
+		assert(
+			["A_JPG_file.jpg", "JPG_file.jpg", "WAV_file.wav"] == a.children
+		)
+		with a.openChild("A_JPG_file.jpg") as f:
+			assert(isinstance(f, QiDataImageFile))
+		# The child was not modified, no external annotation file was created
+		assert(not os.path.exists(
+		         os.path.join(folder_with_non_annotated_files, "A_JPG_file.jpg.xmp")
+		       ))
+		os.remove(os.path.join(folder_with_non_annotated_files, "A_JPG_file.jpg"))
+		a.refresh()
+		assert(["JPG_file.jpg", "WAV_file.wav"] == a.children)
+		with pytest.raises(IOError):
+			a.openChild("A_JPG_file.jpg")
+
 def test_child_opening(dataset_with_non_annotated_files):
 	with QiDataSet(dataset_with_non_annotated_files, "r") as d:
 		with d.openChild("JPG_file.jpg") as f:
@@ -79,6 +110,66 @@ def test_child_opening(dataset_with_non_annotated_files):
 			assert(not f.closed)
 			assert(f.mode == "w")
 
+def test_children_iteration(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "r") as d:
+		opened = []
+		for f in d.iterChildren(prefetch=2, workers=2):
+			assert(not f.closed)
+			assert("r" == f.mode)
+			opened.append(f)
+		assert(d.children == [os.path.basename(f.name) for f in opened])
+		assert(all([f.closed for f in opened]))
+
+		for f in d.iterChildren(["WAV_file.wav", "JPG_file.jpg"]):
+			assert(f.name.endswith("WAV_file.wav"))
+			break
+		assert(f.closed)
+
+		with pytest.raises(ReadOnlyException):
+			d.iterChildren(mode="w")
+		with pytest.raises(IOError):
+			d.iterChildren(["TXT_file.txt"])
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		for f in d.iterChildren(["JPG_file.jpg"], mode="w", prefetch=0):
+			f.addAnnotation("jdoe", Property("key", "value"))
+		with d.openChild("JPG_file.jpg") as f:
+			assert(["jdoe"] == f.annotators)
+
+def test_children_prefetching(folder_with_annotations, monkeypatch):
+	# Children are opened as soon as they are submitted
+	class _Result(object):
+		def __init__(self, value):
+			self.value = value
+		def get(self):
+			return self.value
+	class _SynchronousPool(object):
+		def __init__(self, workers):
+			pass
+		def apply_async(self, function, args):
+			return _Result(function(*args))
+		def close(self):
+			pass
+		def join(self):
+			pass
+	monkeypatch.setattr(qidataset, "ThreadPool", _SynchronousPool)
+	opened = []
+	_open = qidata.open
+	def _recordedOpen(path, mode="r"):
+		opened.append(os.path.basename(path))
+		return _open(path, mode)
+	monkeypatch.setattr(qidata, "open", _recordedOpen)
+
+	with QiDataSet(folder_with_annotations, "r") as d:
+		for i, f in enumerate(d.iterChildren(prefetch=0)):
+			assert(d.children[:i+1] == opened)
+		assert(d.children == opened)
+
+		del opened[:]
+		for i, f in enumerate(d.iterChildren(prefetch=2)):
+			assert(d.children[:i+3] == opened)
+		assert(d.children == opened)
+
 def test_content(folder_with_annotations):
 	with QiDataSet(folder_with_annotations, "w") as d:
 		assert(set(["sambrose"]) == d.annotators)
@@ -112,6 +203,98 @@ def test_content_reexamination(dataset_with_new_annotations):
 		)
 		assert(set([DataType.AUDIO, DataType.IMAGE]) == d.datatypes_available)
 
+def test_parallel_content_examination(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.setAnnotationStatus("sambrose", "Person", True)
+		d.examineContent()
+		serial_annotations = d.annotations_available
+		serial_types = dict(
+		    (t, d.getAllFilesOfType(t)) for t in d.datatypes_available
+		)
+		d.examineContent(workers=3)
+		assert(serial_annotations == d.annotations_available)
+		assert(
+		    serial_types == dict(
+		        (t, d.getAllFilesOfType(t)) for t in d.datatypes_available
+		    )
+		)
+
+def test_incremental_content_examination(folder_with_annotations, monkeypatch):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		pass
+	assert(os.path.exists(
+	          os.path.join(folder_with_annotations, "metadata.manifest"))
+	       )
+
+	inspected = []
+	def _inspect(path):
+		inspected.append(os.path.basename(path))
+		return _inspectChild(path)
+	monkeypatch.setattr(qidataset, "_inspectChild", _inspect)
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.examineContent()
+		assert([] == inspected)
+		with d.openChild("JPG_file.jpg") as f:
+			f.addAnnotation("jdoe", Property("key", "value"))
+		d.examineContent()
+		assert(["JPG_file.jpg"] == inspected)
+		assert(
+		    {
+		        ("sambrose", "Property"): QiDataSet.AnnotationStatus.PARTIAL,
+		        ("jdoe", "Property"): QiDataSet.AnnotationStatus.PARTIAL
+		    } == d.annotations_available
+		)
+
+	# A file replaced with the same size and times is examined again
+	path = os.path.join(folder_with_annotations, "WAV_file.wav")
+	stat = os.stat(path)
+	shutil.copyfile(path, path + ".tmp")
+	os.rename(path + ".tmp", path)
+	os.utime(path, (stat.st_atime, stat.st_mtime))
+	del inspected[:]
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.examineContent()
+		assert(["WAV_file.wav"] == inspected)
+
+def test_bulk_annotation(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "r") as d:
+		with pytest.raises(ReadOnlyException):
+			d.bulkAnnotate(dict(), "jdoe")
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		failures = d.bulkAnnotate(
+		    {
+		        "JPG_file.jpg": [
+		            (Property("key", "value"), [[0,0],[10,10]]),
+		            (Property("key", "value2"), None)
+		        ],
+		        "Annotated_JPG_file.jpg": [
+		            (Property("key", "value"), None),
+		            (Property("key", "value"), 5)
+		        ],
+		        "WAV_file.wav": [(Property("key", "value"), [0,10])],
+		        "Unknown_file.jpg": [(Property("key", "value"), None)],
+		    },
+		    "jdoe",
+		    workers=2
+		)
+		assert(
+		    set(["Annotated_JPG_file.jpg", "Unknown_file.jpg"])\
+		      == set(failures.keys())
+		)
+		assert(isinstance(failures["Unknown_file.jpg"], IOError))
+		assert(
+		    {
+		        ("sambrose", "Property"): QiDataSet.AnnotationStatus.PARTIAL,
+		        ("jdoe", "Property"): QiDataSet.AnnotationStatus.PARTIAL
+		    } == d.annotations_available
+		)
+		with d.openChild("JPG_file.jpg") as f:
+			assert(2 == len(f.getAnnotations("jdoe", "Property")))
+		with d.openChild("Annotated_JPG_file.jpg") as f:
+			assert([] == f.getAnnotations("jdoe"))
+
 def test_annotation_status(folder_with_annotations):
 	with QiDataSet(folder_with_annotations, "w") as d:
 		assert(
@@ -229,6 +412,15 @@ def test_dataset_filter(folder_with_annotations,
 	                      only_total_annotations=True
 	                     )
 	)
+	assert(
+	[
+	  folder_with_annotations,
+	  dataset_with_new_annotations
+	] == QiDataSet.filter(dataset_lists,
+	                      only_annotated_by=["sambrose"],
+	                      workers=2
+	                     )
+	)
 
 def test_data_type_change_impact(folder_with_non_annotated_files):
 	with QiDataSet(folder_with_non_annotated_files, "w") as d:
@@ -405,6 +597,72 @@ def test_data_stream(folder_with_annotations):
 		    } == d.getAllStreams()
 		)
 
+def test_data_stream_time_queries(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		imgs = d.getAllFilesOfType("IMAGE")
+		d.createNewStream("cam2d", zip([(1,0),(0,500000000)],imgs))
+		d.addToStream("cam2d", ((2,0),"JPG_file.jpg"))
+
+		assert(
+		    [
+		        ((0,500000000), "JPG_file.jpg"),
+		        ((1,0), "Annotated_JPG_file.jpg"),
+		        ((2,0), "JPG_file.jpg")
+		    ] == list(d.iterStream("cam2d"))
+		)
+		assert(
+		    [
+		        ((0,500000000), "JPG_file.jpg"),
+		        ((1,0), "Annotated_JPG_file.jpg")
+		    ] == d.getStreamRange("cam2d", (0,0), (1,0))
+		)
+		assert([] == d.getStreamRange("cam2d", (3,0), (4,0)))
+		assert(
+		    ((1,0), "Annotated_JPG_file.jpg") == d.getNearest("cam2d", (1,200))
+		)
+		assert(((2,0), "JPG_file.jpg") == d.getNearest("cam2d", (9,0)))
+		assert(None == d.getNearest("cam2d", (9,0), tolerance=(1,0)))
+		with pytest.raises(KeyError):
+			d.getNearest("camxd", (0,0))
+
+	with QiDataSet(folder_with_annotations, "r") as d:
+		assert(
+		    ((0,500000000), "JPG_file.jpg") == d.getNearest("cam2d", (0,0))
+		)
+
+def test_data_stream_alignment(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.createNewStream("cam", [((0,0),"JPG_file.jpg"),
+		                          ((1,0),"Annotated_JPG_file.jpg")])
+		d.createNewStream("audio", [((0,600000000),"WAV_file.wav")])
+
+		assert(
+		    [
+		        ("JPG_file.jpg", "WAV_file.wav"),
+		        ("Annotated_JPG_file.jpg", "WAV_file.wav")
+		    ] == d.alignStreams("cam", ["audio"])
+		)
+		assert(
+		    [
+		        ("JPG_file.jpg", None),
+		        ("Annotated_JPG_file.jpg", "WAV_file.wav")
+		    ] == d.alignStreams("cam", ["audio"], direction="backward")
+		)
+		assert(
+		    [
+		        ("JPG_file.jpg", None),
+		        ("Annotated_JPG_file.jpg", "WAV_file.wav")
+		    ] == d.alignStreams("cam", ["audio"], tolerance=(0,500000000))
+		)
+		aligned = d.alignStreams("audio", ["cam"], as_array=True)
+		assert([600000000] == list(aligned["timestamp"]))
+		assert(["WAV_file.wav"] == list(aligned["audio"]))
+		assert(["Annotated_JPG_file.jpg"] == list(aligned["cam"]))
+		with pytest.raises(ValueError):
+			d.alignStreams("cam", ["audio"], direction="sideways")
+		with pytest.raises(KeyError):
+			d.alignStreams("cam", ["depth"])
+
 def test_data_frame(folder_with_annotations):
 	with QiDataSet(folder_with_annotations, "w") as d:
 		assert([] == d.getAllFrames())
@@ -473,6 +731,64 @@ def test_data_frame(folder_with_annotations):
 	with QiDataSet(folder_with_annotations, "r") as d:
 		assert([] == d.getAllFrames())
 
+def test_lazy_frame_loading(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.createNewFrame("JPG_file.jpg", "WAV_file.wav")\
+		 .addAnnotation("jdoe", Property("key", "value"))
+		d.createNewFrame("Annotated_JPG_file.jpg", "WAV_file.wav")
+
+	with QiDataSet(folder_with_annotations, "r") as d:
+		assert(dict() == d._loaded_frames)
+		_f = d.getFrame("WAV_file.wav", "JPG_file.jpg")
+		assert(1 == len(d._loaded_frames))
+		assert(_f.closed)
+		assert(set(["JPG_file.jpg", "WAV_file.wav"]) == _f.files)
+		assert(["jdoe"] == _f.annotators)
+		assert(None == d.getFrame("JPG_file.jpg", "Annotated_JPG_file.jpg"))
+		assert(2 == len(d.getAllFrames()))
+		assert(_f in d.getAllFrames())
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.examineContent()
+		assert(dict() == d._loaded_frames)
+		assert(
+		    {
+		        ("sambrose", "Property"): QiDataSet.AnnotationStatus.PARTIAL,
+		        ("jdoe", "Property"): QiDataSet.AnnotationStatus.PARTIAL
+		    } == d.annotations_available
+		)
+
+def test_frames_do_not_keep_file_handles(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		for i in range(50):
+			d.createNewFrame("JPG_file.jpg", "WAV_file.wav")\
+			 .addAnnotation("jdoe", Property("key", str(i)))
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		fd_folder = "/proc/self/fd"
+		if os.path.isdir(fd_folder):
+			open_files = len(os.listdir(fd_folder))
+		frames = d.getAllFrames()
+		assert(50 == len(frames))
+		if os.path.isdir(fd_folder):
+			assert(open_files >= len(os.listdir(fd_folder)))
+		for frame in frames:
+			assert(not frame.closed)
+			assert(frame._xmp_file is None)
+			assert(1 == len(frame.annotations["jdoe"]["Property"]))
+			frame.addAnnotation("sambrose", Property("key", "value"))
+		assert(frames[0]._xmp_file is None)
+
+	with QiDataSet(folder_with_annotations, "r") as d:
+		frames = d.getAllFrames()
+		assert(
+		  set([str(i) for i in range(50)])
+		    == set([f.annotations["jdoe"]["Property"][0][0].value
+		              for f in frames])
+		)
+		for frame in frames:
+			assert(["jdoe", "sambrose"] == sorted(frame.annotators))
+
 def test_dataset_context(folder_with_annotations):
 	with QiDataSet(folder_with_annotations, "w") as _ds:
 		_ds.context.recorder_names = ["sambrose"]
@@ -489,4 +805,338 @@ def test_dataset_context(folder_with_annotations):
 		_ds.context = c
 
 	with QiDataSet(folder_with_annotations, "r") as _ds:
-		_ds.context.recorder_names = []
\ No newline at end of file
+		_ds.context.recorder_names = []
+
+def test_annotation_index(folder_with_annotations, monkeypatch):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		with pytest.raises(IOError):
+			d.query()
+		d.buildIndex()
+		assert(
+		    [
+		        ("Annotated_JPG_file.jpg", "sambrose", "Property", None)
+		    ] == d.query(annotator="sambrose")
+		)
+		with d.openChild("JPG_file.jpg") as f:
+			f.addAnnotation("jdoe", Property("key", "other"), [[0,0],[5,5]])
+		assert(
+		    [
+		        ("JPG_file.jpg", "jdoe", "Property", [[0,0],[5,5]])
+		    ] == d.query(metadata_type="Property",
+		                 attributes={"value":"other"})
+		)
+		assert([] == d.query(annotator="jdoe", metadata_type="Person"))
+		assert(2 == len(d.query(attributes={"key":"key"})))
+
+		# Files annotated in bulk do not write the index concurrently
+		def _updateIndexOf(file_path, annotations):
+			raise AssertionError("%s updated the index"%file_path)
+		monkeypatch.setattr(_annotation_index, "updateIndexOf", _updateIndexOf)
+		assert(
+		  dict() == d.bulkAnnotate(
+		              {
+		                "JPG_file.jpg": [(Property("key", "bulk"), None)],
+		                "WAV_file.wav": [(Property("key", "bulk"), None)],
+		              },
+		              "jsmith",
+		              workers=2
+		            )
+		)
+		assert(
+		    ["JPG_file.jpg", "WAV_file.wav"]\
+		      == [row[0] for row in d.query(annotator="jsmith")]
+		)
+
+		# Files which left the dataset are not returned anymore, and they are
+		# removed from the index when it is built again
+		os.remove(os.path.join(folder_with_annotations, "WAV_file.wav"))
+		d.refresh()
+		assert(
+		    ["JPG_file.jpg"]\
+		      == [row[0] for row in d.query(annotator="jsmith")]
+		)
+		d.buildIndex()
+		with _annotation_index.AnnotationIndex(folder_with_annotations) as index:
+			assert(["JPG_file.jpg"]\
+			         == [row[0] for row in index.query(annotator="jsmith")])
+
+	# Read-only datasets search the index without modifying it
+	index_path = _annotation_index.indexPath(folder_with_annotations)
+	os.utime(index_path, (0, 0))
+	with QiDataSet(folder_with_annotations, "r") as d:
+		assert(1 == len(d.query(annotator="jsmith")))
+	assert(0 == os.path.getmtime(index_path))
+	with _annotation_index.AnnotationIndex(folder_with_annotations,
+	                                       read_only=True) as index:
+		with pytest.raises(sqlite3.OperationalError):
+			index.setFileAnnotations("JPG_file.jpg", [])
+
+def test_unmodified_dataset_is_not_written(folder_with_annotations):
+	with QiDataSet(folder_with_annotations, "w") as d:
+		pass
+	metadata_path = os.path.join(folder_with_annotations, "metadata.xmp")
+	manifest_path = os.path.join(folder_with_annotations, "metadata.manifest")
+	os.utime(metadata_path, (0, 0))
+	os.utime(manifest_path, (0, 0))
+
+	qidatafile.resetWriteStatistics()
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.examineContent()
+		d.getAllFrames()
+	assert(0 == os.path.getmtime(metadata_path))
+	assert(0 == os.path.getmtime(manifest_path))
+	assert(dict(written=0, skipped=1) == qidatafile.getWriteStatistics())
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.context.recorder_names = ["jdoe"]
+	assert(0 != os.path.getmtime(metadata_path))
+	assert(dict(written=1, skipped=1) == qidatafile.getWriteStatistics())
+	with QiDataSet(folder_with_annotations, "r") as d:
+		assert(["jdoe"] == d.context.recorder_names)
+
+def test_group_commit(folder_with_annotations, monkeypatch):
+	synchronized = []
+	monkeypatch.setattr(_atomic_write, "_syncDirectory", synchronized.append)
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		with d.groupCommit():
+			for name in ["JPG_file.jpg", "WAV_file.wav"]:
+				with d.openChild(name) as f:
+					f.addAnnotation("jdoe", Property("key", "value"))
+			assert([] == synchronized)
+		assert([os.path.abspath(folder_with_annotations)] == synchronized)
+
+		# Outside of a group, each write synchronizes the folder
+		with d.openChild("JPG_file.jpg") as f:
+			f.addAnnotation("jdoe", Property("key", "value2"))
+		assert(2 == len(synchronized))
+
+	with QiDataSet(folder_with_annotations, "r") as d:
+		with d.openChild("WAV_file.wav") as f:
+			assert([[Property("key", "value"), None]] == f.getAnnotations("jdoe"))
+
+def test_consolidated_store(folder_with_annotations):
+	a = Property("key", "value")
+	with QiDataSet(folder_with_annotations, "w") as d:
+		with d.openChild("JPG_file.jpg") as f:
+			f.addAnnotation("jdoe", a, [[0,0],[10,10]])
+		d.createNewFrame("JPG_file.jpg", "WAV_file.wav").addAnnotation(
+		    "jdoe", a, None
+		)
+	with QiDataSet(folder_with_annotations, "r") as d:
+		with d.openChild("Annotated_JPG_file.jpg") as f:
+			expected_annotations = f.annotations
+
+	with QiDataSet(folder_with_annotations, "r") as d:
+		with pytest.raises(ReadOnlyException):
+			d.consolidate()
+
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.consolidate()
+		assert(d.consolidated)
+	content = os.listdir(folder_with_annotations)
+	assert("metadata.store" in content)
+	assert([] == [name for name in content if name.endswith(".xmp")\
+	                                        and name != "metadata.xmp"])
+
+	# Files and frames are served from the store
+	with QiDataSet(folder_with_annotations, "w") as d:
+		with d.openChild("JPG_file.jpg") as f:
+			assert(DataType.IMAGE == f.type)
+			assert([[a, [[0,0],[10,10]]]] == f.getAnnotations("jdoe"))
+			f.addAnnotation("jdoe", a, None)
+		with d.openChild("Annotated_JPG_file.jpg") as f:
+			assert(expected_annotations == f.annotations)
+		frame = d.getFrame("JPG_file.jpg", "WAV_file.wav")
+		assert([[a, None]] == frame.getAnnotations("jdoe"))
+		d.examineContent()
+		assert(set([("jdoe", "Property"), ("sambrose", "Property")])\
+		         == set(d.annotations_available.keys()))
+	assert(not os.path.exists(
+	         os.path.join(folder_with_annotations, "JPG_file.jpg.xmp")
+	       ))
+
+	# Entries are read and written through the same connection, and each
+	# write gives them a new revision
+	store = _consolidated_store.sharedStore(folder_with_annotations)
+	revisions = store.revisions()
+	with qidata.open(
+	       os.path.join(folder_with_annotations, "WAV_file.wav"), "w"
+	     ) as f:
+		f.addAnnotation("jdoe", a, None)
+	assert(store is _consolidated_store.sharedStore(folder_with_annotations))
+	assert(max(revisions.values()) < store.revisions()["WAV_file.wav"])
+
+	# And they can be written back in XMP files
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.unconsolidate()
+		assert(not d.consolidated)
+	assert(not os.path.exists(
+	         os.path.join(folder_with_annotations, "metadata.store")
+	       ))
+	with QiDataSet(folder_with_annotations, "r") as d:
+		with d.openChild("JPG_file.jpg") as f:
+			assert(2 == len(f.getAnnotations("jdoe")))
+		with d.openChild("Annotated_JPG_file.jpg") as f:
+			assert(expected_annotations == f.annotations)
+		assert(1 == len(d.getAllFrames()))
+
+def test_box_export(folder_with_annotations, tmpdir):
+	bundle_path = os.path.join(str(tmpdir), "boxes")
+	with QiDataSet(folder_with_annotations, "w") as d:
+		with d.openChild("JPG_file.jpg") as f:
+			f.addAnnotation("jdoe", Property("key", "1.5"), [[0,0],[10,20]])
+			f.addAnnotation("jdoe", Property("other", "2"), [[5,5],[6,7]])
+			f.addAnnotation("jdoe", Property("key", "value"), None)
+		with d.openChild("WAV_file.wav") as f:
+			f.addAnnotation("jdoe", Property("key", "value"), [0,1])
+	with QiDataSet(folder_with_annotations, "r") as d:
+		d.exportBoxes(bundle_path, attributes=["key", "value", "missing"])
+		names = d.children
+
+	bundle = qidataset.loadBoxes(bundle_path)
+	assert(names == bundle.files)
+	assert(["jdoe"] == bundle.annotators)
+	assert(["Property"] == bundle.metadata_types)
+	assert(2 == len(bundle))
+	assert(["JPG_file.jpg"]*2 == [bundle.files[i] for i in bundle["file_index"]])
+	assert([0, 5] == list(bundle["x0"]))
+	assert([20, 7] == list(bundle["y1"]))
+	assert(["key", "other"] == bundle.categories("key"))
+	assert([0, 1] == list(bundle["key"]))
+	assert(None == bundle.categories("value"))
+	assert([1.5, 2.] == list(bundle["value"]))
+	assert(all(numpy.isnan(bundle["missing"])))
+
+def test_child_cache(folder_with_annotations):
+	a = Property("key", "value")
+	with QiDataSet(folder_with_annotations, "r", cache_size=1) as d:
+		with d.openChild("JPG_file.jpg") as f:
+			pass
+		assert(not f.closed)
+		assert(f is d.openChild("JPG_file.jpg"))
+		g = d.openChild("WAV_file.wav")
+		assert(f.closed)
+		assert(dict(hits=1, misses=2, evictions=1, size=1)\
+		         == d.child_cache_statistics)
+	assert(g.closed)
+
+	# Writable children are not cached, they are written when closed
+	with QiDataSet(folder_with_annotations, "w", cache_size=2) as d:
+		with d.openChild("JPG_file.jpg") as f:
+			f.addAnnotation("jdoe", a, None)
+		assert(f.closed)
+		assert(os.path.exists(
+		         os.path.join(folder_with_annotations, "JPG_file.jpg.xmp")
+		       ))
+		with d.openChild("JPG_file.jpg") as g:
+			assert(f is not g)
+			assert([[a, None]] == g.getAnnotations("jdoe"))
+		assert(dict(hits=0, misses=0, evictions=0, size=0)\
+		         == d.child_cache_statistics)
+
+	# Changes made on disk invalidate the cached child
+	with QiDataSet(folder_with_annotations, "r", cache_size=2) as d:
+		f = d.openChild("JPG_file.jpg")
+		with qidata.open(
+		       os.path.join(folder_with_annotations, "JPG_file.jpg"), "w"
+		     ) as _f:
+			_f.addAnnotation("sambrose", a, None)
+		stat = os.stat(os.path.join(folder_with_annotations, "JPG_file.jpg.xmp"))
+		os.utime(
+		  os.path.join(folder_with_annotations, "JPG_file.jpg.xmp"),
+		  (stat.st_atime, stat.st_mtime + 10)
+		)
+		g = d.openChild("JPG_file.jpg")
+		assert(f is not g and f.closed)
+		assert([[a, None]] == g.getAnnotations("sambrose"))
+
+def test_child_cache_external_changes(folder_with_annotations):
+	a = Property("key", "value")
+	path = os.path.join(folder_with_annotations, "JPG_file.jpg")
+	store_path = _consolidated_store.storePath(folder_with_annotations)
+	with QiDataSet(folder_with_annotations, "w") as d:
+		d.consolidate()
+
+	# Writable children are not cached: writing another entry of the
+	# consolidated store meanwhile does not lose their modifications
+	with QiDataSet(folder_with_annotations, "w", cache_size=2) as d:
+		f = d.openChild("JPG_file.jpg")
+		f.addAnnotation("jdoe", a, None)
+		with d.openChild("WAV_file.wav") as _f:
+			_f.addAnnotation("sambrose", a, None)
+		stat = os.stat(store_path)
+		os.utime(store_path, (stat.st_atime, stat.st_mtime + 10))
+		f.close()
+	with QiDataSet(folder_with_annotations, "r") as d:
+		with d.openChild("JPG_file.jpg") as _f:
+			assert(["jdoe"] == _f.annotators)
+		with d.openChild("WAV_file.wav") as _f:
+			assert(["sambrose"] == _f.annotators)
+
+	# Read-only children are dropped when the store changes, and opened
+	# again with the new content
+	with QiDataSet(folder_with_annotations, "r", cache_size=2) as d:
+		f = d.openChild("JPG_file.jpg")
+		with qidata.open(path, "w") as _f:
+			_f.addAnnotation("sambrose", a, None)
+		stat = os.stat(store_path)
+		os.utime(store_path, (stat.st_atime, stat.st_mtime + 10))
+		g = d.openChild("JPG_file.jpg")
+		assert(f is not g and f.closed)
+		assert(["jdoe", "sambrose"] == sorted(g.annotators))
+
+def test_background_opening(folder_with_annotations):
+	result = qidata.openAsync(
+	           os.path.join(folder_with_annotations, "Annotated_JPG_file.jpg")
+	         )
+	with result.get() as f:
+		assert(["sambrose"] == f.annotators)
+
+	opener = qidata._background.BackgroundOpener(max_concurrent_opens=2)
+	try:
+		with qidata.AsyncQiDataSet.open(folder_with_annotations, "w",
+		                                opener=opener).get() as d:
+			assert(isinstance(d.dataset, QiDataSet))
+			imgs = d.dataset.getAllFilesOfType("IMAGE")
+			d.dataset.createNewStream("cam", zip([(0,0),(1,0)], imgs))
+
+			names = []
+			for name, result in d.iterChildren(prefetch=1):
+				with result.get() as f:
+					names.append(name)
+					assert(f.name == os.path.join(folder_with_annotations, name))
+			assert(d.dataset.children == names)
+
+			# Nothing is submitted ahead of the current file with prefetch=0
+			submitted = []
+			_open = opener.open
+			def _recordedOpen(path, mode="r"):
+				submitted.append(os.path.basename(path))
+				return _open(path, mode)
+			opener.open = _recordedOpen
+			for i, (name, result) in enumerate(d.iterChildren(prefetch=0)):
+				assert(d.dataset.children[:i+1] == submitted)
+				result.get().close()
+			del submitted[:]
+			for i, (name, result) in enumerate(d.iterChildren(prefetch=1)):
+				assert(d.dataset.children[:i+2] == submitted)
+				result.get().close()
+			del opener.open
+
+			timestamps = []
+			for timestamp, result in d.iterStream("cam"):
+				with result.get() as f:
+					assert(DataType.IMAGE == f.type)
+				timestamps.append(timestamp)
+			assert(2 == len(timestamps))
+
+			with d.openChild("JPG_file.jpg").get() as f:
+				f.addAnnotation("jdoe", Property("key", "value"), None)
+			with pytest.raises(IOError):
+				d.openChild("unknown_file.jpg").get()
+	finally:
+		opener.close()
+	with QiDataSet(folder_with_annotations, "r") as d:
+		with d.openChild("JPG_file.jpg") as f:
+			assert(["jdoe"] == f.annotators)
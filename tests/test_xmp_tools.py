@@ -26,11 +26,22 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+# Standard libraries
+import glob
+import os
+
 # Third-party libraries
 import pytest
+from xmp.xmp import XMPFile
 
 # Local modules
 from qidata import _mixin as xmp_tools
+from qidata.qidataframe import QIDATA_FRAME_NS
+from qidata.qidataset import QIDATA_CONTENT_NS
+from qidata.qidatasensorfile import QIDATA_SENSOR_NS
+
+# Test
+import conftest
 
 def test_unicode_conversion():
 
@@ -50,4 +61,97 @@ def test_unicode_conversion():
 	assert(data == ["a", [1, 2.0]])
 
 	with pytest.raises(TypeError):
-		xmp_tools._unicodeToBuiltInType([])
\ No newline at end of file
+		xmp_tools._unicodeToBuiltInType([])
+
+def test_xmp_properties_reading(jpg_with_external_annotations):
+	data = xmp_tools._readXMPProperties(
+	           jpg_with_external_annotations + ".xmp",
+	           xmp_tools.QIDATA_NS,
+	           ["sambrose"]
+	       )
+	assert(
+	  {
+	    "sambrose":{
+	      "Property":[
+	        {"info":{"key":"key", "value":"value", "version":"0.1"}}
+	      ]
+	    }
+	  } == data
+	)
+	assert(
+	  {} == xmp_tools._readXMPProperties(
+	           jpg_with_external_annotations + ".xmp",
+	           xmp_tools.QIDATA_NS,
+	           ["jdoe"]
+	       )
+	)
+	assert(
+	  None == xmp_tools._readXMPProperties(
+	           jpg_with_external_annotations + ".xmp",
+	           u"http://softbank-robotics.com/qidataset/1",
+	           ["annotation_content"]
+	       )
+	)
+
+	# Nested descriptions are structures, not top-level properties
+	data = xmp_tools._readXMPProperties(
+	           os.path.join(conftest.DATA_FOLDER, "nested_descriptions.xmp"),
+	           xmp_tools.QIDATA_NS,
+	           ["jdoe", "sambrose"]
+	       )
+	assert(
+	  {
+	    "jdoe":{
+	      "Property":[
+	        {"info":{"version":"0.1", "key":"key", "value":"value"}}
+	      ]
+	    },
+	    "sambrose":{
+	      "Property":[
+	        {"info":{"key":"other_key", "value":"other_value", "version":"0.1"}}
+	      ]
+	    }
+	  } == data
+	)
+	assert(
+	  {} == xmp_tools._readXMPProperties(
+	           os.path.join(conftest.DATA_FOLDER, "nested_descriptions.xmp"),
+	           xmp_tools.QIDATA_NS,
+	           ["Property", "info", "key", "version"]
+	       )
+	)
+
+@pytest.mark.parametrize("xmp_path",
+	[
+		"JPG_with_external_annotations.jpg.xmp",
+		"dataset_annotated/metadata.xmp",
+		"Michal_Asus_2016-02-19-15-25-46/metadata.xmp",
+		"nested_descriptions.xmp",
+	] + [
+		os.path.relpath(path, conftest.DATA_FOLDER)
+		  for path in glob.glob(
+		    os.path.join(conftest.DATA_FOLDER, "*/*.frame.xmp")
+		  )[:3]
+	]
+)
+def test_sidecar_reader(xmp_path):
+	xmp_path = os.path.join(conftest.DATA_FOLDER, xmp_path)
+	with XMPFile(xmp_path) as toolkit_file:
+		with xmp_tools.XMPSidecarReader(xmp_path) as fast_file:
+			for ns in [xmp_tools.QIDATA_NS,
+			           QIDATA_SENSOR_NS,
+			           QIDATA_FRAME_NS,
+			           QIDATA_CONTENT_NS]:
+				assert(
+				  bool(toolkit_file.metadata[ns].children)
+				    == bool(fast_file.metadata[ns].children)
+				)
+				if toolkit_file.metadata[ns].children:
+					assert(
+					  xmp_tools._namespaceValue(toolkit_file.metadata[ns])
+					    == xmp_tools._namespaceValue(fast_file.metadata[ns])
+					)
+			assert(
+			  xmp_tools._load_annotations(toolkit_file)
+			    == xmp_tools._load_annotations(fast_file)
+			)